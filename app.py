@@ -99,91 +99,242 @@
 #         """)
 
 
+import time
+
 import streamlit as st
+
+# === UI CONFIG ===
+# Set first so the page shell renders before the Gemini/Firestore clients load
+st.set_page_config(page_title="AgriDoc Enterprise", layout="wide", page_icon="🌾")
+
 from PIL import Image
-import io
+import pandas as pd
 from src.config import Config
-from src.agent import PlantDoctorAgent
-from src.database import OutbreakRegistry
-from fpdf import FPDF
+from src import resources, telemetry
+from src.jobs import QueueFullError
+from src.preprocess import preprocess_image
+from src.report import pdf_bytes, pdf_name, render_zip
+from src.tiling import analyze_tiled
+
+# === SHARED RESOURCES (one agent, registry and storage client per process) ===
+@st.cache_resource
+def load_resources():
+    telemetry.start_log_exporter()
+    agent = resources.get_agent()
+    resources.start_knowledge_warmup()
+    return agent, resources.get_registry()
+
+# === MAIN LAYOUT ===
+st.title("🌾 AgriDoc: Intelligent Plant Pathology Agent")
+status_slot = st.empty()
 
 # Initialize Config
 try:
     Config.validate()
-    agent = PlantDoctorAgent()
-    registry = OutbreakRegistry()
+    with st.spinner("Starting AI agent..."):
+        agent, registry = load_resources()
     status_msg = "System Online 🟢 | AI Agent Active"
 except Exception as e:
     st.error(f"System Init Failure: {e}")
     status_msg = "System Offline 🔴"
+status_slot.caption(status_msg)
 
-# === UI CONFIG ===
-st.set_page_config(page_title="AgriDoc Enterprise", layout="wide", page_icon="🌾")
-
-# === PDF HELPER ===
-def create_pdf(diagnosis_text):
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size=12)
-    # Handling unicode/emoji in PDFs is tricky, so we keep it simple for hackathon
-    clean_text = diagnosis_text.encode('latin-1', 'replace').decode('latin-1') 
-    pdf.multi_cell(0, 10, clean_text)
-    return pdf.output(dest="S").encode("latin-1")
+@st.cache_data(ttl=Config.MONITOR_REFRESH_SECONDS)
+def load_totals(dimension):
+    # Served from sharded counters on Firestore: O(shards) reads, no collection scan
+    return resources.get_registry().get_totals(dimension)
 
 # === SIDEBAR ===
 with st.sidebar:
     st.image("https://www.gstatic.com/images/branding/product/2x/google_cloud_64dp.png", width=50)
     st.title("Control Center")
     st.markdown("### 🛡️ Outbreak Monitor")
-    stats = registry.get_recent_stats()
+    monitor = resources.get_monitor()
+    if st.button("🔄 Refresh", key="refresh_monitor"):
+        monitor.refresh()
+    stats = monitor.recent_stats(limit=5)
     if stats:
         st.dataframe(stats)
     else:
         st.info("No active outbreaks logged.")
-    
+    age = monitor.snapshot_age()
+    st.caption(f"Snapshot age: {age:.0f}s" if age is not None else "Snapshot unavailable")
+
+    totals = load_totals("disease")
+    if totals:
+        st.caption(f"All-time outbreaks: {sum(totals.values())}")
+        st.dataframe(pd.Series(totals, name="Outbreaks").sort_values(ascending=False).head(5))
+
+    with st.expander("📈 Outbreak Analytics"):
+        analytics = resources.get_analytics()
+        analytics.maybe_refresh()
+        for spike in analytics.spikes(by="disease"):
+            st.warning(f"⚠️ Spike: {spike['disease']} — {spike['today']} today vs {spike['baseline']}/day")
+
+        weekly = analytics.counts(by="disease", period="week", since_days=56)
+        if weekly:
+            st.caption("Weekly incidents per disease (8 weeks)")
+            st.bar_chart(pd.DataFrame(weekly).pivot_table(
+                index="period", columns="disease", values="count", fill_value=0
+            ))
+            st.caption("Severity (30 days)")
+            st.bar_chart(pd.Series(analytics.severity_histogram(since_days=30)))
+            hotspots = analytics.geohash_counts(precision=5, since_days=30)
+            if hotspots:
+                st.caption("Hotspots (geohash cells, 30 days)")
+                st.dataframe(pd.Series(hotspots, name="Incidents").sort_values(ascending=False).head(10))
+        else:
+            st.info("No incidents to analyze yet.")
+
     st.markdown("---")
     st.caption(f"Agent: {Config.MODEL_NAME}")
+    if 'agent' in globals():
+        degraded = [name for name, state in agent.models.stats().items() if state["circuit"] != "closed"]
+        if degraded:
+            st.caption(f"⚠️ Degraded (circuit open): {', '.join(degraded)}")
+    if Config.JOB_QUEUE_ENABLED:
+        queue_stats = resources.get_job_queue().metrics()
+        st.caption(f"Queue: {queue_stats['depth']} waiting · {queue_stats['running']}/{queue_stats['workers']} workers busy")
     # Capture language selection
-    language = st.sidebar.selectbox("Select Language", ["English", "Hindi", "Spanish", "Telugu"])
-
-# === MAIN LAYOUT ===
-st.title("🌾 AgriDoc: Intelligent Plant Pathology Agent")
-st.caption(status_msg)
+    language = st.sidebar.selectbox("Select Language", Config.LANGUAGES)
 
 col1, col2 = st.columns([4, 6])
 
+with col2:
+    st.markdown("### 2. Agent Report")
+    # Streamed diagnoses render here while they arrive
+    live_report = st.empty()
+
 with col1:
     st.markdown("### 1. Visual Input")
-    uploaded_file = st.file_uploader("Upload Field Sample", type=["jpg", "jpeg", "png"])
-    
+    mode = st.radio("Mode", ["Single Sample", "Batch (Field Visit)", "Tiled (Drone / Field)"], horizontal=True)
+
+    if mode == "Single Sample":
+        uploaded_file = st.file_uploader("Upload Field Sample", type=["jpg", "jpeg", "png"])
+    elif mode == "Tiled (Drone / Field)":
+        uploaded_file = None
+        # Full-resolution image: it is tiled instead of downscaled, so small lesions stay visible
+        field_file = st.file_uploader("Upload Drone / Field Image", type=["jpg", "jpeg", "png"])
+        if field_file:
+            st.image(field_file, caption="Field Preview", use_container_width=True)
+            if st.button("🛰️ Analyze Tiles", type="primary"):
+                try:
+                    with st.spinner(f"Agent is analyzing tiles in {language}..."):
+                        tiled = analyze_tiled(agent, field_file.getvalue(), language)
+                    st.session_state['result'] = tiled.report
+                    st.session_state['logged'] = tiled.logged
+                    st.session_state['result_language'] = language
+                    st.session_state['tile_overlay'] = tiled.overlay
+                    st.session_state.pop('batch_results', None)
+                except Exception as e:
+                    st.error(f"Agent Execution Failed: {e}")
+    else:
+        uploaded_file = None
+        uploaded_files = st.file_uploader("Upload Field Samples", type=["jpg", "jpeg", "png"], accept_multiple_files=True)
+
+        if uploaded_files and st.button(f"🚀 Analyze {len(uploaded_files)} Samples", type="primary"):
+            # A file that can't be decoded gets its own error row; the rest of the batch still runs
+            names, images, rows = [], [], []
+            for f in uploaded_files:
+                try:
+                    images.append(preprocess_image(f.getvalue()))
+                    names.append(f.name)
+                except Exception as e:
+                    rows.append({"File": f.name, "Status": "❌ Error", "Diagnosis": f"Unreadable image: {e}"})
+            progress = st.progress(len(rows) / len(uploaded_files), text=f"Agent is analyzing in {language}...")
+            live_table = st.empty()
+            if rows:
+                live_table.dataframe(rows, use_container_width=True)
+            for item in agent.analyze_many(images, language):
+                rows.append({
+                    "File": names[item.index],
+                    "Status": "❌ Error" if item.error else ("🚨 Logged" if item.logged else "✅ OK"),
+                    "Diagnosis": item.error or item.diagnosis,
+                })
+                progress.progress(len(rows) / len(uploaded_files), text=f"{len(rows)}/{len(uploaded_files)} analyzed")
+                live_table.dataframe(rows, use_container_width=True)
+            st.session_state['batch_results'] = rows
+            st.session_state['batch_language'] = language
+            st.session_state.pop('result', None)
+
     if uploaded_file:
             image = Image.open(uploaded_file)
             st.image(image, caption="Sample Preview", use_container_width=True)
-            
+
+            # Near-duplicate check against samples we already diagnosed. The index holds
+            # hashes of preprocessed images, so hash the same bytes; once per upload, not per rerun
+            cached = st.session_state.get('upload_cache')
+            if cached is None or cached['file_id'] != uploaded_file.file_id:
+                processed = preprocess_image(uploaded_file.getvalue())
+                cached = {
+                    'file_id': uploaded_file.file_id,
+                    'img_bytes': processed,
+                    'duplicate': agent.find_near_duplicate(processed),
+                }
+                st.session_state['upload_cache'] = cached
+            duplicate = cached['duplicate']
+            if duplicate:
+                if Config.PHASH_MODE == "reuse":
+                    st.warning(f"🔁 Near-duplicate of an earlier sample (distance {duplicate[1]}). The earlier diagnosis will be reused.")
+                else:
+                    st.warning(f"🔁 Near-duplicate of an earlier sample (distance {duplicate[1]}).")
+
             # Process
-            if st.button("🚀 Initialize Agent Analysis", type="primary"):
-                with st.spinner(f"Agent is analyzing in {language}..."):
-                    img_byte_arr = io.BytesIO()
-                    
-                    # Handle PNG transparency
-                    if image.mode in ("RGBA", "P"):
-                        image = image.convert("RGB")
-                    
-                    image.save(img_byte_arr, format='JPEG')
-                    img_bytes = img_byte_arr.getvalue()
-                    
-                    # CALL THE AGENT (PASSING THE LANGUAGE NOW)
-                    try:
-                        # === FIX: Passing 'language' variable ===
-                        diagnosis, logged = agent.analyze_and_act(img_bytes, language)
-                        st.session_state['result'] = diagnosis
-                        st.session_state['logged'] = logged
-                    except Exception as e:
-                        st.error(f"Agent Execution Failed: {e}")
+            analyze = st.button("🚀 Initialize Agent Analysis", type="primary")
+            if analyze and Config.JOB_QUEUE_ENABLED:
+                # Hand the raw upload to the worker pool; this session only polls for the result
+                try:
+                    st.session_state['job_id'] = resources.get_job_queue().submit(uploaded_file.getvalue(), language)
+                except QueueFullError as e:
+                    st.warning(f"⏳ The agent is at capacity, please retry shortly. ({e})")
+            elif analyze:
+                # EXIF fix, downscale and re-encode (PNG transparency is flattened here too), done above
+                img_bytes = cached['img_bytes']
+
+                # CALL THE AGENT (PASSING THE LANGUAGE NOW)
+                try:
+                    if Config.STREAM_DIAGNOSIS:
+                        # Text appears as Gemini produces it instead of after the whole call
+                        stream = agent.analyze_and_act_stream(img_bytes, language)
+                        with live_report.container():
+                            st.caption(f"Agent is analyzing in {language}...")
+                            st.write_stream(stream)
+                        diagnosis, logged = stream.text, stream.logged
+                    else:
+                        with st.spinner(f"Agent is analyzing in {language}..."):
+                            diagnosis, logged = agent.analyze_and_act(img_bytes, language)
+                    st.session_state['result'] = diagnosis
+                    st.session_state['logged'] = logged
+                    st.session_state['result_language'] = language
+                    st.session_state.pop('batch_results', None)
+                    st.session_state.pop('tile_overlay', None)
+                    live_report.empty()
+                except Exception as e:
+                    st.error(f"Agent Execution Failed: {e}")
+
+    # Queued diagnosis: poll the job until a worker has finished it
+    if 'job_id' in st.session_state:
+        job = resources.get_job_queue().get(st.session_state['job_id'])
+        if job is not None and job["status"] in ("queued", "running"):
+            if job["status"] == "queued":
+                st.info(f"⏳ Queued (position {job['position']})...")
+            else:
+                st.info(f"🔬 Agent is analyzing in {job['language']}...")
+            time.sleep(1)
+            st.rerun()
+        del st.session_state['job_id']
+        if job is None:
+            st.error("Agent Execution Failed: job not found")
+        elif job["status"] == "done":
+            st.session_state['result'] = job["diagnosis"]
+            st.session_state['logged'] = job["logged"]
+            st.session_state['result_language'] = job["language"]
+            st.session_state.pop('batch_results', None)
+            st.session_state.pop('tile_overlay', None)
+        else:
+            st.error(f"Agent Execution Failed: {job['error']}")
 
 with col2:
-    st.markdown("### 2. Agent Report")
-    
     if 'result' in st.session_state:
         report = st.session_state['result']
         logged = st.session_state['logged']
@@ -194,19 +345,48 @@ with col2:
         else:
             st.info("✅ ANALYSIS COMPLETE: No critical threat requiring database log.")
             
+        if st.session_state.get('tile_overlay') is not None:
+            st.image(st.session_state['tile_overlay'], use_container_width=True,
+                     caption="Disease heatmap: red tiles are affected, dimmed tiles were skipped by the prefilter")
+
         st.markdown("#### Diagnosis & Protocol:")
         st.write(report)
         
         # === PDF BUTTON (Inside the column now) ===
         st.markdown("---")
-        pdf_data = create_pdf(report)
+        report_language = st.session_state.get('result_language', language)
+        # Rendered only when the button is clicked, then served from the report cache
         st.download_button(
             label="📄 Download Prescription (PDF)",
-            data=pdf_data,
+            data=lambda: pdf_bytes(report, report_language),
             file_name="agridoc_prescription.pdf",
             mime="application/pdf"
         )
-        
+
+    elif 'batch_results' in st.session_state:
+        rows = st.session_state['batch_results']
+        logged_count = sum(1 for r in rows if r["Status"] == "🚨 Logged")
+        error_count = sum(1 for r in rows if r["Status"] == "❌ Error")
+
+        m1, m2, m3 = st.columns(3)
+        m1.metric("Samples", len(rows))
+        m2.metric("Outbreaks Logged", logged_count)
+        m3.metric("Errors", error_count)
+
+        st.dataframe(rows, use_container_width=True)
+        batch_language = st.session_state.get('batch_language', language)
+        st.download_button(
+            label="📦 Download All Prescriptions (ZIP)",
+            data=lambda: render_zip(
+                (pdf_name(r["File"]), r["Diagnosis"], batch_language) for r in rows if r["Status"] != "❌ Error"
+            ),
+            file_name="agridoc_prescriptions.zip",
+            mime="application/zip"
+        )
+        for r in rows:
+            with st.expander(f"{r['Status']} {r['File']}"):
+                st.write(r["Diagnosis"])
+
     else:
         st.markdown("""
         *Waiting for input...*
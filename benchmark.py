@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for AgriDoc Enterprise
+
+Usage:
+    python benchmark.py            # run every benchmark
+    python benchmark.py startup    # run one benchmark by name
+
+Set BENCH_IMAGE_DIR to a folder of field photos to benchmark real samples
+(a synthetic 12 MP image is used otherwise), and BENCH_BASELINE_REF to a
+git ref with the old eager imports to include it in the startup
+benchmark. Benchmarks that need Gemini only run when GOOGLE_API_KEY is set.
+"""
+
+import glob
+import io
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _time_in_fresh_interpreter(code, repeat, cwd=ROOT):
+    """Median wall time (ms) of `code` in a new interpreter, so import caches are cold."""
+    timer = (
+        "import time as _t; _s = _t.perf_counter()\n"
+        f"{code}\n"
+        "print((_t.perf_counter() - _s) * 1000)"
+    )
+    samples = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", timer], cwd=cwd, capture_output=True, text=True, check=True
+        )
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+
+def _app_imports(tree):
+    """The module-level import statements of `tree`/app.py, as source."""
+    import ast
+    with open(os.path.join(tree, "app.py"), encoding="utf-8") as f:
+        module = ast.parse(f.read())
+    return "\n".join(ast.unparse(node) for node in module.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def bench_startup(repeat=5):
+    """
+    Import latency of app.py's module-level imports, and of the agent
+    that loads after first paint. With BENCH_BASELINE_REF set to a git
+    ref, the same app.py imports are timed in an export of that tree.
+    """
+    import tempfile
+    print("🧪 Startup latency (median of %d cold interpreters)" % repeat)
+    baseline_ref = os.getenv("BENCH_BASELINE_REF")
+    scenarios = [
+        ("app.py imports", _app_imports(ROOT), ROOT),
+        ("+ agent ready", _app_imports(ROOT) + "\nimport google.generativeai\nimport src.agent", ROOT),
+    ]
+    with tempfile.TemporaryDirectory() as baseline_dir:
+        if baseline_ref:
+            archive = subprocess.run(["git", "archive", baseline_ref], cwd=ROOT, capture_output=True, check=True)
+            subprocess.run(["tar", "-x", "-C", baseline_dir], input=archive.stdout, check=True)
+            scenarios.insert(0, (f"app.py imports @ {baseline_ref[:10]}", _app_imports(baseline_dir), baseline_dir))
+        for label, code, cwd in scenarios:
+            try:
+                ms = _time_in_fresh_interpreter(code, repeat, cwd)
+                print(f"   {label:<28} {ms:8.1f} ms")
+            except subprocess.CalledProcessError as e:
+                print(f"   {label:<28} ❌ {e.stderr.strip().splitlines()[-1]}")
+
+
+def _sample_images():
+    """Field photos from BENCH_IMAGE_DIR, or one synthetic 12 MP leaf-like JPEG."""
+    image_dir = os.getenv("BENCH_IMAGE_DIR")
+    if image_dir:
+        paths = sorted(glob.glob(os.path.join(image_dir, "*.jp*g")) + glob.glob(os.path.join(image_dir, "*.png")))
+        return [(os.path.basename(p), open(p, "rb").read()) for p in paths]
+
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(0)
+    h, w = 3000, 4000
+    y, x = np.mgrid[0:h, 0:w]
+    green = 120 + 60 * np.sin(x / 150.0) * np.cos(y / 200.0)
+    rgb = np.stack([green * 0.5, green, green * 0.3], axis=-1) + rng.normal(0, 12, (h, w, 3))
+    buf = io.BytesIO()
+    Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8)).save(buf, format="JPEG", quality=95)
+    return [("synthetic_12mp.jpg", buf.getvalue())]
+
+
+class _CaptureRegistry:
+    """Registry stand-in that records log_outbreak calls instead of writing them."""
+    def __init__(self):
+        self.calls = []
+
+    def log_incident(self, **kwargs):
+        self.calls.append(kwargs)
+        return "CAPTURED"
+
+
+def bench_preprocess(sizes=(512, 768, 1024, 1536, 2048)):
+    """Bytes sent, preprocessing latency and (with an API key) end-to-end latency and agreement."""
+    from src.preprocess import preprocess_image
+    images = _sample_images()
+    print(f"🧪 Image preprocessing ({len(images)} images)")
+
+    agent = None
+    if os.getenv("GOOGLE_API_KEY"):
+        from src.agent import PlantDoctorAgent
+        agent = PlantDoctorAgent(registry=_CaptureRegistry())
+
+    baseline = {}
+    print(f"   {'max_edge':>8} {'avg KB':>9} {'prep ms':>9} {'e2e ms':>9} {'agree':>7}")
+    for size in (None,) + tuple(sizes):
+        sent, prep_ms, e2e_ms, agree = [], [], [], []
+        for name, data in images:
+            start = time.perf_counter()
+            payload = data if size is None else preprocess_image(data, max_edge=size)
+            prep_ms.append((time.perf_counter() - start) * 1000)
+            sent.append(len(payload))
+
+            if agent is not None:
+                agent.db.calls.clear()
+                start = time.perf_counter()
+                agent._run_analysis(payload, "English")
+                e2e_ms.append((time.perf_counter() - start) * 1000 + prep_ms[-1])
+                finding = tuple((c["plant"], c["disease"]) for c in agent.db.calls)
+                if size is None:
+                    baseline[name] = finding
+                agree.append(finding == baseline.get(name))
+
+        label = "original" if size is None else str(size)
+        e2e = f"{statistics.median(e2e_ms):9.0f}" if e2e_ms else f"{'-':>9}"
+        agreement = f"{100 * sum(agree) / len(agree):6.0f}%" if agree else f"{'-':>7}"
+        print(f"   {label:>8} {statistics.mean(sent) / 1024:9.1f} {statistics.median(prep_ms):9.1f} {e2e} {agreement}")
+
+
+def bench_modes():
+    """A/B of DIAGNOSIS_MODE: single structured call vs tool call + summary call (needs GOOGLE_API_KEY)."""
+    print("🧪 Diagnosis mode A/B")
+    if not os.getenv("GOOGLE_API_KEY"):
+        print("   skipped: GOOGLE_API_KEY not set")
+        return
+    from src.config import Config
+    from src.agent import PlantDoctorAgent
+    from src.preprocess import preprocess_image
+    images = [(name, preprocess_image(data)) for name, data in _sample_images()]
+    agent = PlantDoctorAgent(registry=_CaptureRegistry())
+
+    findings = {}
+    for mode in ("two_call", "single"):
+        Config.DIAGNOSIS_MODE = mode
+        latencies = []
+        for name, payload in images:
+            agent.db.calls.clear()
+            start = time.perf_counter()
+            agent._run_analysis(payload, "English")
+            latencies.append((time.perf_counter() - start) * 1000)
+            findings.setdefault(name, {})[mode] = tuple((c["plant"], c["disease"]) for c in agent.db.calls)
+        print(f"   {mode:<9} p50 {statistics.median(latencies):7.0f} ms   max {max(latencies):7.0f} ms")
+    agree = sum(1 for f in findings.values() if f["single"] == f["two_call"])
+    print(f"   logged-finding agreement: {agree}/{len(findings)}")
+
+
+def bench_stream():
+    """Time-to-first-token: streaming vs blocking analyze_and_act (needs GOOGLE_API_KEY)."""
+    print("🧪 Streaming time-to-first-token")
+    if not os.getenv("GOOGLE_API_KEY"):
+        print("   skipped: GOOGLE_API_KEY not set")
+        return
+    from src.agent import PlantDoctorAgent
+    from src.preprocess import preprocess_image
+    agent = PlantDoctorAgent(registry=_CaptureRegistry())
+    agent.cache.max_entries = 0  # measure Gemini, not the cache
+    agent.phash_index = None
+
+    blocking, first_token, streamed = [], [], []
+    for _, data in _sample_images():
+        payload = preprocess_image(data)
+        agent.cache._memory.clear()
+        start = time.perf_counter()
+        agent.analyze_and_act(payload, "English")
+        blocking.append((time.perf_counter() - start) * 1000)
+
+        agent.cache._memory.clear()
+        start = time.perf_counter()
+        for i, _chunk in enumerate(agent.analyze_and_act_stream(payload, "English")):
+            if i == 0:
+                first_token.append((time.perf_counter() - start) * 1000)
+        streamed.append((time.perf_counter() - start) * 1000)
+    print(f"   blocking full response   p50 {statistics.median(blocking):7.0f} ms")
+    print(f"   streaming first token    p50 {statistics.median(first_token):7.0f} ms")
+    print(f"   streaming full response  p50 {statistics.median(streamed):7.0f} ms")
+
+
+def bench_analytics(n=1_000_000):
+    """Aggregation latency of the analytics snapshot over `n` synthetic incidents."""
+    import datetime
+    import numpy as np
+    from src.analytics import OutbreakAnalytics
+    print(f"🧪 Outbreak analytics ({n:,} incidents)")
+    rng = np.random.default_rng(0)
+    now = datetime.datetime.now()
+    offsets = rng.integers(0, 90 * 86400, n)
+    diseases = ["Early Blight", "Late Blight", "Powdery Mildew", "Rust", "Leaf Spot", "Mosaic Virus"]
+    records = [
+        {"id": str(i), "timestamp": now - datetime.timedelta(seconds=int(offsets[i])),
+         "plant": ("Tomato", "Potato", "Wheat")[i % 3], "disease": diseases[i % len(diseases)],
+         "severity": ("Low", "Medium", "High", "Critical")[i % 4], "confidence": 85.0,
+         "latitude": 17.0 + rng.random(), "longitude": 78.0 + rng.random()}
+        for i in range(n)
+    ]
+    analytics = OutbreakAnalytics()
+    start = time.perf_counter()
+    analytics.append(records)
+    print(f"   initial load             {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+    queries = [
+        ("daily counts / disease", lambda: analytics.counts("disease", "day")),
+        ("weekly counts / plant", lambda: analytics.counts("plant", "week")),
+        ("spike detection", lambda: analytics.spikes()),
+        ("severity histogram", lambda: analytics.severity_histogram()),
+        ("geohash buckets (p5)", lambda: analytics.geohash_counts(5)),
+    ]
+    for label, query in queries:
+        samples = []
+        for _ in range(5):
+            start = time.perf_counter()
+            query()
+            samples.append((time.perf_counter() - start) * 1000)
+        print(f"   {label:<24} {statistics.median(samples):8.1f} ms")
+
+    start = time.perf_counter()
+    analytics.append([dict(records[0], id="incremental", timestamp=now)])
+    print(f"   incremental append (1)   {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+
+def _stub_agent(latency):
+    """Shared PlantDoctorAgent on the local fake model (no cache, no near-dup reuse)."""
+    from src import resources
+    from src.agent import PlantDoctorAgent
+    from src.backends import FakeBackend
+    agent = PlantDoctorAgent(registry=_CaptureRegistry(), backend=FakeBackend(latency=latency))
+    agent.cache.max_entries = 0
+    agent.phash_index = None
+    resources._agent = agent
+    return agent
+
+
+def _distinct_images(n, size=(800, 600)):
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(1)
+    images = []
+    for i in range(n):
+        buf = io.BytesIO()
+        Image.fromarray(rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)).save(buf, format="JPEG")
+        images.append((f"sample_{i:03d}.jpg", buf.getvalue()))
+    return images
+
+
+def bench_api(n=32, clients=8, latency=None):
+    """Throughput of the Streamlit path vs the HTTP API and CLI, against the fake model."""
+    import json
+    import socket
+    import tempfile
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    import requests
+    import uvicorn
+    from streamlit.testing.v1 import AppTest
+    from src.__main__ import diagnose_directory
+    from src.preprocess import preprocess_image
+
+    from src.config import Config
+    Config.GOOGLE_API_KEY = Config.GOOGLE_API_KEY or "stub"
+    Config.STORAGE_BACKEND = "memory"
+    latency = latency if latency is not None else float(os.getenv("BENCH_STUB_LATENCY", "0.2"))
+    agent = _stub_agent(latency)
+    images = _distinct_images(n)
+    print(f"🧪 Throughput, {n} images, fake model latency {latency * 1000:.0f} ms")
+
+    def report(label, seconds):
+        print(f"   {label:<34} {seconds:7.2f} s  {n / seconds:7.1f} img/s")
+
+    # Streamlit: one diagnosis at a time in the session thread, plus a full script rerun per click
+    reruns = []
+    for _ in range(3):
+        start = time.perf_counter()
+        AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60).run()
+        reruns.append(time.perf_counter() - start)
+    rerun = statistics.median(reruns)
+    start = time.perf_counter()
+    for _, data in images:
+        agent.analyze_and_act(preprocess_image(data), "English")
+    report("streamlit session (sequential)", time.perf_counter() - start + rerun * n)
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config("src.api:app", host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("API server failed to start")
+        time.sleep(0.05)
+    url = f"http://127.0.0.1:{port}/diagnose"
+
+    def post_single(item):
+        name, data = item
+        requests.post(url, files={"file": (name, data, "image/jpeg")}).raise_for_status()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(post_single, images))
+    report(f"api POST /diagnose x{clients} clients", time.perf_counter() - start)
+
+    start = time.perf_counter()
+    requests.post(url, files=[("files", (name, data, "image/jpeg")) for name, data in images]).raise_for_status()
+    report("api POST /diagnose batch", time.perf_counter() - start)
+    server.should_exit = True
+    thread.join()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, data in images:
+            with open(os.path.join(directory, name), "wb") as f:
+                f.write(data)
+        out = io.StringIO()
+        start = time.perf_counter()
+        diagnose_directory(directory, out, agent=agent)
+        report("cli diagnose dir/", time.perf_counter() - start)
+        assert len(out.getvalue().splitlines()) == n and json.loads(out.getvalue().splitlines()[0])
+
+
+def _percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return pick(0.50), pick(0.95), pick(0.99)
+
+
+def _stage(label, fn, items, concurrency=1):
+    """Runs fn(item) for every item, printing p50/p95/p99 latency (ms) and throughput."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def timed(item):
+        start = time.perf_counter()
+        fn(item)
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        samples = [timed(item) for item in items]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(timed, items))
+    elapsed = time.perf_counter() - start
+    p50, p95, p99 = _percentiles(samples)
+    print(f"   {label:<30} {p50:9.2f} {p95:9.2f} {p99:9.2f} {len(items) / elapsed:10.1f}")
+
+
+def bench_stages(n=200, latency=0.05):
+    """Offline per-stage latency (p50/p95/p99 ms) and throughput (ops/s) on the fake model."""
+    import datetime
+    import tempfile
+    from src.agent import PlantDoctorAgent
+    from src.backends import FakeBackend
+    from src.config import Config
+    from src.database import OutbreakRegistry
+    from src.preprocess import preprocess_image
+    from src.storage import MemoryStore, SQLiteStore
+
+    print(f"🧪 Hot-path stages ({n} operations each, fake model latency {latency * 1000:.0f} ms)")
+    print(f"   {'stage':<30} {'p50':>9} {'p95':>9} {'p99':>9} {'ops/s':>10}")
+
+    photos = _distinct_images(16, size=(3000, 2000))
+    _stage("preprocess 6 MP -> 1024", lambda item: preprocess_image(item[1]), photos)
+    payloads = [preprocess_image(data) for _, data in _distinct_images(n, size=(320, 240))]
+
+    def parsing_agent(mode):
+        Config.DIAGNOSIS_MODE = mode
+        agent = PlantDoctorAgent(registry=_CaptureRegistry(), backend=FakeBackend())
+        agent.phash_index = None
+        return agent
+
+    mode = Config.DIAGNOSIS_MODE
+    try:
+        agent = parsing_agent("single")
+        _stage("parse: single call (JSON)", lambda p: agent._run_analysis(p, "English"), payloads)
+        agent = parsing_agent("two_call")
+        _stage("parse: two call (tool+summary)", lambda p: agent._run_analysis(p, "English"), payloads)
+    finally:
+        Config.DIAGNOSIS_MODE = mode
+
+    now = datetime.datetime.now()
+    incident = {"timestamp": now, "plant": "Tomato", "disease": "Early Blight",
+                "confidence": 90.0, "severity": "High", "status": "OPEN"}
+    with tempfile.TemporaryDirectory() as directory:
+        for label, store in (("memory", MemoryStore()),
+                             ("sqlite", SQLiteStore(os.path.join(directory, "bench.db")))):
+            _stage(f"store.write ({label})", lambda _: store.write(store.new_id(), dict(incident)), range(n))
+            registry = OutbreakRegistry(store=store)
+            _stage(f"log_incident, buffered ({label})",
+                   lambda _: registry.log_incident("Tomato", "Early Blight", 90.0, "High"), range(n))
+
+    for concurrency in (1, 4, 16):
+        agent = PlantDoctorAgent(registry=_CaptureRegistry(), backend=FakeBackend(latency=latency, jitter=0.3))
+        agent.cache.max_entries = 0
+        agent.phash_index = None
+        count = min(n, 50 * concurrency)
+        _stage(f"end-to-end x{concurrency}", lambda p: agent.analyze_and_act(p, "English"),
+               payloads[:count], concurrency=concurrency)
+
+
+def bench_resilience(n=200, latency=0.05, slow_rate=0.05, slow_latency=2.0):
+    """Tail latency with and without hedging when a fraction of model calls are slow (fake model)."""
+    from src.agent import PlantDoctorAgent
+    from src.backends import FakeBackend
+    from src.config import Config
+    print(f"🧪 Hedging: {slow_rate:.0%} of calls take {slow_latency:.1f}s instead of {latency * 1000:.0f} ms")
+    print(f"   {'':<12} {'p50':>9} {'p95':>9} {'p99':>9} {'hedges':>8}")
+    hedge_enabled, hedge_delay = Config.MODEL_HEDGE_ENABLED, Config.MODEL_HEDGE_MIN_DELAY
+    Config.MODEL_HEDGE_MIN_DELAY = latency * 2
+    try:
+        for hedge in (False, True):
+            Config.MODEL_HEDGE_ENABLED = hedge
+            backend = FakeBackend(latency=latency, jitter=0.2, slow_rate=slow_rate, slow_latency=slow_latency, seed=7)
+            agent = PlantDoctorAgent(registry=_CaptureRegistry(), backend=backend)
+            agent.cache.max_entries = 0
+            agent.phash_index = None
+            samples = []
+            for i in range(n):
+                start = time.perf_counter()
+                agent.analyze_and_act(i.to_bytes(4, "big"), "English")
+                samples.append((time.perf_counter() - start) * 1000)
+            p50, p95, p99 = _percentiles(samples)
+            hedges = backend.calls - n
+            print(f"   {'hedged' if hedge else 'plain':<12} {p50:9.1f} {p95:9.1f} {p99:9.1f} {hedges:8d}")
+    finally:
+        Config.MODEL_HEDGE_ENABLED, Config.MODEL_HEDGE_MIN_DELAY = hedge_enabled, hedge_delay
+
+
+SAMPLE_REPORTS = {
+    "English": "## Tomato: Early Blight (92%, High)\n\nConcentric brown lesions on older leaves.\n\n"
+               "1. Spray neem oil every 7 days\n2. Remove infected leaves\n3. Improve air circulation\n",
+    "Hindi": "## टमाटर: अगेती झुलसा (Early Blight) (92%, उच्च)\n\nपुरानी पत्तियों पर भूरे धब्बे।\n\n"
+             "1. हर 7 दिन में नीम तेल का छिड़काव करें\n2. संक्रमित पत्तियाँ हटा दें\n3. हवा का संचार बढ़ाएँ\n",
+    "Telugu": "## టమోటా: ఎర్లీ బ్లైట్ (Early Blight) (92%, ఎక్కువ)\n\nపాత ఆకులపై గోధుమ రంగు మచ్చలు.\n\n"
+              "1. ప్రతి 7 రోజులకు వేప నూనె పిచికారీ చేయండి\n2. సోకిన ఆకులను తీసివేయండి\n",
+}
+
+
+def bench_pdf(n=100):
+    """Per-PDF render latency by language, cached re-downloads, and batch rendering on a process pool."""
+    from src import report
+    print(f"🧪 Prescription PDFs ({n} reports per row, {os.cpu_count()} CPUs)")
+    for language in SAMPLE_REPORTS:
+        fonts = ", ".join(os.path.basename(path) for _, path in report.font_files(language)) or "core Helvetica"
+        print(f"   {language}: {fonts}")
+    print(f"   {'stage':<30} {'p50':>9} {'p95':>9} {'p99':>9} {'ops/s':>10}")
+    report.render_pdf("warm-up")  # fpdf2 / fontTools imports
+    for language, text in SAMPLE_REPORTS.items():
+        items = [text * 3 + f"\n#{i}" for i in range(n)]
+        _stage(f"render ({language})", lambda t: report.render_pdf(t, language), items)
+    _stage("pdf_bytes, cached rerun", lambda _: report.pdf_bytes(SAMPLE_REPORTS["Hindi"], "Hindi"), range(n))
+
+    batch = [(text * 3 + f"\n#{i}", language) for i in range(n) for language, text in SAMPLE_REPORTS.items()]
+    for workers in sorted({1, os.cpu_count() or 1}):
+        start = time.perf_counter()
+        report.render_many(batch, workers=workers)
+        elapsed = time.perf_counter() - start
+        print(f"   render_many x{workers:<3} {len(batch)} PDFs in {elapsed:5.1f}s ({len(batch) / elapsed:.1f}/s)")
+
+
+def _synthetic_field(width=6000, height=4000, lesion_spots=6, seed=3):
+    """Drone-shot stand-in: crop rows on bare soil, with a few patches of brown lesions on the leaves."""
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    rgb = np.empty((height, width, 3), dtype=np.uint8)
+    rgb[:] = (120, 95, 70)
+    for x in range(0, width, 160):
+        rgb[:, x:x + 100] = (50, 140, 45)
+    rgb += rng.integers(0, 20, rgb.shape, dtype=np.uint8)
+    for _ in range(lesion_spots):
+        cx = int(rng.integers(200, width - 200)) // 160 * 160 + 50
+        cy = int(rng.integers(200, height - 200))
+        for y in range(cy - 150, cy + 150, 25):
+            for x in (cx - 30, cx, cx + 30):
+                rgb[y - 6:y + 6, x - 6:x + 6] = (150, 105, 40)
+    buf = io.BytesIO()
+    Image.fromarray(rgb).save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def bench_tiling(latency=0.3):
+    """Model calls and wall time per 24 MP field image: naive tiling vs the NumPy prefilter (fake model)."""
+    from PIL import Image
+    from src import tiling
+    from src.config import Config
+    agent = _stub_agent(latency)
+    print(f"🧪 Tiled analysis (6000x4000, {Config.TILE_SIZE}px tiles, {Config.TILE_OVERLAP:.0%} overlap, "
+          f"fake model {latency * 1000:.0f} ms/call)")
+    fields = {"diseased field": _synthetic_field(), "healthy field": _synthetic_field(lesion_spots=0)}
+
+    print(f"   {'stage':<30} {'p50':>9} {'p95':>9} {'p99':>9} {'ops/s':>10}")
+    image = Image.open(io.BytesIO(fields["diseased field"])).convert("RGB")
+    _stage("prefilter (score 40 tiles)", lambda _: tiling.plan_tiles(image), range(10))
+
+    saved = (Config.TILE_MIN_PLANT, Config.TILE_MIN_LESION, Config.TILE_MAX_CALLS)
+    for label, data in fields.items():
+        for arm in ("naive", "prefilter"):
+            if arm == "naive":
+                Config.TILE_MIN_PLANT, Config.TILE_MIN_LESION, Config.TILE_MAX_CALLS = 0.0, 0.0, 10 ** 6
+            calls = agent.backend.calls
+            start = time.perf_counter()
+            try:
+                result = tiling.analyze_tiled(agent, data)
+            finally:
+                Config.TILE_MIN_PLANT, Config.TILE_MIN_LESION, Config.TILE_MAX_CALLS = saved
+            elapsed = time.perf_counter() - start
+            print(f"   {label:<15} {arm:<10} {agent.backend.calls - calls:3d} model calls "
+                  f"of {len(result.tiles)} tiles, {elapsed:5.2f}s")
+
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "preprocess": bench_preprocess,
+    "modes": bench_modes,
+    "stream": bench_stream,
+    "analytics": bench_analytics,
+    "api": bench_api,
+    "stages": bench_stages,
+    "resilience": bench_resilience,
+    "pdf": bench_pdf,
+    "tiling": bench_tiling,
+}
+
+if __name__ == "__main__":
+    print("🚀 AgriDoc Enterprise Benchmarks")
+    print("=" * 40)
+    sys.path.append(ROOT)
+
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        BENCHMARKS[name]()
+        print()
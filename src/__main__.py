@@ -0,0 +1,184 @@
+"""
+AgriDoc command line.
+
+    python -m src diagnose samples/ --language Hindi --output results.jsonl
+    python -m src prescriptions results.jsonl --output pdfs/
+    python -m src knowledge warm --top 10
+    python -m src serve --port 8000
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from src.config import Config
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def find_images(directory):
+    paths = []
+    for root, _, names in os.walk(directory):
+        paths.extend(os.path.join(root, n) for n in names if n.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(paths)
+
+
+def diagnose_directory(directory, out, language="English", workers=None, agent=None):
+    """
+    Diagnoses every image under `directory` in parallel and writes one JSON
+    line per image to `out` as soon as it completes. At most 2 x workers
+    images are held in memory at once; model calls use the bulk rate-limit
+    lane. Returns (processed, failed).
+    """
+    from src import rate_limit, resources
+    from src.preprocess import preprocess_image
+    agent = agent or resources.get_agent()
+    workers = workers or Config.BATCH_MAX_CONCURRENCY
+
+    def run(path):
+        with open(path, "rb") as f, rate_limit.lane(rate_limit.BULK):
+            diagnosis, logged, ok = agent.analyze(preprocess_image(f.read()), language)
+        if not ok:
+            raise RuntimeError(diagnosis)  # recorded as "error", so no prescription is rendered for it
+        return diagnosis, logged
+
+    paths = iter(find_images(directory))
+    processed = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        inflight = {}
+        while True:
+            for path in paths:
+                inflight[pool.submit(run, path)] = path
+                if len(inflight) >= workers * 2:
+                    break
+            if not inflight:
+                break
+            done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = inflight.pop(future)
+                record = {"file": os.path.relpath(path, directory), "language": language}
+                try:
+                    record["diagnosis"], record["logged"] = future.result()
+                except Exception as e:
+                    record["error"] = str(e)
+                    failed += 1
+                processed += 1
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+    return processed, failed
+
+
+def write_prescriptions(results_path, out_dir, workers=None):
+    """One PDF per successful line of a `diagnose` JSONL file, rendered on a process pool. Returns the count."""
+    from src.report import pdf_name, render_many, unique_names
+    with open(results_path, encoding="utf-8") as f:
+        records = [r for r in map(json.loads, filter(str.strip, f)) if r.get("diagnosis")]
+    os.makedirs(out_dir, exist_ok=True)
+    pdfs = render_many([(r["diagnosis"], r.get("language", "English")) for r in records], workers)
+    for name, data in zip(unique_names(pdf_name(r["file"]) for r in records), pdfs):
+        with open(os.path.join(out_dir, name), "wb") as f:
+            f.write(data)
+    return len(records)
+
+
+def manage_knowledge(args, parser):
+    from src import resources
+    if not Config.KNOWLEDGE_DB_PATH:
+        print("⚠️ KNOWLEDGE_DB_PATH is not set, changes only last for this process", file=sys.stderr)
+    Config.validate()
+    agent = resources.get_agent()
+    if agent.knowledge is None:
+        parser.error("the knowledge cache is disabled (KNOWLEDGE_ENABLED=false)")
+    if args.action == "warm":
+        analytics = resources.get_analytics()
+        analytics.maybe_refresh()
+        languages = [args.language] if args.language else None
+        count = agent.warm_up_knowledge(top_n=args.top, languages=languages, analytics=analytics)
+        print(f"✅ {count} entries added ({len(agent.knowledge)} total)", file=sys.stderr)
+    elif args.action == "import":
+        if not args.file:
+            parser.error("knowledge import needs a JSON file")
+        with open(args.file, encoding="utf-8") as f:
+            count = agent.knowledge.import_entries(json.load(f))
+        print(f"✅ {count} vetted entries imported", file=sys.stderr)
+    else:
+        count = agent.knowledge.invalidate(args.plant, args.disease, args.language)
+        print(f"✅ {count} entries invalidated", file=sys.stderr)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src", description="AgriDoc Enterprise")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    diagnose = commands.add_parser("diagnose", help="Diagnose a directory of images and write JSONL results")
+    diagnose.add_argument("directory")
+    diagnose.add_argument("--language", default="English")
+    diagnose.add_argument("--workers", type=int, default=Config.BATCH_MAX_CONCURRENCY)
+    diagnose.add_argument("--output", "-o", help="JSONL file (default: stdout)")
+
+    prescriptions = commands.add_parser("prescriptions", help="Render a PDF per diagnosis in a JSONL results file")
+    prescriptions.add_argument("results")
+    prescriptions.add_argument("--output", "-o", default="prescriptions")
+    prescriptions.add_argument("--workers", type=int, default=Config.REPORT_WORKERS or None)
+
+    knowledge = commands.add_parser("knowledge", help="Manage the remedy knowledge cache (KNOWLEDGE_DB_PATH)")
+    knowledge.add_argument("action", choices=["warm", "import", "invalidate"])
+    knowledge.add_argument("file", nargs="?", help="JSON list of vetted entries (import)")
+    knowledge.add_argument("--top", type=int, help="Diseases to warm up (default KNOWLEDGE_WARMUP_TOP_N)")
+    knowledge.add_argument("--plant")
+    knowledge.add_argument("--disease")
+    knowledge.add_argument("--language")
+
+    compact = commands.add_parser("compact", help="Merge duplicate outbreak documents already in the store")
+    compact.add_argument("--days", type=float, help="Only documents from the last N days (default: all)")
+
+    serve = commands.add_parser("serve", help="Run the HTTP API")
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        import uvicorn
+        uvicorn.run("src.api:app", host=args.host, port=args.port)
+        return 0
+
+    if args.command == "knowledge":
+        return manage_knowledge(args, parser)
+
+    if args.command == "compact":
+        from src.database import OutbreakRegistry
+        Config.validate()
+        since = datetime.datetime.now() - datetime.timedelta(days=args.days) if args.days else None
+        updated, removed = OutbreakRegistry().compact(since=since)
+        print(f"✅ {removed} duplicate documents merged into {updated} outbreaks", file=sys.stderr)
+        return 0
+
+    if args.command == "prescriptions":
+        start = time.perf_counter()
+        count = write_prescriptions(args.results, args.output, args.workers)
+        print(f"✅ {count} prescriptions in {time.perf_counter() - start:.1f}s -> {args.output}", file=sys.stderr)
+        return 0
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"not a directory: {args.directory}")
+    Config.validate()
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    start = time.perf_counter()
+    try:
+        processed, failed = diagnose_directory(args.directory, out, args.language, args.workers)
+    finally:
+        if args.output:
+            out.close()
+    elapsed = time.perf_counter() - start
+    print(f"✅ {processed} images in {elapsed:.1f}s ({processed / max(elapsed, 1e-9):.1f}/s), {failed} failed",
+          file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -102,17 +102,87 @@
 #         return final_text_response, logged_status
 
 
-import google.generativeai as genai
-from google.generativeai.types import FunctionDeclaration, Tool
 from src.config import Config
 from src.database import OutbreakRegistry
+from src.cache import DiagnosisCache, image_digest, digest_cache_key
+from src.phash import PerceptualIndex, dhash, phash
+from src.knowledge import DEFAULT_TOP_DISEASES, KnowledgeCache
+from src.backends import create_backend
+from src.resilience import ResilientClient
+from src import rate_limit
+from src import telemetry
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
+import re
+import time
 
-class PlantDoctorAgent:
+# google.generativeai is imported lazily (first agent construction, in the
+# Gemini backend): it is the slowest import in the app and the page should render first.
+
+BatchResult = namedtuple("BatchResult", ["index", "diagnosis", "logged", "error"])
+
+# Structured output for single-call mode: the registry fields and the report in one response
+DIAGNOSIS_SCHEMA = {
+    'type_': 'OBJECT',
+    'properties': {
+        'plant': {'type_': 'STRING'},
+        'disease': {'type_': 'STRING'},
+        'confidence': {'type_': 'NUMBER'},
+        'severity': {'type_': 'STRING', 'enum': ['Low', 'Medium', 'High', 'Critical']},
+        'diagnosis': {'type_': 'STRING'},
+        'remedies': {'type_': 'ARRAY', 'items': {'type_': 'STRING'}}
+    },
+    'required': ['plant', 'disease', 'confidence', 'severity', 'diagnosis', 'remedies']
+}
+
+# Knowledge cache entries: a disease description and its remedies, independent of any one image
+KNOWLEDGE_SCHEMA = {
+    'type_': 'OBJECT',
+    'properties': {
+        'diagnosis': {'type_': 'STRING'},
+        'remedies': {'type_': 'ARRAY', 'items': {'type_': 'STRING'}}
+    },
+    'required': ['diagnosis', 'remedies']
+}
+
+def _partial_json_string(raw, field):
+    """The decoded prefix of string `field` in an incomplete JSON object ("" until it starts)."""
+    match = re.search(r'"%s"\s*:\s*"' % re.escape(field), raw)
+    if match is None:
+        return ""
+    i = end = match.end()
+    while i < len(raw) and raw[i] != '"':
+        if raw[i] == '\\':
+            step = 6 if raw[i + 1:i + 2] == 'u' else 2
+            if i + step > len(raw):
+                break  # escape sequence cut off mid-chunk
+            i += step
+        else:
+            i += 1
+        end = i
+    text = json.loads('"' + raw[match.end():end] + '"')
+    if text and '\ud800' <= text[-1] <= '\udbff':
+        text = text[:-1]  # first half of an escaped surrogate pair
+    return text
+
+class DiagnosisStream:
+    """Iterable of diagnosis text chunks (usable with st.write_stream)."""
     def __init__(self):
-        # 1. Configure API
-        genai.configure(api_key=Config.GOOGLE_API_KEY)
-        self.db = OutbreakRegistry()
+        self.text = ""
+        self.logged = False
+        self._chunks = iter(())
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            self.text += chunk
+            yield chunk
+
+class PlantDoctorAgent:
+    def __init__(self, registry=None, backend=None):
+        # 1. Model Backend (Gemini, or the local fake for tests and benchmarks)
+        self.backend = backend or create_backend()
+        self.db = registry or OutbreakRegistry()
         
         # 2. Define the Tool
         self.log_tool = {
@@ -134,15 +204,421 @@ class PlantDoctorAgent:
             ]
         }
         
-        # 3. Initialize Model
-        self.model = genai.GenerativeModel(
-            model_name=Config.MODEL_NAME,
-            tools=[self.log_tool],
-            system_instruction="You are an expert AI Botanist. You can see images. Analyze the plant health."
+        # 3. Initialize Model (retries, deadlines, hedging, circuit breaker and fallback model)
+        system_instruction = "You are an expert AI Botanist. You can see images. Analyze the plant health."
+        self.models = ResilientClient(self.backend)
+        self.model = self.models.tool_model([self.log_tool], system_instruction)
+        self.summary_model = self.models.text_model()
+        self.structured_model = self.models.json_model(DIAGNOSIS_SCHEMA, system_instruction)
+        self.knowledge_model = self.models.json_model(KNOWLEDGE_SCHEMA, system_instruction)
+
+        # 4. Diagnosis Cache (re-uploads skip Gemini and the registry write)
+        self.cache = DiagnosisCache(
+            max_entries=Config.CACHE_MAX_ENTRIES,
+            ttl_seconds=Config.CACHE_TTL_SECONDS,
+            db_path=Config.CACHE_DB_PATH or None,
+            disk_max_entries=Config.CACHE_DISK_MAX_ENTRIES
         )
 
-    # === FIX: Added 'language' parameter here ===
+        # 5. Near-Duplicate Index (re-photographed / re-compressed samples)
+        self.phash_index = None
+        if Config.PHASH_ENABLED:
+            self.phash_index = PerceptualIndex(
+                max_distance=Config.PHASH_MAX_DISTANCE,
+                path=Config.PHASH_INDEX_PATH or None
+            )
+
+        # 6. Knowledge Cache (vetted remedies per plant, disease and language; skips the summary call)
+        self.knowledge = None
+        if Config.KNOWLEDGE_ENABLED:
+            self.knowledge = KnowledgeCache(db_path=Config.KNOWLEDGE_DB_PATH or None)
+
+    def analyze_many(self, images, language="English", max_concurrency=None):
+        """
+        Diagnoses many images concurrently and yields a BatchResult for each
+        one as soon as it completes (not in input order). A failure on one
+        image, including a response that could not be parsed, is reported in
+        its result's `error` and does not stop the batch. Batch calls run in
+        the bulk rate-limit lane, behind interactive uploads. Closing the
+        generator early cancels the images that have not started.
+        """
+        max_concurrency = max_concurrency or Config.BATCH_MAX_CONCURRENCY
+        pool = ThreadPoolExecutor(max_workers=max_concurrency)
+        try:
+            futures = {
+                pool.submit(self._analyze_bulk, image_bytes, language): index
+                for index, image_bytes in enumerate(images)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    diagnosis, logged, ok = future.result()
+                except Exception as e:
+                    print(f"Batch item {index} failed: {e}")
+                    yield BatchResult(index, None, False, str(e))
+                    continue
+                if ok:
+                    yield BatchResult(index, diagnosis, logged, None)
+                else:
+                    yield BatchResult(index, None, logged, diagnosis)
+        finally:
+            # Don't wait for calls already running; a consumer that stopped reading has moved on
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _analyze_bulk(self, image_bytes, language):
+        with rate_limit.lane(rate_limit.BULK):
+            return self.analyze(image_bytes, language)
+
+    def _fingerprint(self, image_bytes):
+        hasher = phash if Config.PHASH_ALGORITHM == "phash" else dhash
+        try:
+            return hasher(image_bytes)
+        except Exception as e:
+            print(f"Fingerprint Error: {e}")
+            return None
+
+    def find_near_duplicate(self, image_bytes):
+        """Returns (image_digest, hamming_distance) of an earlier diagnosed sample, or None."""
+        if self.phash_index is None:
+            return None
+        fingerprint = self._fingerprint(image_bytes)
+        if fingerprint is None:
+            return None
+        return self.phash_index.nearest(fingerprint)
+
     def analyze_and_act(self, image_bytes, language="English"):
+        """
+        Returns (diagnosis_text, logged). Identical images in the same
+        language are served from the cache without re-logging the incident,
+        and near-duplicates reuse the earlier diagnosis when PHASH_MODE is "reuse".
+        """
+        final_text_response, logged_status, _ = self.analyze(image_bytes, language)
+        return final_text_response, logged_status
+
+    def analyze(self, image_bytes, language="English"):
+        """
+        Returns (text, logged, ok): analyze_and_act() plus whether the model
+        response was usable. When `ok` is False the text is an error message
+        for the user, not a diagnosis, and should not be stored as one.
+        """
+        lookup = self._lookup(image_bytes, language)
+        if lookup['result'] is not None:
+            return lookup['result'] + (True,)
+
+        final_text_response, logged_status, ok = self._run_analysis(image_bytes, language)
+        # Don't pin processing errors in the cache; a retry should hit Gemini again
+        if ok:
+            self._remember(lookup, final_text_response, logged_status)
+        return final_text_response, logged_status, ok
+
+    def analyze_and_act_stream(self, image_bytes, language="English"):
+        """
+        Streaming variant of analyze_and_act. Returns a DiagnosisStream that
+        yields text chunks as Gemini produces them; `.text` and `.logged`
+        are final once it has been iterated to the end.
+        """
+        stream = DiagnosisStream()
+        stream._chunks = self._stream_chunks(stream, image_bytes, language)
+        return stream
+
+    def _lookup(self, image_bytes, language):
+        """Exact-cache and near-duplicate lookup shared by the blocking and streaming paths."""
+        digest = image_digest(image_bytes)
+        lookup = {
+            'digest': digest,
+            'key': digest_cache_key(digest, language, self._model_key()),
+            'fingerprint': None,
+            'match': None,
+            'result': None,
+        }
+        cached = self.cache.get(lookup['key'])
+        if cached is not None:
+            print("♻️ Diagnosis served from cache")
+            telemetry.record_cache_lookup("hit")
+            lookup['result'] = cached
+            return lookup
+
+        if self.phash_index is not None:
+            lookup['fingerprint'] = self._fingerprint(image_bytes)
+            if lookup['fingerprint'] is not None:
+                lookup['match'] = self.phash_index.nearest(lookup['fingerprint'])
+            match = lookup['match']
+            if match and Config.PHASH_MODE == "reuse":
+                earlier = self.cache.get(digest_cache_key(match[0], language, self._model_key()))
+                if earlier is not None:
+                    print(f"♻️ Near-duplicate of {match[0][:12]} (distance {match[1]}), reusing diagnosis")
+                    # The text is reused, but nothing was logged for this image
+                    lookup['result'] = (earlier[0], False)
+                    self.cache.put(lookup['key'], *lookup['result'])
+        telemetry.record_cache_lookup("near_duplicate" if lookup['result'] is not None else "miss")
+        return lookup
+
+    def _remember(self, lookup, text, logged):
+        self.cache.put(lookup['key'], text, logged)
+        match = lookup['match']
+        if lookup['fingerprint'] is not None and not (match and match[0] == lookup['digest']):
+            self.phash_index.add(lookup['fingerprint'], lookup['digest'])
+
+    def _stream_chunks(self, stream, image_bytes, language):
+        lookup = self._lookup(image_bytes, language)
+        if lookup['result'] is not None:
+            stream.logged = lookup['result'][1]
+            yield lookup['result'][0]
+            return
+
+        # Same flow (and cache entries) as analyze_and_act in the configured DIAGNOSIS_MODE
+        if Config.DIAGNOSIS_MODE == "two_call":
+            ok = yield from self._stream_two_call(stream, image_bytes, language)
+        else:
+            ok = yield from self._stream_single_call(stream, image_bytes, language)
+        if ok:
+            self._remember(lookup, stream.text, stream.logged)
+
+    def _stream_single_call(self, stream, image_bytes, language):
+        """
+        Streams the structured call: the 'diagnosis' text is shown as its
+        JSON arrives, the remedies once the response is complete. `.text`
+        then becomes the same report _run_single_call returns.
+        """
+        telemetry.record_request_bytes("structured", len(image_bytes))
+        start = time.perf_counter()
+        first_chunk = None
+        response = self._request_finding_stream(image_bytes, language)
+        raw, shown = "", 0
+        for chunk in response:
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - start
+                telemetry.observe_stage("model.structured.first_chunk", first_chunk)
+            raw += "".join(part.text for part in chunk.parts if part.text)
+            diagnosis = _partial_json_string(raw, 'diagnosis')
+            if len(diagnosis) > shown:
+                yield diagnosis[shown:]
+                shown = len(diagnosis)
+        telemetry.record_usage(response, "structured")
+        telemetry.observe_stage("model.structured", time.perf_counter() - start)
+
+        try:
+            result = self._parse_finding_text(raw)
+            report = self._format_report(result)  # fails here, before logging, if a field is missing
+            stream.logged = self._log_finding(result)
+        except Exception as e:
+            print(f"Parsing Error: {e}")
+            error = f"I analyzed the image, but encountered a processing error: {str(e)}"
+            yield "\n\n" + error
+            stream.text = error
+            return False
+        yield "\n\n" + "\n".join(f"{i}. {r}" for i, r in enumerate(result['remedies'], 1))
+        stream.text = report
+        return True
+
+    def _stream_two_call(self, stream, image_bytes, language):
+        """Streams the tool-calling chat; a log_outbreak call continues it with the tool result."""
+        prompt = f"""
+        Analyze this plant image.
+        1. Identify the plant and any disease (or say 'Healthy').
+        2. If a specific disease is detected with >70% confidence, CALL the 'log_outbreak' function first.
+        3. Then provide a diagnosis and 3 organic remedies in {language} language.
+        """
+        chat = self.model.start_chat()
+        telemetry.record_request_bytes("stream", len(image_bytes))
+        # Spans can't stay open across yields, so the stream stages are timed by hand
+        start = time.perf_counter()
+        first_chunk = None
+        response = chat.send_message(
+            [{'mime_type': 'image/jpeg', 'data': image_bytes}, prompt],
+            stream=True
+        )
+
+        tool_result = None
+        try:
+            for chunk in response:
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - start
+                    telemetry.observe_stage("model.stream.first_chunk", first_chunk)
+                for part in chunk.parts:
+                    if part.function_call and part.function_call.name == "log_outbreak":
+                        # Dispatched as soon as it arrives; the registry write is non-blocking
+                        args = {k: v for k, v in part.function_call.args.items()}
+                        print(f"⚠️ Model calling tool: {args}")
+                        tool_result = self.db.log_incident(**args)
+                        stream.logged = True
+                    elif part.text:
+                        yield part.text
+
+            # As in _run_two_call, the report after a tool call replaces the first call's text
+            report = None
+            knowledge_text = self._knowledge_report(args, language) if tool_result is not None else None
+            if knowledge_text is not None:
+                yield ("\n\n" if stream.text else "") + knowledge_text
+                report = knowledge_text
+            elif tool_result is not None:
+                # Continue the same chat with the tool result; the model writes the report from there
+                continuation = chat.send_message(
+                    self.backend.function_response("log_outbreak", {'result': tool_result}),
+                    stream=True
+                )
+                report = ""
+                for chunk in continuation:
+                    for part in chunk.parts:
+                        if part.text:
+                            yield ("\n\n" if stream.text and not report else "") + part.text
+                            report += part.text
+                telemetry.record_usage(continuation, "stream")
+        except Exception as e:
+            print(f"Parsing Error: {e}")
+            error = f"I analyzed the image, but encountered a processing error: {str(e)}"
+            yield ("\n\n" if stream.text else "") + error
+            stream.text = error
+            return False
+
+        telemetry.record_usage(response, "stream")
+        telemetry.observe_stage("model.stream", time.perf_counter() - start)
+        if report is not None:
+            stream.text = report
+        if not stream.text.strip():
+            yield "Analysis complete. Check the logs for details."
+        return True
+
+    def _model_key(self):
+        # Mode is part of the key so an A/B run never serves one arm's result to the other;
+        # the knowledge version too, so bumping it retires reports built from old entries
+        return f"{Config.MODEL_NAME}:{Config.DIAGNOSIS_MODE}:k{Config.KNOWLEDGE_VERSION}"
+
+    def _run_analysis(self, image_bytes, language):
+        """Returns (text, logged, ok) using the configured DIAGNOSIS_MODE."""
+        if Config.DIAGNOSIS_MODE == "two_call":
+            return self._run_two_call(image_bytes, language)
+        return self._run_single_call(image_bytes, language)
+
+    def _run_single_call(self, image_bytes, language):
+        """One Gemini call returning JSON; log_outbreak runs locally instead of as a tool round-trip."""
+        response = self._request_finding(image_bytes, language)
+        try:
+            result = self._parse_finding(response)
+            logged_status = self._log_finding(result)
+            return self._format_report(result), logged_status, True
+        except Exception as e:
+            print(f"Parsing Error: {e}")
+            return f"I analyzed the image, but encountered a processing error: {str(e)}", False, False
+
+    def _log_finding(self, result):
+        """Logs a confident, non-healthy finding. Returns whether it was logged."""
+        if result['disease'].strip().lower() == 'healthy' or result['confidence'] <= Config.LOG_CONFIDENCE_THRESHOLD:
+            return False
+        args = {k: result[k] for k in ('plant', 'disease', 'confidence', 'severity')}
+        print(f"⚠️ Logging outbreak: {args}")
+        # Non-blocking: the registry's write buffer commits it in the background
+        self.db.log_incident(**args)
+        return True
+
+    def find_disease(self, image_bytes, language="English"):
+        """
+        The structured finding for one image (plant, disease, confidence
+        0-100, severity, diagnosis, remedies), without logging it. Used by
+        single-call mode and by tiled analysis (src/tiling.py).
+        """
+        return self._parse_finding(self._request_finding(image_bytes, language))
+
+    @staticmethod
+    def _finding_prompt(language):
+        return f"""
+        Analyze this plant image.
+        1. Identify the plant and any disease (use 'Healthy' as the disease if there is none).
+        2. Give your confidence as a percentage (0-100) and the severity.
+        3. Write 'diagnosis' and exactly 3 organic 'remedies' in {language} language.
+           Keep 'plant', 'disease' and 'severity' in English.
+        """
+
+    def _request_finding(self, image_bytes, language):
+        telemetry.record_request_bytes("structured", len(image_bytes))
+        with telemetry.span("model.structured", bytes=len(image_bytes)) as span:
+            response = self.structured_model.generate_content(
+                [
+                    {'mime_type': 'image/jpeg', 'data': image_bytes},
+                    self._finding_prompt(language)
+                ]
+            )
+            telemetry.record_usage(response, "structured", span)
+        return response
+
+    def _request_finding_stream(self, image_bytes, language):
+        return self.structured_model.generate_content(
+            [
+                {'mime_type': 'image/jpeg', 'data': image_bytes},
+                self._finding_prompt(language)
+            ],
+            stream=True
+        )
+
+    @staticmethod
+    def _parse_finding(response):
+        return PlantDoctorAgent._parse_finding_text(response.text)
+
+    @staticmethod
+    def _parse_finding_text(text):
+        with telemetry.span("parse"):
+            result = json.loads(text)
+            if result['confidence'] <= 1:
+                result['confidence'] *= 100  # model answered with a fraction
+        return result
+
+    @staticmethod
+    def _format_report(result):
+        remedies = "\n".join(f"{i}. {r}" for i, r in enumerate(result['remedies'], 1))
+        return (
+            f"### 🌿 {result['plant']} — {result['disease']}\n"
+            f"**{result['confidence']:.0f}%** · {result['severity']}\n\n"
+            f"{result['diagnosis']}\n\n"
+            f"{remedies}"
+        )
+
+    def _knowledge_report(self, finding, language):
+        """Report built from the knowledge cache, or None (no entry, or not confident enough to reuse one)."""
+        if self.knowledge is None:
+            return None
+        confidence = float(finding.get('confidence', 0))
+        if confidence <= 1:
+            confidence *= 100  # model answered with a fraction
+        if confidence < Config.KNOWLEDGE_MIN_CONFIDENCE:
+            return None
+        entry = self.knowledge.get(finding['plant'], finding['disease'], language)
+        telemetry.record_knowledge_lookup("hit" if entry is not None else "miss")
+        if entry is None:
+            return None
+        print(f"📚 Remedies for {finding['disease']} served from knowledge cache")
+        return self._format_report({
+            'plant': finding['plant'], 'disease': finding['disease'], 'confidence': confidence,
+            'severity': finding.get('severity', ''), 'diagnosis': entry['diagnosis'], 'remedies': entry['remedies'],
+        })
+
+    def generate_knowledge(self, plant, disease, language):
+        """(diagnosis, remedies) for a disease in general, written for the knowledge cache."""
+        prompt = f"""
+        Describe {disease} on {plant} for a farmer: how to recognise it and why it spreads.
+        Put that in 'diagnosis' and exactly 3 organic 'remedies', all in {language} language.
+        """
+        with telemetry.span("model.knowledge"):
+            result = json.loads(self.knowledge_model.generate_content(prompt).text)
+        return result['diagnosis'], result['remedies'][:3]
+
+    def warm_up_knowledge(self, top_n=None, languages=None, analytics=None):
+        """
+        Pre-populates the knowledge cache for the `top_n` most logged (plant,
+        disease) pairs (padded with DEFAULT_TOP_DISEASES) in every language.
+        Runs in the bulk rate-limit lane. Returns the number of entries added.
+        """
+        if self.knowledge is None:
+            return 0
+        top_n = top_n or Config.KNOWLEDGE_WARMUP_TOP_N or len(DEFAULT_TOP_DISEASES)
+        pairs = []
+        ranked = analytics.top_pairs(top_n) if analytics is not None else []
+        for plant, disease in ranked + DEFAULT_TOP_DISEASES:
+            if disease.strip().lower() != 'healthy' and (plant, disease) not in pairs:
+                pairs.append((plant, disease))
+        with rate_limit.lane(rate_limit.BULK):
+            return self.knowledge.warm_up(pairs[:top_n], languages or Config.LANGUAGES, self.generate_knowledge)
+
+    def _run_two_call(self, image_bytes, language):
         # === FIX: Added 'f' before the string to make it dynamic ===
         prompt = f"""
         Analyze this plant image.
@@ -152,27 +628,32 @@ class PlantDoctorAgent:
         """
         
         # Send Image + Prompt
-        response = self.model.generate_content(
-            [
-                {'mime_type': 'image/jpeg', 'data': image_bytes},
-                prompt
-            ],
-            tool_config={'function_calling_config': 'AUTO'}
-        )
+        telemetry.record_request_bytes("diagnose", len(image_bytes))
+        with telemetry.span("model.diagnose", bytes=len(image_bytes)) as span:
+            response = self.model.generate_content(
+                [
+                    {'mime_type': 'image/jpeg', 'data': image_bytes},
+                    prompt
+                ],
+                tool_config={'function_calling_config': 'AUTO'}
+            )
+            telemetry.record_usage(response, "diagnose", span)
         
         # === ROBUST PARSING LOGIC ===
         logged_status = False
         final_text_response = ""
         function_call_found = None
+        ok = True
 
         try:
             # Iterate through ALL parts to find text and function calls
-            for part in response.candidates[0].content.parts:
-                if part.function_call:
-                    function_call_found = part.function_call
-                
-                if part.text:
-                    final_text_response += part.text + "\n\n"
+            with telemetry.span("parse"):
+                for part in response.candidates[0].content.parts:
+                    if part.function_call:
+                        function_call_found = part.function_call
+
+                    if part.text:
+                        final_text_response += part.text + "\n\n"
 
             # If we found a function call, execute it
             if function_call_found:
@@ -183,15 +664,21 @@ class PlantDoctorAgent:
                     print(f"⚠️ Model calling tool: {args}")
                     self.db.log_incident(**args)
                     logged_status = True
-                    
-                    # Generate summary in the correct language
-                    summary_model = genai.GenerativeModel(Config.MODEL_NAME)
-                    summary_response = summary_model.generate_content(
-                        f"I just detected {args['disease']} on {args['plant']} and logged it. "
-                        f"Current thoughts: {final_text_response}. "
-                        f"Please write a clean, helpful diagnosis and 3 organic remedies for the user in {language} language."
-                    )
-                    final_text_response = summary_response.text
+
+                    # Known disease: assemble the report from vetted text instead of a second call
+                    knowledge_text = self._knowledge_report(args, language)
+                    if knowledge_text is not None:
+                        final_text_response = knowledge_text
+                    else:
+                        # Generate summary in the correct language
+                        with telemetry.span("model.summary") as span:
+                            summary_response = self.summary_model.generate_content(
+                                f"I just detected {args['disease']} on {args['plant']} and logged it. "
+                                f"Current thoughts: {final_text_response}. "
+                                f"Please write a clean, helpful diagnosis and 3 organic remedies for the user in {language} language."
+                            )
+                            telemetry.record_usage(summary_response, "summary", span)
+                        final_text_response = summary_response.text
 
             if not final_text_response.strip():
                 final_text_response = "Analysis complete. Check the logs for details."
@@ -199,5 +686,6 @@ class PlantDoctorAgent:
         except Exception as e:
             print(f"Parsing Error: {e}")
             final_text_response = f"I analyzed the image, but encountered a processing error: {str(e)}"
+            ok = False
 
-        return final_text_response, logged_status
\ No newline at end of file
+        return final_text_response, logged_status, ok
\ No newline at end of file
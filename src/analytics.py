@@ -0,0 +1,298 @@
+import datetime
+import logging
+import threading
+import time
+
+import numpy as np
+
+from src.storage import last_seen
+
+logger = logging.getLogger(__name__)
+
+SEVERITIES = ["Low", "Medium", "High", "Critical"]
+DAY_SECONDS = 86400
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_codes(lat, lon, precision=5):
+    """Vectorized geohash: integer codes (5 bits per character) for arrays of coordinates."""
+    lat_lo, lat_hi = np.full(lat.shape, -90.0), np.full(lat.shape, 90.0)
+    lon_lo, lon_hi = np.full(lon.shape, -180.0), np.full(lon.shape, 180.0)
+    code = np.zeros(lat.shape, dtype=np.int64)
+    for bit in range(precision * 5):
+        if bit % 2 == 0:  # geohash interleaves starting with longitude
+            mid = (lon_lo + lon_hi) / 2
+            upper = lon >= mid
+            lon_lo = np.where(upper, mid, lon_lo)
+            lon_hi = np.where(upper, lon_hi, mid)
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            upper = lat >= mid
+            lat_lo = np.where(upper, mid, lat_lo)
+            lat_hi = np.where(upper, lat_hi, mid)
+        code = (code << 1) | upper
+    return code
+
+
+def geohash_string(code, precision=5):
+    chars = []
+    for shift in range((precision - 1) * 5, -1, -5):
+        chars.append(GEOHASH_ALPHABET[(int(code) >> shift) & 31])
+    return "".join(chars)
+
+
+class _Categories:
+    """String <-> int code mapping for one categorical column."""
+    def __init__(self):
+        self.labels = []
+        self.codes = {}
+
+    def encode(self, values):
+        uniques, inverse = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+        mapping = np.empty(len(uniques), dtype=np.int32)
+        for i, label in enumerate(uniques):
+            if label not in self.codes:
+                self.codes[label] = len(self.labels)
+                self.labels.append(str(label))
+            mapping[i] = self.codes[label]
+        return mapping[inverse]
+
+
+class OutbreakAnalytics:
+    """
+    Columnar, in-process snapshot of logged incidents for dashboard aggregates.
+
+    Incidents are held as NumPy columns (epoch day, categorical codes,
+    confidence, optional coordinates, report count) that grow by doubling.
+    refresh() pulls only documents reported since the last one seen (minus an
+    overlap window), so the store is scanned in full once per process.
+
+    Counts are of reports, not outbreak documents: a new outbreak adds a row
+    for its first report at `timestamp` (and one for any later reports at
+    `last_seen`); when a refresh finds a known outbreak grown, the new
+    reports are added at its `last_seen`. Outbreaks are tracked by ID while
+    they can still grow (`merge_window_seconds`, the clustering window).
+    Every query is a weighted bincount over integer keys, which keeps 1M
+    incidents well under a second.
+    """
+    COLUMNS = {
+        "ts": np.float64,
+        "plant": np.int32,
+        "disease": np.int32,
+        "severity": np.int8,
+        "confidence": np.float32,
+        "lat": np.float64,
+        "lon": np.float64,
+        "n": np.int32,
+    }
+
+    def __init__(self, store=None, refresh_interval=60.0, overlap_seconds=60.0, page_size=5000,
+                 merge_window_seconds=0.0):
+        self.store = store
+        self.refresh_interval = refresh_interval
+        self.overlap = overlap_seconds
+        self.merge_window = merge_window_seconds
+        self.page_size = page_size
+        self.size = 0
+        self._capacity = 1024
+        self._cols = {name: np.empty(self._capacity, dtype=dtype) for name, dtype in self.COLUMNS.items()}
+        self.plants = _Categories()
+        self.diseases = _Categories()
+        self._newest = None
+        self._refreshed_at = None
+        self._seen = {}  # id -> (occurrences counted, last_seen ts), while the outbreak can still grow
+        self._lock = threading.RLock()
+
+    # === INGEST ===
+    def _grow(self, needed):
+        if needed <= self._capacity:
+            return
+        while self._capacity < needed:
+            self._capacity *= 2
+        for name, col in self._cols.items():
+            grown = np.empty(self._capacity, dtype=col.dtype)
+            grown[:self.size] = col[:self.size]
+            self._cols[name] = grown
+
+    def append(self, records):
+        """
+        Adds incident dicts (as returned by IncidentStore reads). Returns the
+        number of new reports; re-reads of unchanged documents add none.
+        """
+        with self._lock:
+            fresh, times, weights = [], [], []
+            newest = self._newest
+            for r in records:
+                doc_id = r.get("id")
+                occurrences = int(r.get("occurrences") or 1)
+                reported = last_seen(r).timestamp()
+                newest = reported if newest is None else max(newest, reported)
+                counted = self._seen.get(doc_id, (0,))[0] if doc_id is not None else 0
+                if occurrences <= counted:
+                    continue
+                if not counted:
+                    fresh.append(r)
+                    times.append(r["timestamp"].timestamp())
+                    weights.append(1)
+                    counted = 1
+                if occurrences > counted:
+                    fresh.append(r)
+                    times.append(reported)
+                    weights.append(occurrences - counted)
+                if doc_id is not None:
+                    self._seen[doc_id] = (occurrences, reported)
+            self._newest = newest
+            if not fresh:
+                return 0
+
+            n = len(fresh)
+            start, end = self.size, self.size + n
+            self._grow(end)
+            c = self._cols
+            c["ts"][start:end] = times
+            c["n"][start:end] = weights
+            c["plant"][start:end] = self.plants.encode([r.get("plant") for r in fresh])
+            c["disease"][start:end] = self.diseases.encode([r.get("disease") for r in fresh])
+            c["severity"][start:end] = [
+                SEVERITIES.index(r.get("severity")) if r.get("severity") in SEVERITIES else -1 for r in fresh
+            ]
+            c["confidence"][start:end] = [float(r.get("confidence") or 0) for r in fresh]
+            # Coordinates are optional; incidents without them are NaN and skipped by geohash_counts
+            c["lat"][start:end] = [np.nan if r.get("latitude") is None else r["latitude"] for r in fresh]
+            c["lon"][start:end] = [np.nan if r.get("longitude") is None else r["longitude"] for r in fresh]
+            self.size = end
+
+            cutoff = self._newest - max(self.overlap, self.merge_window)
+            self._seen = {k: v for k, v in self._seen.items() if v[1] >= cutoff}
+            return sum(weights)
+
+    def refresh(self):
+        """Pulls incidents reported since the last one seen from the store."""
+        if self.store is None:
+            return 0
+        added = 0
+        with self._lock:
+            if self._newest is None:
+                cursor = datetime.datetime.fromtimestamp(0)
+            else:
+                cursor = datetime.datetime.fromtimestamp(self._newest - self.overlap)
+            while True:
+                page = self.store.since(cursor, limit=self.page_size)
+                added += self.append(page)
+                if len(page) < self.page_size or last_seen(page[-1]) <= cursor:
+                    break
+                cursor = last_seen(page[-1])
+            self._refreshed_at = time.time()
+        if added:
+            logger.info(f"Analytics snapshot: +{added} reports ({self.size} rows)")
+        return added
+
+    def maybe_refresh(self):
+        """refresh() at most once per refresh_interval (safe to call on every Streamlit rerun)."""
+        if self._refreshed_at is None or time.time() - self._refreshed_at >= self.refresh_interval:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Analytics refresh failed: {e}")
+
+    # === QUERIES ===
+    def _view(self, since_days=None):
+        c = {name: col[:self.size] for name, col in self._cols.items()}
+        if since_days is not None and self.size:
+            keep = c["ts"] >= (self._newest - since_days * DAY_SECONDS)
+            c = {name: col[keep] for name, col in c.items()}
+        return c
+
+    def counts(self, by="disease", period="day", since_days=None):
+        """Rows of {"period", by, "count"} for each non-empty (period, category) pair."""
+        with self._lock:
+            c = self._view(since_days)
+            cats = self.diseases if by == "disease" else self.plants
+            if not len(c["ts"]):
+                return []
+            days = (c["ts"] // DAY_SECONDS).astype(np.int64)
+            # Epoch day 0 was a Thursday; shift so weeks start on Monday
+            buckets = (days + 3) // 7 if period == "week" else days
+            first = buckets.min()
+            span = int(buckets.max() - first + 1)
+            keys = c[by].astype(np.int64) * span + (buckets - first)
+            totals = np.bincount(keys, weights=c["n"], minlength=len(cats.labels) * span)
+            rows = []
+            for key in np.flatnonzero(totals):
+                code, offset = divmod(int(key), span)
+                start_day = (first + offset) * 7 - 3 if period == "week" else first + offset
+                rows.append({
+                    "period": datetime.date(1970, 1, 1) + datetime.timedelta(days=int(start_day)),
+                    by: cats.labels[code],
+                    "count": int(totals[key]),
+                })
+            return rows
+
+    def _daily_matrix(self, by, days, end):
+        """(categories x days) incident counts for the `days` days ending with the day of `end` (epoch seconds)."""
+        c = self._view()
+        cats = self.diseases if by == "disease" else self.plants
+        last_day = int(end // DAY_SECONDS)
+        offset = (c["ts"] // DAY_SECONDS).astype(np.int64) - (last_day - days + 1)
+        inside = (offset >= 0) & (offset < days)
+        keys = c[by][inside].astype(np.int64) * days + offset[inside]
+        totals = np.bincount(keys, weights=c["n"][inside], minlength=len(cats.labels) * days).astype(np.int64)
+        return totals.reshape(len(cats.labels), days), cats
+
+    def spikes(self, by="disease", window=7, threshold=3.0, min_count=3, now=None):
+        """
+        Categories whose count today (the day of `now`, default the current
+        time) exceeds the mean of the previous `window` days by `threshold`
+        standard deviations. Days without reports count as zero.
+        """
+        end = (now or datetime.datetime.now()).timestamp()
+        with self._lock:
+            if not self.size:
+                return []
+            matrix, cats = self._daily_matrix(by, window + 1, end)
+            history, today = matrix[:, :-1].astype(np.float64), matrix[:, -1]
+            mean = history.mean(axis=1)
+            std = history.std(axis=1)
+            score = (today - mean) / np.maximum(std, 1.0)
+            hits = np.flatnonzero((score >= threshold) & (today >= min_count))
+            return sorted(
+                ({by: cats.labels[i], "today": int(today[i]), "baseline": round(float(mean[i]), 1),
+                  "z": round(float(score[i]), 1)} for i in hits),
+                key=lambda r: -r["z"]
+            )
+
+    def top_pairs(self, n=10, since_days=None):
+        """The `n` most frequent (plant, disease) pairs, most frequent first."""
+        with self._lock:
+            c = self._view(since_days)
+            if not len(c["ts"]):
+                return []
+            width = len(self.diseases.labels)
+            keys = c["plant"].astype(np.int64) * width + c["disease"]
+            totals = np.bincount(keys, weights=c["n"], minlength=len(self.plants.labels) * width)
+            top = np.argsort(totals, kind="stable")[::-1][:n]
+            return [(self.plants.labels[k // width], self.diseases.labels[k % width]) for k in top if totals[k]]
+
+    def severity_histogram(self, disease=None, since_days=None):
+        with self._lock:
+            c = self._view(since_days)
+            severity, weights = c["severity"], c["n"]
+            if disease is not None:
+                code = self.diseases.codes.get(disease)
+                keep = c["disease"] == code if code is not None else np.zeros(len(severity), dtype=bool)
+                severity, weights = severity[keep], weights[keep]
+            valid = severity >= 0
+            totals = np.bincount(severity[valid].astype(np.int64), weights=weights[valid], minlength=len(SEVERITIES))
+            return {label: int(n) for label, n in zip(SEVERITIES, totals)}
+
+    def geohash_counts(self, precision=5, since_days=None):
+        """Incident counts per geohash cell, for incidents that carry coordinates."""
+        with self._lock:
+            c = self._view(since_days)
+            located = ~(np.isnan(c["lat"]) | np.isnan(c["lon"]))
+            if not located.any():
+                return {}
+            codes = geohash_codes(c["lat"][located], c["lon"][located], precision)
+            cells, inverse = np.unique(codes, return_inverse=True)
+            totals = np.bincount(inverse, weights=c["n"][located])
+            return {geohash_string(cell, precision): int(n) for cell, n in zip(cells, totals)}
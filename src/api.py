@@ -0,0 +1,130 @@
+"""
+Headless HTTP API for ingestion systems.
+
+    uvicorn src.api:app --host 0.0.0.0 --port 8000
+    python -m src serve
+
+Handlers are async; blocking work (preprocessing, Gemini, the registry)
+runs in the thread pool, on the same process-wide agent and registry as
+the Streamlit app.
+"""
+import logging
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from fastapi import FastAPI, File, Form, HTTPException, Query, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from PIL import UnidentifiedImageError
+
+from src import resources, telemetry
+from src.config import Config
+from src.jobs import QueueFullError
+from src.preprocess import preprocess_image
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Build the shared clients before the first request instead of during it
+    Config.validate()
+    await run_in_threadpool(resources.get_agent)
+    resources.start_knowledge_warmup()
+    telemetry.start_log_exporter()
+    yield
+
+
+app = FastAPI(title="AgriDoc Enterprise API", lifespan=lifespan)
+
+
+def _diagnose(data, language):
+    return resources.get_agent().analyze(preprocess_image(data), language)
+
+
+def _diagnose_many(named_images, language):
+    results = [{"file": name, "diagnosis": None, "logged": False, "error": None} for name, _ in named_images]
+    images, positions = [], []
+    for position, (name, data) in enumerate(named_images):
+        try:
+            images.append(preprocess_image(data))
+            positions.append(position)
+        except Exception as e:
+            results[position]["error"] = f"Unreadable image: {e}"
+    for item in resources.get_agent().analyze_many(images, language):
+        results[positions[item.index]].update(diagnosis=item.diagnosis, logged=item.logged, error=item.error)
+    return results
+
+
+def _diagnose_queued(data, language):
+    queue = resources.get_job_queue()
+    return queue.wait(queue.submit(data, language))
+
+
+@app.get("/healthz")
+async def healthz():
+    client = resources.get_agent().models
+    models = client.stats()
+    degraded = any(m["circuit"] != "closed" for m in models.values())
+    return {"status": "degraded" if degraded else "ok", "model": Config.MODEL_NAME, "models": models,
+            "in_flight": client.in_flight()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus scrape endpoint: stage latency, bytes sent, tokens, cache lookups, store writes."""
+    return telemetry.render_prometheus()
+
+
+@app.post("/diagnose")
+async def diagnose(
+    file: Optional[UploadFile] = File(None),
+    files: Optional[List[UploadFile]] = File(None),
+    language: str = Form("English"),
+):
+    """
+    One image as `file` returns {"diagnosis", "logged"}; several images as
+    `files` return {"results": [...]} in upload order, each with its own error.
+    """
+    if file is not None:
+        data = await file.read()
+        if Config.JOB_QUEUE_ENABLED:
+            try:
+                job = await run_in_threadpool(_diagnose_queued, data, language)
+            except QueueFullError as e:
+                raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+            if job["status"] != "done":
+                status_code = {"timeout": 504, "invalid": 400}.get(job["status"], 500)
+                raise HTTPException(status_code=status_code, detail=job["error"])
+            return {"diagnosis": job["diagnosis"], "logged": job["logged"]}
+        try:
+            diagnosis, logged, ok = await run_in_threadpool(_diagnose, data, language)
+        except UnidentifiedImageError as e:
+            raise HTTPException(status_code=400, detail=f"Unreadable image: {e}")
+        except Exception as e:
+            logger.error(f"Diagnosis failed: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        if not ok:
+            # The model answered but the response could not be used; same as a failed queued job
+            raise HTTPException(status_code=500, detail=diagnosis)
+        return {"diagnosis": diagnosis, "logged": logged}
+
+    if files:
+        named_images = [(f.filename, await f.read()) for f in files]
+        return {"results": await run_in_threadpool(_diagnose_many, named_images, language)}
+
+    raise HTTPException(status_code=422, detail="Upload an image as 'file' or several as 'files'")
+
+
+@app.get("/outbreaks")
+async def outbreaks(limit: int = Query(20, ge=1, le=500)):
+    """Newest logged incidents."""
+    records = await run_in_threadpool(resources.get_registry().store.recent, limit)
+    return {"outbreaks": records}
+
+
+@app.get("/outbreaks/totals")
+async def outbreak_totals(dimension: str = Query("disease", pattern="^(disease|plant|severity)$"),
+                          day: Optional[str] = None):
+    """Incident totals per disease, plant or severity (all-time, or one YYYY-MM-DD day)."""
+    return {"totals": await run_in_threadpool(resources.get_registry().get_totals, dimension, day)}
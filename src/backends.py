@@ -0,0 +1,266 @@
+"""
+Model backends for PlantDoctorAgent.
+
+The agent talks to three models: one with the log_outbreak tool (also
+used as a chat for two-call streaming), one plain text model for the
+two-call summary, and one returning schema-constrained JSON (streamed or
+not) for single-call mode. A backend builds
+those models and the function-response message used to continue a chat.
+
+GeminiBackend wraps google.generativeai. FakeBackend is a deterministic
+local stand-in with the same duck-typed response objects, configurable
+latency, function calls and errors, for tests and offline benchmarks.
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+
+from src.config import Config
+
+
+class ModelBackend:
+    """`model_name` defaults to Config.MODEL_NAME (the resilience layer also asks for the fallback model)."""
+    def tool_model(self, tools, system_instruction, model_name=None):
+        raise NotImplementedError
+
+    def text_model(self, model_name=None):
+        raise NotImplementedError
+
+    def json_model(self, schema, system_instruction, model_name=None):
+        raise NotImplementedError
+
+    def function_response(self, name, response):
+        """Chat message carrying a tool result back to the model."""
+        raise NotImplementedError
+
+
+class GeminiBackend(ModelBackend):
+    def __init__(self, api_key=None, model_name=None):
+        import google.generativeai as genai
+        self._genai = genai
+        genai.configure(api_key=api_key or Config.GOOGLE_API_KEY)
+        self.model_name = model_name or Config.MODEL_NAME
+
+    def tool_model(self, tools, system_instruction, model_name=None):
+        return self._genai.GenerativeModel(
+            model_name=model_name or self.model_name, tools=tools, system_instruction=system_instruction
+        )
+
+    def text_model(self, model_name=None):
+        return self._genai.GenerativeModel(model_name or self.model_name)
+
+    def json_model(self, schema, system_instruction, model_name=None):
+        return self._genai.GenerativeModel(
+            model_name=model_name or self.model_name,
+            system_instruction=system_instruction,
+            generation_config={
+                'response_mime_type': 'application/json',
+                'response_schema': schema
+            }
+        )
+
+    def function_response(self, name, response):
+        protos = self._genai.protos
+        return protos.Content(parts=[protos.Part(
+            function_response=protos.FunctionResponse(name=name, response=response)
+        )])
+
+
+# === FAKE BACKEND ===
+FAKE_FINDINGS = [
+    ("Tomato", "Early Blight", 92.0, "High"),
+    ("Potato", "Late Blight", 88.0, "Critical"),
+    ("Wheat", "Rust", 81.0, "Medium"),
+    ("Grape", "Powdery Mildew", 76.0, "Medium"),
+    ("Tomato", "Healthy", 97.0, "Low"),
+]
+FAKE_REMEDIES = ["Neem oil spray", "Remove infected leaves", "Improve air circulation"]
+FAKE_IMAGE_TOKENS = 258  # what Gemini bills for one image up to 384 px per side
+
+
+class FakeFunctionCall:
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+
+class FakePart:
+    def __init__(self, text="", function_call=None):
+        self.text = text
+        self.function_call = function_call
+
+
+class FakeUsage:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    """Mimics a GenerateContentResponse (or one streamed chunk of it)."""
+    def __init__(self, parts, prompt_tokens=0):
+        self.parts = parts
+        self.candidates = [type("Candidate", (), {"content": type("Content", (), {"parts": parts})()})()]
+        self.usage_metadata = FakeUsage(prompt_tokens, sum(len(p.text) for p in parts) // 4)
+
+    @property
+    def text(self):
+        return "".join(p.text for p in self.parts)
+
+
+class FakeBackend(ModelBackend):
+    """
+    Deterministic local model. The finding is picked from FAKE_FINDINGS by
+    a hash of the image bytes, so the same image always gets the same
+    answer. Each call sleeps `latency` seconds (+/- `jitter` fraction);
+    streamed responses split the text into `chunks` pieces. A seeded
+    `slow_rate` fraction of calls take `slow_latency` instead (a latency
+    tail), and an `error_rate` fraction raise `error` ("unavailable",
+    "quota", "deadline" or "invalid"). Every call to a model named in
+    `down_models` fails. A request_options timeout shorter than the
+    latency ends the call with DeadlineExceeded, as the SDK does. With
+    call_functions=False the tool model never calls log_outbreak.
+    """
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error="unavailable",
+                 call_functions=True, chunks=4, seed=0, slow_rate=0.0, slow_latency=0.0, down_models=()):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error = error
+        self.call_functions = call_functions
+        self.chunks = chunks
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.down_models = set(down_models)
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def tool_model(self, tools, system_instruction, model_name=None):
+        return _FakeModel(self, "tool", model_name)
+
+    def text_model(self, model_name=None):
+        return _FakeModel(self, "text", model_name)
+
+    def json_model(self, schema, system_instruction, model_name=None):
+        return _FakeModel(self, "json", model_name)
+
+    def function_response(self, name, response):
+        return {"function_response": {"name": name, "response": response}}
+
+    def _simulate_call(self, model_name=None, request_options=None):
+        with self._lock:
+            self.calls += 1
+            fail = self._rng.random() < self.error_rate or (model_name or Config.MODEL_NAME) in self.down_models
+            delay = self.latency * (1 + self.jitter * (2 * self._rng.random() - 1))
+            if self._rng.random() < self.slow_rate:
+                delay = self.slow_latency
+        timeout = (request_options or {}).get("timeout")
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            from google.api_core import exceptions
+            raise exceptions.DeadlineExceeded("Simulated request timeout")
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise self._make_error()
+
+    def _make_error(self):
+        from google.api_core import exceptions
+        errors = {
+            "unavailable": exceptions.ServiceUnavailable,
+            "quota": exceptions.ResourceExhausted,
+            "deadline": exceptions.DeadlineExceeded,
+            "invalid": exceptions.InvalidArgument,
+        }
+        return errors[self.error]("Simulated model error")
+
+    @staticmethod
+    def finding(contents):
+        """(plant, disease, confidence, severity) for the image in a request."""
+        data = b""
+        for item in contents if isinstance(contents, list) else [contents]:
+            if isinstance(item, dict) and "data" in item:
+                data = item["data"]
+        digest = hashlib.sha256(data).digest()
+        return FAKE_FINDINGS[digest[0] % len(FAKE_FINDINGS)]
+
+    @staticmethod
+    def report(finding):
+        plant, disease, confidence, severity = finding
+        remedies = "\n".join(f"{i}. {r}" for i, r in enumerate(FAKE_REMEDIES, 1))
+        return f"{plant}: {disease} ({confidence:.0f}%, {severity}).\n\n{remedies}"
+
+
+class _FakeModel:
+    def __init__(self, backend, kind, model_name=None):
+        self.backend = backend
+        self.kind = kind
+        self.model_name = model_name
+
+    def _parts(self, contents):
+        plant, disease, confidence, severity = finding = FakeBackend.finding(contents)
+        if self.kind == "json":
+            return [FakePart(json.dumps({
+                "plant": plant, "disease": disease, "confidence": confidence, "severity": severity,
+                "diagnosis": f"{disease} detected on {plant}.", "remedies": FAKE_REMEDIES,
+            }))]
+        if self.kind == "tool" and disease != "Healthy" and self.backend.call_functions:
+            return [
+                FakePart(f"Lesion pattern consistent with {disease}."),
+                FakePart(function_call=FakeFunctionCall("log_outbreak", {
+                    "plant": plant, "disease": disease, "confidence": confidence, "severity": severity
+                })),
+            ]
+        return [FakePart(FakeBackend.report(finding))]
+
+    def generate_content(self, contents, stream=False, request_options=None, **kwargs):
+        self.backend._simulate_call(self.model_name, request_options)
+        if stream:
+            return self._stream(self._parts(contents))
+        return FakeResponse(self._parts(contents), prompt_tokens=FAKE_IMAGE_TOKENS)
+
+    def _stream(self, parts):
+        for part in parts:
+            if part.function_call or not part.text:
+                yield FakeResponse([part])
+                continue
+            size = max(1, -(-len(part.text) // self.backend.chunks))
+            for start in range(0, len(part.text), size):
+                yield FakeResponse([FakePart(part.text[start:start + size])])
+
+    def start_chat(self):
+        return _FakeChat(self)
+
+
+class _FakeChat:
+    def __init__(self, model):
+        self.model = model
+        self.finding = None
+
+    def send_message(self, content, stream=False, request_options=None, **kwargs):
+        self.model.backend._simulate_call(self.model.model_name, request_options)
+        if isinstance(content, dict) and "function_response" in content:
+            parts = [FakePart(FakeBackend.report(self.finding))]
+        else:
+            self.finding = FakeBackend.finding(content)
+            parts = self.model._parts(content)
+        if not stream:
+            return FakeResponse(parts)
+        return self.model._stream(parts)
+
+
+BACKENDS = {
+    "gemini": GeminiBackend,
+    "fake": lambda: FakeBackend(latency=Config.FAKE_MODEL_LATENCY, error_rate=Config.FAKE_MODEL_ERROR_RATE),
+}
+
+
+def create_backend(name=None):
+    name = (name or Config.MODEL_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown MODEL_BACKEND '{name}' (expected one of: {', '.join(BACKENDS)})")
+    return BACKENDS[name]()
@@ -0,0 +1,126 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def image_digest(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def make_cache_key(image_bytes: bytes, language: str, model_name: str) -> str:
+    """Content address for a diagnosis: image digest + language + model."""
+    return digest_cache_key(image_digest(image_bytes), language, model_name)
+
+
+def digest_cache_key(digest: str, language: str, model_name: str) -> str:
+    return f"{digest}:{language}:{model_name}"
+
+
+class DiagnosisCache:
+    """
+    Two-tier cache for (diagnosis_text, logged) results.
+
+    Tier 1 is a bounded in-process LRU. Tier 2 is an optional SQLite file
+    that survives Streamlit restarts. Both tiers honour the same TTL.
+    """
+    def __init__(self, max_entries=256, ttl_seconds=86400, db_path=None, disk_max_entries=10000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_max_entries = disk_max_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if db_path:
+            self._disk = sqlite3.connect(db_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS diagnosis_cache ("
+                "key TEXT PRIMARY KEY, text TEXT NOT NULL, logged INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._disk.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON diagnosis_cache(accessed)")
+            self._disk.commit()
+
+    def _expired(self, created):
+        return self.ttl_seconds > 0 and time.time() - created > self.ttl_seconds
+
+    def get(self, key):
+        """Returns the cached (text, logged) tuple, or None on a miss."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if self._expired(entry[2]):
+                    del self._memory[key]
+                else:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[0], entry[1]
+
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT text, logged, created FROM diagnosis_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    if self._expired(row[2]):
+                        self._disk.execute("DELETE FROM diagnosis_cache WHERE key = ?", (key,))
+                        self._disk.commit()
+                    else:
+                        self._disk.execute(
+                            "UPDATE diagnosis_cache SET accessed = ? WHERE key = ?", (time.time(), key)
+                        )
+                        self._disk.commit()
+                        self._remember(key, row[0], bool(row[1]), row[2])
+                        self.hits += 1
+                        return row[0], bool(row[1])
+
+            self.misses += 1
+            return None
+
+    def put(self, key, text, logged):
+        now = time.time()
+        with self._lock:
+            self._remember(key, text, logged, now)
+            if self._disk is not None:
+                try:
+                    self._disk.execute(
+                        "INSERT OR REPLACE INTO diagnosis_cache (key, text, logged, created, accessed) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (key, text, int(logged), now, now)
+                    )
+                    self._evict_disk()
+                    self._disk.commit()
+                except sqlite3.Error as e:
+                    logger.error(f"Cache write failed: {e}")
+
+    def _remember(self, key, text, logged, created):
+        self._memory[key] = (text, logged, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        if self.ttl_seconds > 0:
+            self._disk.execute(
+                "DELETE FROM diagnosis_cache WHERE created < ?", (time.time() - self.ttl_seconds,)
+            )
+        self._disk.execute(
+            "DELETE FROM diagnosis_cache WHERE key NOT IN "
+            "(SELECT key FROM diagnosis_cache ORDER BY accessed DESC LIMIT ?)",
+            (self.disk_max_entries,)
+        )
+
+    def stats(self):
+        """Hit/miss counters for the dashboard."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._memory),
+        }
@@ -0,0 +1,136 @@
+"""
+Outbreak clustering: repeat detections of one outbreak update one document.
+
+A field photographed 40 times is one outbreak, not 40. An incident joins
+an open outbreak of the same plant and disease (case-insensitive) if it
+comes within OUTBREAK_CLUSTER_WINDOW_HOURS of that outbreak's last
+detection and, when both sides have coordinates, within
+OUTBREAK_CLUSTER_RADIUS_KM. The outbreak keeps its first `timestamp` (so
+totals count it once, on its first day) and tracks `occurrences`,
+`last_seen` and the highest confidence and severity. Stores read by
+`last_seen`, so the monitor and analytics pick up every merge.
+
+ClusterIndex holds the open outbreaks in memory, so assigning an incident
+needs no store query. Each process has its own index, so two replicas can
+still open the same outbreak twice; compact_records() merges those, and
+history logged before clustering, in the compaction job.
+"""
+import datetime
+import math
+import threading
+
+from src.analytics import SEVERITIES
+from src.storage import last_seen
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def cluster_key(record):
+    return str(record.get("plant") or "").strip().lower(), str(record.get("disease") or "").strip().lower()
+
+
+def _has_location(record):
+    return record.get("latitude") is not None and record.get("longitude") is not None
+
+
+def _severity_rank(severity):
+    return SEVERITIES.index(severity) if severity in SEVERITIES else -1
+
+
+def merge(outbreak, incident):
+    """The outbreak document after absorbing `incident` (itself a single incident or an outbreak)."""
+    merged = dict(outbreak)
+    merged["occurrences"] = outbreak.get("occurrences", 1) + incident.get("occurrences", 1)
+    merged["confidence"] = max(outbreak.get("confidence") or 0, incident.get("confidence") or 0)
+    merged["severity"] = max(outbreak.get("severity"), incident.get("severity"), key=_severity_rank)
+    merged["timestamp"] = min(outbreak["timestamp"], incident["timestamp"])
+    merged["last_seen"] = max(last_seen(outbreak), last_seen(incident))
+    if not _has_location(outbreak) and _has_location(incident):
+        merged["latitude"], merged["longitude"] = incident["latitude"], incident["longitude"]
+    return merged
+
+
+class ClusterIndex:
+    """Open outbreaks by (plant, disease), for one store."""
+    SWEEP_EVERY = 1000  # assignments between sweeps of expired outbreaks
+
+    def __init__(self, window_hours=24.0, radius_km=0.0):
+        self.window = datetime.timedelta(hours=window_hours)
+        self.radius_km = radius_km
+        self._open = {}  # key -> [[doc_id, data], ...]
+        self._assigned = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(outbreaks) for outbreaks in self._open.values())
+
+    def _matches(self, outbreak, incident):
+        if incident["timestamp"] - last_seen(outbreak) > self.window:
+            return False
+        if self.radius_km and _has_location(outbreak) and _has_location(incident):
+            distance = haversine_km(outbreak["latitude"], outbreak["longitude"],
+                                    incident["latitude"], incident["longitude"])
+            return distance <= self.radius_km
+        return True
+
+    def _sweep(self, now):
+        for key in list(self._open):
+            alive = [o for o in self._open[key] if now - last_seen(o[1]) <= self.window]
+            if alive:
+                self._open[key] = alive
+            else:
+                del self._open[key]
+
+    def load(self, records, now=None):
+        """Indexes existing OPEN outbreak documents (store reads, with an "id" key)."""
+        now = now or datetime.datetime.now()
+        with self._lock:
+            for record in sorted(records, key=last_seen):
+                if record.get("status", "OPEN") != "OPEN" or now - last_seen(record) > self.window:
+                    continue
+                data = {k: v for k, v in record.items() if k != "id"}
+                self._open.setdefault(cluster_key(record), []).append([record["id"], data])
+
+    def assign(self, incident, new_id):
+        """
+        Returns (doc_id, data, merged): the open outbreak `incident` joins and
+        its updated document, or a new ID from new_id() and the incident itself.
+        """
+        with self._lock:
+            self._assigned += 1
+            if self._assigned % self.SWEEP_EVERY == 0:
+                self._sweep(incident["timestamp"])
+            outbreaks = self._open.setdefault(cluster_key(incident), [])
+            for outbreak in outbreaks:
+                if self._matches(outbreak[1], incident):
+                    outbreak[1] = merge(outbreak[1], incident)
+                    return outbreak[0], dict(outbreak[1]), True
+            doc_id = new_id()
+            outbreaks.append([doc_id, dict(incident)])
+            return doc_id, dict(incident), False
+
+
+def compact_records(records, window_hours=24.0, radius_km=0.0):
+    """
+    Folds duplicate OPEN outbreaks in `records` (store reads) into the
+    earliest one of each cluster. Returns ([(doc_id, data)] to rewrite,
+    [doc_id] to delete).
+    """
+    index = ClusterIndex(window_hours, radius_km)
+    updated, removed = {}, []
+    for record in sorted(records, key=lambda r: r["timestamp"]):
+        if record.get("status", "OPEN") != "OPEN":
+            continue
+        data = {k: v for k, v in record.items() if k != "id"}
+        doc_id, merged_data, merged = index.assign(data, lambda: record["id"])
+        if merged:
+            updated[doc_id] = merged_data
+            removed.append(record["id"])
+    return list(updated.items()), removed
@@ -13,9 +13,133 @@ class Config:
     
     # Use the Pro model (It is free with the API Key!)
     MODEL_NAME = "gemini-2.5-flash" 
+    # "gemini", or "fake" for a deterministic local model (tests, offline benchmarks)
+    MODEL_BACKEND = os.getenv("MODEL_BACKEND", "gemini")
+    FAKE_MODEL_LATENCY = float(os.getenv("FAKE_MODEL_LATENCY", "0"))
+    FAKE_MODEL_ERROR_RATE = float(os.getenv("FAKE_MODEL_ERROR_RATE", "0"))
     COLLECTION_NAME = "agridoc_outbreaks"
+
+    # Outbreak storage: "firestore" (production), "sqlite" or "memory" (offline / load tests)
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore")
+    SQLITE_PATH = os.getenv("SQLITE_PATH", "agridoc.db")
+    # Shards per Firestore counter document (each shard sustains ~1 write/sec)
+    COUNTER_SHARDS = int(os.getenv("COUNTER_SHARDS", "10"))
+
+    # Sidebar Outbreak Monitor (cached snapshot, incremental refresh)
+    MONITOR_REFRESH_SECONDS = float(os.getenv("MONITOR_REFRESH_SECONDS", "30"))
+    MONITOR_CAPACITY = int(os.getenv("MONITOR_CAPACITY", "200"))
+    # Re-read window behind the newest seen timestamp, covers late commits from other replicas
+    MONITOR_OVERLAP_SECONDS = float(os.getenv("MONITOR_OVERLAP_SECONDS", "60"))
+
+    # Write-behind buffer for outbreak logging (batched Firestore commits)
+    WRITE_BUFFER_ENABLED = os.getenv("WRITE_BUFFER_ENABLED", "true").lower() == "true"
+    WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "50"))  # capped at 500 by Firestore
+    WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "2.0"))
+    WRITE_MAX_RETRIES = int(os.getenv("WRITE_MAX_RETRIES", "5"))
+    # Local spool so queued incidents survive a crash; empty disables it
+    WRITE_SPOOL_PATH = os.getenv("WRITE_SPOOL_PATH", "agridoc_spool.jsonl")
+
+    # Outbreak clustering (src/clusters.py): repeat detections of one plant/disease update one outbreak
+    OUTBREAK_CLUSTERING = os.getenv("OUTBREAK_CLUSTERING", "true").lower() == "true"
+    OUTBREAK_CLUSTER_WINDOW_HOURS = float(os.getenv("OUTBREAK_CLUSTER_WINDOW_HOURS", "24"))  # since its last report
+    OUTBREAK_CLUSTER_RADIUS_KM = float(os.getenv("OUTBREAK_CLUSTER_RADIUS_KM", "5"))  # when both have coordinates
+    # How far back the in-memory index of open outbreaks is loaded on start
+    OUTBREAK_CLUSTER_LOOKBACK_DAYS = float(os.getenv("OUTBREAK_CLUSTER_LOOKBACK_DAYS", "7"))
+
+    # "single": one structured-output call per image; "two_call": tool call + summary call (legacy, for A/B)
+    DIAGNOSIS_MODE = os.getenv("DIAGNOSIS_MODE", "single")
+    LOG_CONFIDENCE_THRESHOLD = float(os.getenv("LOG_CONFIDENCE_THRESHOLD", "70"))
+    # Stream single-sample diagnoses token by token into the UI (same flow and cache as DIAGNOSIS_MODE)
+    STREAM_DIAGNOSIS = os.getenv("STREAM_DIAGNOSIS", "true").lower() == "true"
+
+    # Gemini call resilience (src/resilience.py): retries on 429 / 503, deadlines, hedging, breaker, fallback
+    MODEL_MAX_RETRIES = int(os.getenv("MODEL_MAX_RETRIES", "4"))
+    MODEL_BACKOFF_BASE = float(os.getenv("MODEL_BACKOFF_BASE", "1.0"))
+    MODEL_BACKOFF_MAX = float(os.getenv("MODEL_BACKOFF_MAX", "20"))
+    MODEL_ATTEMPT_TIMEOUT = float(os.getenv("MODEL_ATTEMPT_TIMEOUT", "30"))
+    MODEL_CALL_DEADLINE = float(os.getenv("MODEL_CALL_DEADLINE", "90"))  # whole call, retries included
+    MODEL_HEDGE_ENABLED = os.getenv("MODEL_HEDGE_ENABLED", "false").lower() == "true"
+    MODEL_HEDGE_MIN_DELAY = float(os.getenv("MODEL_HEDGE_MIN_DELAY", "2.0"))  # or the observed p95, if later
+    BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+    BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+    # Used when MODEL_NAME keeps failing; empty disables fallback
+    FALLBACK_MODEL_NAME = os.getenv("FALLBACK_MODEL_NAME", "gemini-2.0-flash")
+    BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+
+    # Client-side quota per model (src/rate_limit.py); 0 disables that limit
+    RATE_LIMIT_RPM = int(os.getenv("RATE_LIMIT_RPM", "0"))
+    RATE_LIMIT_TPM = int(os.getenv("RATE_LIMIT_TPM", "0"))
+    RATE_LIMIT_TOKENS_PER_CALL = int(os.getenv("RATE_LIMIT_TOKENS_PER_CALL", "1000"))  # settled with actual usage
+    RATE_LIMIT_BURST_FRACTION = float(os.getenv("RATE_LIMIT_BURST_FRACTION", "0.1"))
+    RATE_LIMIT_BULK_RESERVE = float(os.getenv("RATE_LIMIT_BULK_RESERVE", "0.2"))  # kept for interactive calls
+    # "local" (per process) or "sqlite" (shared by every process using RATE_LIMIT_DB_PATH)
+    RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "local")
+    RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH", "agridoc_ratelimit.db")
+
+    # Prescription PDFs (src/report.py); the Docker image ships fonts-noto-core
+    REPORT_FONT_DIRS = os.getenv(
+        "REPORT_FONT_DIRS", "/usr/share/fonts/truetype/noto:/usr/share/fonts/truetype/dejavu"
+    )
+    REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "128"))
+    REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "0"))  # batch rendering processes; 0 = one per CPU
+
+    # Knowledge cache (src/knowledge.py): vetted remedy text per (plant, disease, language)
+    KNOWLEDGE_ENABLED = os.getenv("KNOWLEDGE_ENABLED", "true").lower() == "true"
+    KNOWLEDGE_DB_PATH = os.getenv("KNOWLEDGE_DB_PATH", "")  # e.g. agridoc_knowledge.db; empty = memory only
+    KNOWLEDGE_VERSION = os.getenv("KNOWLEDGE_VERSION", "1")  # bump to invalidate every entry
+    # Cached text is only used when the model is at least this confident in the disease
+    KNOWLEDGE_MIN_CONFIDENCE = float(os.getenv("KNOWLEDGE_MIN_CONFIDENCE", "85"))
+    KNOWLEDGE_WARMUP_TOP_N = int(os.getenv("KNOWLEDGE_WARMUP_TOP_N", "0"))  # > 0: warm up in the background on start
+    # Report languages offered in the UI (and pre-populated by knowledge warm-up)
+    LANGUAGES = os.getenv("LANGUAGES", "English,Hindi,Spanish,Telugu").split(",")
+
+    # Job queue: single-sample diagnoses run on a fixed worker pool instead of the session thread
+    JOB_QUEUE_ENABLED = os.getenv("JOB_QUEUE_ENABLED", "false").lower() == "true"
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+    JOB_QUEUE_MAX_DEPTH = int(os.getenv("JOB_QUEUE_MAX_DEPTH", "32"))
+    JOB_TIMEOUT_SECONDS = float(os.getenv("JOB_TIMEOUT_SECONDS", "120"))
+    # SQLite file for a durable queue; empty keeps jobs in memory only
+    JOB_DB_PATH = os.getenv("JOB_DB_PATH", "")
+
+    # Image preprocessing before Gemini (smaller payload, fewer image tokens)
+    IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1024"))
+    JPEG_QUALITY = int(os.getenv("JPEG_QUALITY", "85"))
+    IMAGE_CROP = os.getenv("IMAGE_CROP", "none")  # "none", "center" or "leaf"
+    IMAGE_CENTER_FRACTION = float(os.getenv("IMAGE_CENTER_FRACTION", "0.8"))
+    # Already-small JPEGs up to this size are sent as-is
+    IMAGE_PASSTHROUGH_BYTES = int(os.getenv("IMAGE_PASSTHROUGH_BYTES", "400000"))
+
+    # Tiled analysis of drone / high-resolution field images (src/tiling.py)
+    TILE_SIZE = int(os.getenv("TILE_SIZE", "1024"))  # tile side in pixels of the original image
+    TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.2"))
+    TILE_MAX_CALLS = int(os.getenv("TILE_MAX_CALLS", "12"))  # model calls per image, at most
+    # Prefilter on a downscaled copy: tiles with too little plant material or no lesion colours are skipped
+    TILE_PREFILTER_EDGE = int(os.getenv("TILE_PREFILTER_EDGE", "1536"))
+    TILE_MIN_PLANT = float(os.getenv("TILE_MIN_PLANT", "0.15"))
+    TILE_MIN_LESION = float(os.getenv("TILE_MIN_LESION", "0.002"))
+
+    # Diagnosis cache (keyed on image hash + language + model)
+    CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "256"))
+    CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "86400"))
+    # Set to a file path (e.g. /tmp/agridoc_cache.db) to keep results across restarts
+    CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "")
+    CACHE_DISK_MAX_ENTRIES = int(os.getenv("CACHE_DISK_MAX_ENTRIES", "10000"))
+
+    # Near-duplicate detection (perceptual hash of previously diagnosed samples)
+    PHASH_ENABLED = os.getenv("PHASH_ENABLED", "true").lower() == "true"
+    PHASH_ALGORITHM = os.getenv("PHASH_ALGORITHM", "dhash")  # "dhash" or "phash"
+    PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "6"))
+    # "reuse" serves the earlier diagnosis, "flag" only reports the match
+    PHASH_MODE = os.getenv("PHASH_MODE", "reuse")
+    PHASH_INDEX_PATH = os.getenv("PHASH_INDEX_PATH", "")
+
+    # Telemetry: per-stage latency metrics (Prometheus text), optional OpenTelemetry spans
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+    # Log a metrics snapshot every N seconds (0 = off; the API also serves GET /metrics)
+    METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "0"))
     
     @staticmethod
     def validate():
-        if not Config.PROJECT_ID:
+        if Config.STORAGE_BACKEND == "firestore" and not Config.PROJECT_ID:
             raise ValueError("GOOGLE_CLOUD_PROJECT environment variable is not set.")
\ No newline at end of file
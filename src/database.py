@@ -1,45 +1,186 @@
-from google.cloud import firestore
 from src.config import Config
+from src.storage import create_store, is_shared_store, last_seen
+from src.write_buffer import IncidentWriteBuffer
+from src.clusters import ClusterIndex, compact_records
+from src import telemetry
+from concurrent.futures import Future
 import datetime
 import logging
+import threading
+import time
 
 # Configure Professional Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# One write-behind buffer per store, shared by every registry instance on it
+# (Streamlit builds a registry per session; they must not race on the spool file).
+# Only the process-wide stores spool to WRITE_SPOOL_PATH.
+_write_buffers = {}
+_write_buffer_lock = threading.Lock()
+
+def _get_write_buffer(store):
+    with _write_buffer_lock:
+        buffer = _write_buffers.get(id(store))
+        if buffer is None:
+            spool_path = Config.WRITE_SPOOL_PATH if is_shared_store(store) else None
+            buffer = _write_buffers[id(store)] = IncidentWriteBuffer(
+                store,
+                batch_size=Config.WRITE_BATCH_SIZE,
+                flush_interval=Config.WRITE_FLUSH_INTERVAL,
+                spool_path=spool_path or None,
+                max_retries=Config.WRITE_MAX_RETRIES
+            )
+        return buffer
+
+# Open outbreaks per store, loaded once from the store and then kept current in memory
+_cluster_indexes = {}
+_cluster_index_lock = threading.Lock()
+
+def _get_cluster_index(store):
+    with _cluster_index_lock:
+        index = _cluster_indexes.get(id(store))
+        if index is None:
+            index = ClusterIndex(Config.OUTBREAK_CLUSTER_WINDOW_HOURS, Config.OUTBREAK_CLUSTER_RADIUS_KM)
+            cursor = datetime.datetime.now() - datetime.timedelta(days=Config.OUTBREAK_CLUSTER_LOOKBACK_DAYS)
+            try:
+                while True:
+                    page = store.since(cursor, limit=1000)
+                    index.load(page)
+                    if len(page) < 1000 or last_seen(page[-1]) <= cursor:
+                        break
+                    cursor = last_seen(page[-1])
+            except Exception as e:
+                logger.error(f"Loading open outbreaks failed, starting empty: {e}")
+            _cluster_indexes[id(store)] = index
+            logger.info(f"Outbreak index: {len(index)} open outbreaks")
+        return index
+
 class OutbreakRegistry:
     """
     MCP Tool: Handles persistent storage of disease outbreaks.
+    The backing store (Firestore, SQLite or in-memory) is picked by Config.STORAGE_BACKEND.
+    With OUTBREAK_CLUSTERING, repeat detections update one outbreak document (src/clusters.py).
     """
-    def __init__(self):
-        self.db = firestore.Client(project=Config.PROJECT_ID)
-        self.collection = self.db.collection(Config.COLLECTION_NAME)
+    def __init__(self, store=None):
+        self.store = store or create_store()
 
-    def log_incident(self, plant: str, disease: str, confidence: float, severity: str):
+    def log_incident(self, plant: str, disease: str, confidence: float, severity: str,
+                     latitude: float = None, longitude: float = None):
         """
         Logs a confirmed disease incident to the database.
+        With the write buffer enabled this returns a QUEUED acknowledgement
+        immediately; the document is committed in the next batch flush.
         """
         try:
-            data = {
-                "timestamp": datetime.datetime.now(),
-                "plant": plant,
-                "disease": disease,
-                "confidence": confidence,
-                "severity": severity,
-                "status": "OPEN"
-            }
-            doc_ref = self.collection.document()
-            doc_ref.set(data)
-            logger.info(f"Incident logged: {doc_ref.id}")
-            return f"SUCCESS: Logged {disease} outbreak with ID {doc_ref.id}"
+            future = self.log_incident_async(plant, disease, confidence, severity, latitude, longitude)
+            status = "QUEUED" if Config.WRITE_BUFFER_ENABLED else "SUCCESS"
+            doc_id = future.doc_id if Config.WRITE_BUFFER_ENABLED else future.result()
+            if future.occurrences > 1:
+                return f"{status}: Added to open {disease} outbreak {doc_id} ({future.occurrences} reports)"
+            return f"{status}: Logged {disease} outbreak with ID {doc_id}"
         except Exception as e:
             logger.error(f"Database Error: {e}")
             return "ERROR: Failed to log incident."
 
+    def log_incident_async(self, plant: str, disease: str, confidence: float, severity: str,
+                           latitude: float = None, longitude: float = None):
+        """
+        Same as log_incident, but returns a Future that resolves to the
+        document ID once the write is committed. The ID itself is generated
+        client-side and available right away as `future.doc_id`, the
+        outbreak's report count as `future.occurrences`.
+        """
+        now = datetime.datetime.now()
+        data = {
+            "timestamp": now,
+            "plant": plant,
+            "disease": disease,
+            "confidence": confidence,
+            "severity": severity,
+            "status": "OPEN",
+            "occurrences": 1,
+            "last_seen": now,
+        }
+        if latitude is not None and longitude is not None:
+            data["latitude"], data["longitude"] = latitude, longitude
+        with telemetry.span("log_incident"):
+            merged = False
+            if Config.OUTBREAK_CLUSTERING:
+                doc_id, data, merged = _get_cluster_index(self.store).assign(data, self.store.new_id)
+            else:
+                doc_id = self.store.new_id()
+            if Config.WRITE_BUFFER_ENABLED:
+                future = _get_write_buffer(self.store).submit(doc_id, data, update=merged)
+                logger.info(f"Incident queued: {doc_id}")
+            else:
+                start = time.perf_counter()
+                if merged:
+                    self.store.update_many([(doc_id, data)])
+                else:
+                    self.store.write(doc_id, data)
+                telemetry.record_store_write(self.store, 1, time.perf_counter() - start)
+                logger.info(f"Incident logged: {doc_id}")
+                future = Future()
+                future.set_result(doc_id)
+        future.doc_id = doc_id
+        future.occurrences = data["occurrences"]
+        return future
+
+    def get_totals(self, dimension="disease", day=None):
+        """
+        Incident totals per disease / plant / severity, all-time or for one
+        "YYYY-MM-DD" day. On Firestore these come from sharded counters.
+        """
+        try:
+            return self.store.count_by(dimension, day)
+        except Exception as e:
+            logger.error(f"Totals query failed: {e}")
+            return {}
+
+    def reconcile_counters(self):
+        """Rebuilds pre-aggregated counters from raw incidents (Firestore only)."""
+        rebuild = getattr(self.store, "rebuild_counters", None)
+        if rebuild is None:
+            logger.info("Backend aggregates on read; nothing to reconcile")
+            return 0
+        return rebuild()
+
+    def compact(self, since=None, page_size=1000):
+        """
+        Compaction job: merges duplicate OPEN outbreaks already in the store
+        (history from before clustering, or ones opened by different
+        replicas) into the earliest document of each cluster and deletes the
+        rest. Returns (outbreaks updated, documents deleted).
+        """
+        if Config.WRITE_BUFFER_ENABLED:
+            _get_write_buffer(self.store).flush()
+        records = {}
+        cursor = since or datetime.datetime.fromtimestamp(0)
+        while True:
+            page = self.store.since(cursor, limit=page_size)
+            records.update((r["id"], r) for r in page)
+            if len(page) < page_size or last_seen(page[-1]) <= cursor:
+                break
+            cursor = last_seen(page[-1])
+
+        updates, removed = compact_records(
+            records.values(), Config.OUTBREAK_CLUSTER_WINDOW_HOURS, Config.OUTBREAK_CLUSTER_RADIUS_KM
+        )
+        if updates:
+            self.store.update_many(updates)
+        if removed:
+            self.store.delete_many(removed)
+            self.reconcile_counters()
+        with _cluster_index_lock:
+            _cluster_indexes.pop(id(self.store), None)  # reloaded from the compacted store on the next log
+        logger.info(f"Compacted {len(records)} documents into {len(records) - len(removed)}")
+        return len(updates), len(removed)
+
     def get_recent_stats(self):
         """Fetches recent stats for the dashboard."""
         try:
-            docs = self.collection.order_by("timestamp", direction=firestore.Query.DESCENDING).limit(5).stream()
+            docs = self.store.recent(limit=5)
             return [{"Plant": d.get("plant"), "Disease": d.get("disease"), "Severity": d.get("severity")} for d in docs]
         except Exception:
             return []
\ No newline at end of file
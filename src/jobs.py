@@ -0,0 +1,307 @@
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+JOB_STATES = ("queued", "running", "done", "failed", "invalid", "timeout")
+FINISHED_STATES = ("done", "failed", "invalid", "timeout")
+
+
+class QueueFullError(Exception):
+    """Raised by JobQueue.submit when a job is not admitted; callers should retry later."""
+
+
+class InvalidJobError(ValueError):
+    """Raised by a handler for a payload that can never succeed (e.g. not an image); the job ends "invalid"."""
+
+
+class Job:
+    """One diagnosis request and its outcome."""
+    def __init__(self, job_id, payload, language, submitted, deadline):
+        self.id = job_id
+        self.payload = payload
+        self.language = language
+        self.status = "queued"
+        self.diagnosis = None
+        self.logged = False
+        self.error = None
+        self.submitted = submitted
+        self.deadline = deadline
+        self.started = None
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "language": self.language,
+            "diagnosis": self.diagnosis,
+            "logged": self.logged,
+            "error": self.error,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class _JobLog:
+    """SQLite record of every job, so queued work survives a restart and results can be polled."""
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, language TEXT NOT NULL, payload BLOB, "
+            "diagnosis TEXT, logged INTEGER NOT NULL DEFAULT 0, error TEXT, "
+            "submitted REAL NOT NULL, deadline REAL NOT NULL, started REAL, finished REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, submitted)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def insert(self, job):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, language, payload, submitted, deadline) VALUES (?, ?, ?, ?, ?, ?)",
+                (job.id, job.status, job.language, job.payload, job.submitted, job.deadline)
+            )
+            self._conn.commit()
+
+    def update(self, job):
+        # The payload is kept until the job finishes, so a job running at a crash can be re-run
+        payload = job.payload if job.status not in FINISHED_STATES else None
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, payload = ?, diagnosis = ?, logged = ?, error = ?, "
+                "started = ?, finished = ? WHERE id = ?",
+                (job.status, payload, job.diagnosis, int(job.logged), job.error,
+                 job.started, job.finished, job.id)
+            )
+            self._conn.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, language, diagnosis, logged, error, submitted, deadline, started, finished "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = Job(row[0], None, row[2], row[6], row[7])
+        job.status, job.diagnosis, job.logged, job.error = row[1], row[3], bool(row[4]), row[5]
+        job.started, job.finished = row[8], row[9]
+        return job
+
+    def pending(self):
+        """Jobs that were queued or running when the previous process stopped, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, language, payload, submitted, deadline FROM jobs "
+                "WHERE status IN ('queued', 'running') ORDER BY submitted"
+            ).fetchall()
+        return [Job(r[0], r[2], r[1], r[3], r[4]) for r in rows]
+
+
+class JobQueue:
+    """
+    Bounded diagnosis queue served by a fixed pool of worker threads.
+
+    `handler(payload, language)` must return (diagnosis_text, logged).
+    submit() applies admission control: it raises QueueFullError when
+    `max_depth` jobs are already waiting, or when the current backlog means
+    the job could not start before its timeout. A job that is still waiting
+    or running when its timeout passes is reported as "timeout"; a running
+    handler cannot be interrupted, so its late result is discarded, but its
+    worker counts as busy (for admission and metrics) until it returns.
+
+    With `db_path`, jobs are also recorded in SQLite: work queued before a
+    restart is picked up again and results can be polled by ID afterwards.
+    """
+    def __init__(self, handler, workers=4, max_depth=32, timeout=120.0, db_path=None, retain=1000):
+        self.handler = handler
+        self.workers = workers
+        self.max_depth = max_depth
+        self.timeout = timeout
+        self.retain = retain
+
+        self._pending = deque()
+        self._jobs = OrderedDict()  # id -> Job, queued/running plus the newest finished ones
+        self._cond = threading.Condition()
+        self._threads = []
+        self._closed = False
+        self._wait_ms = deque(maxlen=500)
+        self._run_ms = deque(maxlen=500)
+        self._counts = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "invalid": 0, "timeout": 0}
+        self._busy = 0  # workers inside the handler, timed-out jobs included
+
+        self._log = _JobLog(db_path) if db_path else None
+        if self._log is not None:
+            recovered = self._log.pending()
+            for job in recovered:
+                # Restart downtime doesn't count against the recovered job's timeout
+                job.status, job.deadline = "queued", time.time() + self.timeout
+                self._jobs[job.id] = job
+                self._pending.append(job)
+            if recovered:
+                logger.info(f"Recovered {len(recovered)} queued jobs")
+                self._start_workers()
+
+    # === WORKERS ===
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"diagnosis-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._pending:
+                    return
+                job = self._pending.popleft()
+                now = time.time()
+                if now > job.deadline:
+                    self._finish(job, "timeout", error="Timed out waiting in queue")
+                    continue
+                job.status, job.started = "running", now
+                self._busy += 1
+                self._wait_ms.append((now - job.submitted) * 1000)
+            if self._log is not None:
+                self._log.update(job)
+
+            try:
+                diagnosis, logged = self.handler(job.payload, job.language)
+                status, error = "done", None
+            except InvalidJobError as e:
+                logger.warning(f"Job {job.id} rejected: {e}")
+                diagnosis, logged, status, error = None, False, "invalid", str(e)
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {e}")
+                diagnosis, logged, status, error = None, False, "failed", str(e)
+
+            with self._cond:
+                self._busy -= 1
+                if status != "invalid":  # rejected inputs fail fast and would skew the median run time
+                    self._run_ms.append((time.time() - job.started) * 1000)
+                if job.status == "timeout" or time.time() > job.deadline:
+                    self._finish(job, "timeout", error=f"Timed out after {self.timeout:.0f}s")
+                else:
+                    job.diagnosis, job.logged = diagnosis, logged
+                    self._finish(job, status, error=error)
+
+    def _finish(self, job, status, error=None):
+        """Marks a job finished (caller holds _cond) and trims retained results."""
+        already_timed_out = job.status == "timeout"
+        job.status, job.error, job.payload = status, error, None
+        job.finished = job.finished or time.time()
+        if not already_timed_out:
+            self._counts[status] += 1
+        self._cond.notify_all()
+        if self._log is not None:
+            self._log.update(job)
+        finished = [k for k, j in self._jobs.items() if j.status in FINISHED_STATES]
+        for key in finished[:max(0, len(finished) - self.retain)]:
+            del self._jobs[key]
+
+    # === CLIENT API ===
+    def submit(self, payload, language="English"):
+        """Enqueues a diagnosis and returns its job ID. Raises QueueFullError under backpressure."""
+        with self._cond:
+            if self._closed:
+                raise QueueFullError("Queue is shut down")
+            depth = len(self._pending)
+            if depth >= self.max_depth:
+                self._counts["rejected"] += 1
+                raise QueueFullError(f"Queue full ({depth} jobs waiting)")
+            if self._run_ms:
+                # Expected wait if every worker drains the backlog (and the jobs still
+                # running, timed out or not) at the median run time
+                run_ms = sorted(self._run_ms)[len(self._run_ms) // 2]
+                expected = ((depth + self._busy) // self.workers + 1) * run_ms / 1000
+                if expected > self.timeout:
+                    self._counts["rejected"] += 1
+                    raise QueueFullError(f"Estimated wait {expected:.0f}s exceeds the {self.timeout:.0f}s timeout")
+
+            now = time.time()
+            job = Job(uuid.uuid4().hex, payload, language, now, now + self.timeout)
+            if self._log is not None:
+                self._log.insert(job)
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._counts["submitted"] += 1
+            self._start_workers()
+            self._cond.notify()
+            return job.id
+
+    def _expire(self, job):
+        if job.status in ("queued", "running") and time.time() > job.deadline:
+            if job.status == "queued":
+                self._pending.remove(job)
+            self._finish(job, "timeout", error=f"Timed out after {self.timeout:.0f}s")
+
+    def get(self, job_id):
+        """Job state as a dict, or None for an unknown ID."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._expire(job)
+                info = job.to_dict()
+                if job.status == "queued":
+                    info["position"] = self._pending.index(job) + 1
+                return info
+        if self._log is not None:
+            job = self._log.get(job_id)
+            return job.to_dict() if job is not None else None
+        return None
+
+    def wait(self, job_id, timeout=None):
+        """Blocks until the job has finished (or `timeout` seconds pass) and returns get(job_id)."""
+        end = None if timeout is None else time.time() + timeout
+        with self._cond:
+            job = self._jobs.get(job_id)
+            while job is not None and job.status not in FINISHED_STATES:
+                self._expire(job)
+                if job.status in FINISHED_STATES:
+                    break
+                remaining = job.deadline - time.time()
+                if end is not None:
+                    remaining = min(remaining, end - time.time())
+                    if remaining <= 0:
+                        break
+                self._cond.wait(max(remaining, 0.01))
+        return self.get(job_id)
+
+    def metrics(self):
+        """Queue depth, busy workers, outcome counters and p50/p95 wait and run latency (ms)."""
+        def percentiles(samples):
+            if not samples:
+                return None, None
+            ordered = sorted(samples)
+            return ordered[len(ordered) // 2], ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+        with self._cond:
+            wait_p50, wait_p95 = percentiles(self._wait_ms)
+            run_p50, run_p95 = percentiles(self._run_ms)
+            return dict(
+                self._counts,
+                depth=len(self._pending),
+                running=self._busy,
+                workers=self.workers,
+                wait_p50_ms=wait_p50, wait_p95_ms=wait_p95,
+                run_p50_ms=run_p50, run_p95_ms=run_p95,
+            )
+
+    def close(self, wait=True):
+        """Stops accepting jobs; workers drain what is already queued."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
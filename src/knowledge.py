@@ -0,0 +1,157 @@
+"""
+Knowledge cache: vetted diagnosis and remedy text per (plant, disease, language).
+
+The description and the "3 organic remedies" for a common disease are
+the same every time. When the model reports a disease it is confident
+about and an entry exists, the agent builds the report from the entry and
+skips the summary call (two-call mode) or the chat continuation
+(streaming).
+
+Entries come from warm-up, which asks the model once per missing (plant,
+disease, language) for the top N diseases, or from an agronomist-reviewed
+JSON import. Every entry stores the KNOWLEDGE_VERSION it was written
+under, and every version keeps its own rows: bumping the version
+invalidates everything at once, and rolling it back finds the earlier
+entries again. invalidate() drops single diseases or languages.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Used for warm-up before the registry has enough history to rank diseases
+DEFAULT_TOP_DISEASES = [
+    ("Tomato", "Early Blight"),
+    ("Tomato", "Late Blight"),
+    ("Potato", "Late Blight"),
+    ("Grape", "Powdery Mildew"),
+    ("Wheat", "Rust"),
+    ("Rice", "Blast"),
+    ("Maize", "Northern Leaf Blight"),
+    ("Apple", "Scab"),
+    ("Cucumber", "Downy Mildew"),
+    ("Chili", "Leaf Curl"),
+]
+
+
+# One row per entry and version, so a rollback to an earlier KNOWLEDGE_VERSION still finds its entries
+_TABLE_SQL = (
+    "CREATE TABLE IF NOT EXISTS {table} ("
+    "plant TEXT NOT NULL, disease TEXT NOT NULL, language TEXT NOT NULL, version TEXT NOT NULL, "
+    "diagnosis TEXT NOT NULL, remedies TEXT NOT NULL, source TEXT NOT NULL, created REAL NOT NULL, "
+    "PRIMARY KEY (plant, disease, language, version))"
+)
+
+
+def _key(plant, disease, language):
+    return plant.strip().lower(), disease.strip().lower(), language.strip().lower()
+
+
+class KnowledgeCache:
+    """In-memory map over an optional SQLite file; entries from another version are ignored."""
+    def __init__(self, db_path=None, version=None):
+        self.version = Config.KNOWLEDGE_VERSION if version is None else version
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}  # key -> entry, current version only
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(_TABLE_SQL.format(table="knowledge"))
+            self._migrate()
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT plant, disease, language, diagnosis, remedies, source, created FROM knowledge "
+                "WHERE version = ?", (self.version,)
+            ).fetchall()
+            for plant, disease, language, diagnosis, remedies, source, created in rows:
+                self._entries[(plant, disease, language)] = {
+                    "diagnosis": diagnosis, "remedies": json.loads(remedies), "source": source, "created": created,
+                }
+
+    def _migrate(self):
+        # Tables from before versioned keys held one row per entry; rebuild them keyed by version too
+        primary_key = {row[1] for row in self._db.execute("PRAGMA table_info(knowledge)") if row[5]}
+        if "version" in primary_key:
+            return
+        logger.info("Migrating the knowledge table to versioned keys")
+        self._db.execute(_TABLE_SQL.format(table="knowledge_versioned"))
+        self._db.execute("INSERT INTO knowledge_versioned SELECT plant, disease, language, version, diagnosis, "
+                         "remedies, source, created FROM knowledge")
+        self._db.execute("DROP TABLE knowledge")
+        self._db.execute("ALTER TABLE knowledge_versioned RENAME TO knowledge")
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, plant, disease, language):
+        """{"diagnosis", "remedies", "source", "created"} or None."""
+        with self._lock:
+            entry = self._entries.get(_key(plant, disease, language))
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def put(self, plant, disease, language, diagnosis, remedies, source="warmup"):
+        key = _key(plant, disease, language)
+        entry = {"diagnosis": diagnosis, "remedies": list(remedies), "source": source, "created": time.time()}
+        with self._lock:
+            self._entries[key] = entry
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO knowledge VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    key + (self.version, diagnosis, json.dumps(entry["remedies"], ensure_ascii=False),
+                           source, entry["created"])
+                )
+                self._db.commit()
+
+    def invalidate(self, plant=None, disease=None, language=None):
+        """
+        Drops the entries matching every given field (all of them if none is
+        given), in every version on disk. Returns the in-memory count.
+        """
+        wanted = {i: v.strip().lower() for i, v in enumerate((plant, disease, language)) if v}
+        with self._lock:
+            doomed = [k for k in self._entries if all(k[i] == v for i, v in wanted.items())]
+            for key in doomed:
+                del self._entries[key]
+            if self._db is not None:
+                columns = ("plant", "disease", "language")
+                where = " AND ".join(f"{columns[i]} = ?" for i in wanted) or "1"
+                self._db.execute(f"DELETE FROM knowledge WHERE {where}", tuple(wanted.values()))
+                self._db.commit()
+        return len(doomed)
+
+    def import_entries(self, entries):
+        """Loads reviewed entries: dicts with plant, disease, language, diagnosis and remedies."""
+        for e in entries:
+            self.put(e["plant"], e["disease"], e["language"], e["diagnosis"], e["remedies"], source="vetted")
+        return len(entries)
+
+    def warm_up(self, pairs, languages, generate):
+        """
+        Fills in every missing (plant, disease) x language with
+        generate(plant, disease, language) -> (diagnosis, remedies).
+        Failures are logged and skipped. Returns the number of entries added.
+        """
+        added = 0
+        for plant, disease in pairs:
+            for language in languages:
+                if _key(plant, disease, language) in self._entries:
+                    continue
+                try:
+                    diagnosis, remedies = generate(plant, disease, language)
+                except Exception as e:
+                    logger.warning(f"Knowledge warm-up failed for {plant}/{disease}/{language}: {e}")
+                    continue
+                self.put(plant, disease, language, diagnosis, remedies)
+                added += 1
+        return added
@@ -0,0 +1,88 @@
+import datetime
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from src.storage import last_seen
+
+logger = logging.getLogger(__name__)
+
+
+class OutbreakMonitor:
+    """
+    Cached, incrementally refreshed view of recent incidents for the sidebar.
+
+    The first refresh loads the `capacity` most recently reported incidents;
+    later refreshes only ask the store for documents whose `last_seen` is at
+    or after the newest one seen, minus `overlap_seconds`, so outbreaks that
+    absorbed a new report come back too. The overlap catches documents
+    committed late by other replicas (write-behind buffers, clock skew);
+    re-fetched documents replace the old copy by ID. Everything is kept in a
+    bounded ring buffer.
+    """
+    def __init__(self, store, refresh_interval=30.0, capacity=200, overlap_seconds=60.0, page_size=500):
+        self.store = store
+        self.refresh_interval = refresh_interval
+        self.capacity = capacity
+        self.overlap = datetime.timedelta(seconds=overlap_seconds)
+        self.page_size = page_size
+
+        self._records = OrderedDict()  # id -> record
+        self._newest = None
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    def _merge(self, records):
+        with self._lock:
+            for record in records:
+                self._records[record["id"]] = record
+                if self._newest is None or last_seen(record) > self._newest:
+                    self._newest = last_seen(record)
+            if len(self._records) > self.capacity:
+                # Late arrivals are appended out of order, so evict by last report, not insertion
+                newest = sorted(self._records.values(), key=last_seen)[-self.capacity:]
+                self._records = OrderedDict((r["id"], r) for r in newest)
+
+    def refresh(self):
+        """Pulls new incidents from the store. Only one caller refreshes at a time."""
+        if not self._refreshing.acquire(blocking=False):
+            return
+        try:
+            page = None
+            if self._newest is not None:
+                page = self.store.since(self._newest - self.overlap, limit=self.page_size)
+            if page is None or len(page) >= self.page_size:
+                # Cold start, or so much new data that a full reload of the newest rows is cheaper
+                self._merge(reversed(self.store.recent(limit=self.capacity)))
+            else:
+                self._merge(page)
+            self._refreshed_at = time.time()
+        except Exception as e:
+            # Keep serving the last good snapshot; its age tells the dashboard it is stale
+            logger.error(f"Monitor refresh failed: {e}")
+        finally:
+            self._refreshing.release()
+
+    def snapshot_age(self):
+        """Seconds since the last successful refresh, or None if never refreshed."""
+        if self._refreshed_at is None:
+            return None
+        return time.time() - self._refreshed_at
+
+    def snapshot(self, limit=None):
+        """Most recently reported first, refreshing first if the snapshot is older than refresh_interval."""
+        age = self.snapshot_age()
+        if age is None or age >= self.refresh_interval:
+            self.refresh()
+        with self._lock:
+            records = sorted(self._records.values(), key=last_seen, reverse=True)
+        return records[:limit] if limit else records
+
+    def recent_stats(self, limit=5):
+        """Same rows as OutbreakRegistry.get_recent_stats, served from the snapshot."""
+        return [
+            {"Plant": d.get("plant"), "Disease": d.get("disease"), "Severity": d.get("severity")}
+            for d in self.snapshot(limit)
+        ]
@@ -0,0 +1,146 @@
+import io
+import logging
+import os
+import threading
+from itertools import combinations
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+
+
+def _load_gray(image_or_bytes, size):
+    if isinstance(image_or_bytes, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(image_or_bytes))
+    else:
+        image = image_or_bytes
+    # draft() lets the JPEG decoder skip most of the pixels we are about to throw away
+    if image.format == "JPEG":
+        image.draft("L", (size[0] * 4, size[1] * 4))
+    return np.asarray(image.convert("L").resize(size, Image.Resampling.BILINEAR), dtype=np.float32)
+
+
+def _bits_to_int(bits):
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def dhash(image_or_bytes) -> int:
+    """64-bit difference hash: sign of horizontal gradients on a 9x8 thumbnail."""
+    pixels = _load_gray(image_or_bytes, (9, 8))
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    matrix[0] *= 1 / np.sqrt(2)
+    return matrix * np.sqrt(2 / n)
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def phash(image_or_bytes) -> int:
+    """64-bit perceptual hash: low-frequency 8x8 DCT block compared to its median."""
+    pixels = _load_gray(image_or_bytes, (32, 32))
+    low = (_DCT_32 @ pixels @ _DCT_32.T)[:8, :8]
+    return _bits_to_int(low > np.median(low.ravel()[1:]))
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class PerceptualIndex:
+    """
+    Near-duplicate lookup over 64-bit image hashes (multi-index hashing).
+
+    The hash is split into 4 x 16-bit chunks, each with its own lookup table.
+    By the pigeonhole principle, any hash within distance r of the query has
+    at least one chunk within r // 4 bits of the query's chunk, so only those
+    buckets are probed. For the usual r <= 7 that is a handful of dict lookups
+    regardless of index size.
+
+    Entries are appended to a plain text file ("<hash hex> <key>" per line)
+    so the index survives restarts without a full rewrite.
+    """
+    CHUNKS = 4
+    CHUNK_BITS = HASH_BITS // CHUNKS
+
+    def __init__(self, max_distance=6, path=None):
+        self.max_distance = max_distance
+        self.path = path
+        self._hashes = []
+        self._keys = []
+        self._tables = [dict() for _ in range(self.CHUNKS)]
+        self._lock = threading.Lock()
+        self._probes = self._build_probes(max_distance // self.CHUNKS)
+        if path and os.path.exists(path):
+            self._load()
+
+    def _build_probes(self, radius):
+        masks = [0]
+        for r in range(1, radius + 1):
+            for bits in combinations(range(self.CHUNK_BITS), r):
+                mask = 0
+                for b in bits:
+                    mask |= 1 << b
+                masks.append(mask)
+        return masks
+
+    def _chunks(self, value):
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(value >> (i * self.CHUNK_BITS)) & mask for i in range(self.CHUNKS)]
+
+    def _insert(self, value, key):
+        idx = len(self._hashes)
+        self._hashes.append(value)
+        self._keys.append(key)
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            table.setdefault(chunk, []).append(idx)
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as fh:
+            for line in fh:
+                parts = line.split(" ", 1)
+                if len(parts) == 2:
+                    self._insert(int(parts[0], 16), parts[1].rstrip("\n"))
+        logger.info(f"Perceptual index loaded: {len(self._hashes)} hashes")
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def add(self, value: int, key: str):
+        with self._lock:
+            self._insert(value, key)
+            if self.path:
+                try:
+                    with open(self.path, "a", encoding="utf-8") as fh:
+                        fh.write(f"{value:016x} {key}\n")
+                except OSError as e:
+                    logger.error(f"Perceptual index write failed: {e}")
+
+    def nearest(self, value: int, max_distance=None):
+        """Returns (key, distance) for the closest stored hash, or None."""
+        limit = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        best = None
+        seen = set()
+        with self._lock:
+            for table, chunk in zip(self._tables, self._chunks(value)):
+                for mask in self._probes:
+                    for idx in table.get(chunk ^ mask, ()):
+                        if idx in seen:
+                            continue
+                        seen.add(idx)
+                        distance = hamming(value, self._hashes[idx])
+                        if distance <= limit and (best is None or distance < best[1]):
+                            best = (self._keys[idx], distance)
+                            if distance == 0:
+                                return best
+        return best
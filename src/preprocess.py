@@ -0,0 +1,99 @@
+import io
+import logging
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from src.config import Config
+from src import telemetry
+
+logger = logging.getLogger(__name__)
+
+# EXIF tag 0x0112: 1 means the pixels are already upright
+EXIF_ORIENTATION = 0x0112
+
+
+def _leaf_box(image, margin=0.05):
+    """Bounding box of vegetation pixels (excess-green index) on a small thumbnail."""
+    thumb = image.copy()
+    thumb.thumbnail((256, 256))
+    rgb = np.asarray(thumb, dtype=np.int16)
+    exg = 2 * rgb[..., 1] - rgb[..., 0] - rgb[..., 2]
+    mask = exg > 20
+    if mask.mean() < 0.02:
+        return None  # no clear leaf region, keep the full frame
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    sx = image.width / thumb.width
+    sy = image.height / thumb.height
+    pad_x = margin * image.width
+    pad_y = margin * image.height
+    return (
+        max(0, int(cols[0] * sx - pad_x)),
+        max(0, int(rows[0] * sy - pad_y)),
+        min(image.width, int((cols[-1] + 1) * sx + pad_x)),
+        min(image.height, int((rows[-1] + 1) * sy + pad_y)),
+    )
+
+
+def _center_box(image, fraction):
+    w, h = image.width * fraction, image.height * fraction
+    left, top = (image.width - w) / 2, (image.height - h) / 2
+    return int(left), int(top), int(left + w), int(top + h)
+
+
+@telemetry.timed("preprocess")
+def preprocess_image(data: bytes, max_edge=None, quality=None, crop=None) -> bytes:
+    """
+    Turns an uploaded photo into the JPEG bytes sent to Gemini.
+
+    1. Small, upright JPEGs that need no crop are passed through untouched.
+    2. JPEGs are decoded at reduced scale with draft() (DCT scaling), so a
+       48 MP photo never gets fully decoded.
+    3. EXIF orientation is applied to the pixels.
+    4. Optional crop: "center" (IMAGE_CENTER_FRACTION of the frame) or
+       "leaf" (bounding box of green pixels).
+    5. reduce() + a final resample to `max_edge`, then a quality-tuned re-encode.
+    """
+    max_edge = max_edge or Config.IMAGE_MAX_EDGE
+    quality = quality or Config.JPEG_QUALITY
+    crop = crop or Config.IMAGE_CROP
+
+    image = Image.open(io.BytesIO(data))
+    orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+
+    if (image.format == "JPEG" and crop == "none" and orientation == 1
+            and max(image.size) <= max_edge and len(data) <= Config.IMAGE_PASSTHROUGH_BYTES
+            and image.mode in ("RGB", "L")):
+        return data
+
+    if image.format == "JPEG":
+        # The decoder picks the largest 1/2, 1/4 or 1/8 scale still >= the requested size
+        image.draft("RGB", (max_edge, max_edge))
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    if crop == "center":
+        image = image.crop(_center_box(image, Config.IMAGE_CENTER_FRACTION))
+    elif crop == "leaf":
+        box = _leaf_box(image)
+        if box:
+            image = image.crop(box)
+
+    longest = max(image.size)
+    if longest > max_edge:
+        factor = longest // max_edge
+        if factor >= 2:
+            image = image.reduce(factor)  # cheap box filter for the bulk of the shrink
+        if max(image.size) > max_edge:
+            scale = max_edge / max(image.size)
+            image = image.resize(
+                (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                Image.Resampling.LANCZOS
+            )
+
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=quality)
+    return out.getvalue()
@@ -0,0 +1,253 @@
+"""
+Client-side rate limiting for model calls (requests and tokens per minute).
+
+Each model has two token buckets, one for requests and one for tokens. A
+call takes from both at once or from neither. Bucket capacity (the burst)
+is RATE_LIMIT_BURST_FRACTION of the per-minute quota, and the refill rate
+is the rest of the quota spread over 60 s. Capacity plus one minute of
+refill therefore equals the quota, so no 60-second window can exceed it.
+
+Priority lanes: calls made inside `with lane("bulk"):` (batch and CLI jobs)
+may not draw the bucket below RATE_LIMIT_BULK_RESERVE of its capacity,
+and in-process they also wait while any interactive call is waiting. A
+single upload therefore goes ahead of a running batch.
+
+Bucket state lives in a BucketStore. LocalBucketStore is per process.
+SQLiteBucketStore shares buckets between processes on one host (each take
+is a BEGIN IMMEDIATE transaction, i.e. a file lock). A Redis-like store
+needs only take() and adjust(), implemented atomically (e.g. a Lua script).
+"""
+import contextlib
+import contextvars
+import logging
+import sqlite3
+import threading
+import time
+
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+_lane = contextvars.ContextVar("rate_limit_lane", default=INTERACTIVE)
+
+
+@contextlib.contextmanager
+def lane(name):
+    """Runs the block's model calls in the given priority lane ("interactive" or "bulk")."""
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def current_lane():
+    return _lane.get()
+
+
+class RateLimitExceeded(Exception):
+    """The call could not get quota before its deadline."""
+
+
+class BucketStore:
+    def take(self, buckets, floor, now):
+        """
+        Atomically refills every bucket in `buckets` (a list of (key, cost,
+        capacity, rate_per_second)) to `now` and, if each one stays >= `floor`
+        x capacity after taking its cost, takes them all. Returns 0.0 on
+        success, otherwise the seconds until it could succeed.
+        """
+        raise NotImplementedError
+
+    def adjust(self, key, delta, capacity, rate, now):
+        """Adds `delta` (may be negative) to a bucket, e.g. to settle actual token usage."""
+        raise NotImplementedError
+
+
+def _refill(level, updated, capacity, rate, now):
+    if level is None:
+        return capacity
+    return min(capacity, level + max(0.0, now - updated) * rate)
+
+
+def _plan(levels, buckets, floor):
+    """Seconds to wait before every bucket can pay its cost (0.0 if they can now)."""
+    wait = 0.0
+    for (key, cost, capacity, rate), level in zip(buckets, levels):
+        # A single request larger than the bucket can never fit above the floor, let it through on a full bucket
+        needed = min(cost + floor * capacity, capacity)
+        if level < needed - 1e-9:  # a rounding-size deficit would give a wait too small to advance the clock
+            wait = max(wait, (needed - level) / rate if rate > 0 else float("inf"))
+    return wait
+
+
+class LocalBucketStore(BucketStore):
+    def __init__(self):
+        self._buckets = {}  # key -> (level, updated)
+        self._lock = threading.Lock()
+
+    def take(self, buckets, floor, now):
+        with self._lock:
+            levels = []
+            for key, _, capacity, rate in buckets:
+                level, updated = self._buckets.get(key, (None, now))
+                levels.append(_refill(level, updated, capacity, rate, now))
+            wait = _plan(levels, buckets, floor)
+            if wait > 0:
+                return wait
+            for (key, cost, _, _), level in zip(buckets, levels):
+                self._buckets[key] = (level - cost, now)
+            return 0.0
+
+    def adjust(self, key, delta, capacity, rate, now):
+        with self._lock:
+            level, updated = self._buckets.get(key, (None, now))
+            self._buckets[key] = (min(capacity, _refill(level, updated, capacity, rate, now) + delta), now)
+
+
+class SQLiteBucketStore(BucketStore):
+    """Buckets in a SQLite file, shared by every process (Streamlit replicas, workers, CLI) on the host."""
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, level REAL, updated REAL)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _read(self, conn, key):
+        row = conn.execute("SELECT level, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+        return row if row is not None else (None, 0.0)
+
+    def _write(self, conn, key, level, now):
+        conn.execute(
+            "INSERT INTO buckets (key, level, updated) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET level = excluded.level, updated = excluded.updated",
+            (key, level, now)
+        )
+
+    def take(self, buckets, floor, now):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = [_refill(*self._read(conn, key), capacity, rate, now) for key, _, capacity, rate in buckets]
+            wait = _plan(levels, buckets, floor)
+            if wait == 0:
+                for (key, cost, _, _), level in zip(buckets, levels):
+                    self._write(conn, key, level - cost, now)
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def adjust(self, key, delta, capacity, rate, now):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            level = _refill(*self._read(conn, key), capacity, rate, now)
+            self._write(conn, key, min(capacity, level + delta), now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class RateLimiter:
+    """
+    Per-model RPM / TPM limiter (see module docstring). A limit of 0 turns
+    that dimension off. `clock` and `sleep` can be replaced for simulations.
+    """
+    def __init__(self, rpm=0, tpm=0, store=None, burst_fraction=0.1, bulk_reserve=0.2,
+                 clock=time.time, sleep=time.sleep):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.store = store or LocalBucketStore()
+        self.burst_fraction = burst_fraction
+        self.bulk_reserve = bulk_reserve
+        self.clock = clock
+        self.sleep = sleep
+        self._interactive_waiting = 0
+        self._cond = threading.Condition()
+
+    def _bucket(self, model, kind, cost):
+        limit = self.rpm if kind == "rpm" else self.tpm
+        capacity = max(1.0, limit * self.burst_fraction)
+        return f"{model}:{kind}", cost, capacity, (limit - capacity) / 60.0
+
+    def _buckets(self, model, tokens):
+        buckets = []
+        if self.rpm:
+            buckets.append(self._bucket(model, "rpm", 1))
+        if self.tpm:
+            buckets.append(self._bucket(model, "tpm", tokens))
+        return buckets
+
+    def try_acquire(self, model, tokens, lane_name=None):
+        """Takes quota for one call if available now; otherwise returns the seconds to wait."""
+        buckets = self._buckets(model, tokens)
+        if not buckets:
+            return 0.0
+        floor = self.bulk_reserve if (lane_name or current_lane()) == BULK else 0.0
+        return self.store.take(buckets, floor, self.clock())
+
+    def acquire(self, model, tokens, timeout=None):
+        """
+        Blocks until the call may proceed and returns the seconds waited.
+        Raises RateLimitExceeded if that would take longer than `timeout`.
+        """
+        lane_name = current_lane()
+        start = self.clock()
+        end = None if timeout is None else start + timeout
+        interactive = lane_name != BULK
+        if interactive:
+            with self._cond:
+                self._interactive_waiting += 1
+        try:
+            while True:
+                if interactive or not self._interactive_waiting:
+                    wait = self.try_acquire(model, tokens, lane_name)
+                    if wait == 0:
+                        return self.clock() - start
+                else:
+                    wait = 0.05  # let waiting interactive calls go first
+                if end is not None and self.clock() + wait > end:
+                    raise RateLimitExceeded(f"{model}: no quota within {timeout:.0f}s ({lane_name} lane)")
+                self.sleep(min(wait, 1.0))
+        finally:
+            if interactive:
+                with self._cond:
+                    self._interactive_waiting -= 1
+
+    def settle(self, model, delta_tokens):
+        """Corrects the token bucket once the real usage of a call is known."""
+        if self.tpm and delta_tokens:
+            key, _, capacity, rate = self._bucket(model, "tpm", 0)
+            self.store.adjust(key, -delta_tokens, capacity, rate, self.clock())
+
+
+def create_rate_limiter():
+    """The limiter configured by RATE_LIMIT_* settings, or None when no limit is set."""
+    if not (Config.RATE_LIMIT_RPM or Config.RATE_LIMIT_TPM):
+        return None
+    if Config.RATE_LIMIT_BACKEND == "sqlite":
+        store = SQLiteBucketStore(Config.RATE_LIMIT_DB_PATH)
+    else:
+        store = LocalBucketStore()
+    logger.info(f"Rate limiting model calls to {Config.RATE_LIMIT_RPM} RPM / {Config.RATE_LIMIT_TPM} TPM "
+                f"({Config.RATE_LIMIT_BACKEND} buckets)")
+    return RateLimiter(
+        rpm=Config.RATE_LIMIT_RPM,
+        tpm=Config.RATE_LIMIT_TPM,
+        store=store,
+        burst_fraction=Config.RATE_LIMIT_BURST_FRACTION,
+        bulk_reserve=Config.RATE_LIMIT_BULK_RESERVE
+    )
@@ -0,0 +1,191 @@
+"""
+Prescription PDFs (fpdf2).
+
+Reports use embedded Unicode TTF fonts with HarfBuzz text shaping
+(uharfbuzz), so Devanagari and Telugu conjuncts and vowel signs come out
+right. Fonts are looked up in REPORT_FONT_DIRS; the Dockerfile installs
+fonts-noto-core. Latin text in an Indic report (disease names, numbers)
+uses the Latin font as a fallback. With no TTF font at all, the core
+Helvetica font is used (Latin-1 only, like the old create_pdf).
+
+render_pdf() always renders. pdf_bytes() memoizes the bytes by report
+hash + language, for reruns and repeat downloads. render_many() and
+render_zip() render a batch (e.g. a field visit) on a process pool. The
+pool is spawn-started: it is created from threaded servers (Streamlit,
+the API), where a forked child could inherit a lock held by another
+thread and deadlock.
+"""
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+import unicodedata
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from src.config import Config
+from src import telemetry
+
+logger = logging.getLogger(__name__)
+
+# Font files per script, first one found wins. Regular weight only: parsing a
+# TTF is most of the render time, so the title is set larger rather than bold.
+LATIN_FONTS = ["NotoSans-Regular.ttf", "DejaVuSans.ttf"]
+SCRIPT_FONTS = {
+    "Hindi": ["NotoSansDevanagari-Regular.ttf"],
+    "Marathi": ["NotoSansDevanagari-Regular.ttf"],
+    "Telugu": ["NotoSansTelugu-Regular.ttf"],
+}
+
+
+def _find(name):
+    for directory in Config.REPORT_FONT_DIRS.split(os.pathsep):
+        path = os.path.join(directory, name)
+        if directory and os.path.isfile(path):
+            return path
+    return None
+
+
+def _first_available(candidates):
+    for name in candidates:
+        path = _find(name)
+        if path:
+            return path
+    return None
+
+
+@lru_cache(maxsize=None)
+def font_files(language):
+    """[(family, path)] for a language: its script's font first, then Latin."""
+    fonts = []
+    script = _first_available(SCRIPT_FONTS.get(language, []))
+    if script:
+        fonts.append(("Script", script))
+    elif language in SCRIPT_FONTS:
+        logger.warning(f"No {language} font found in REPORT_FONT_DIRS; the PDF will miss those glyphs")
+    latin = _first_available(LATIN_FONTS)
+    if latin:
+        fonts.append(("Latin", latin))
+    return fonts
+
+
+def _plain(text):
+    """Drops markdown markup and emoji (no report font has emoji glyphs)."""
+    text = re.sub(r"^#+\s*", "", text, flags=re.MULTILINE)
+    text = text.replace("**", "").replace("__", "")
+    return "".join(c for c in text if unicodedata.category(c) != "So").replace("\ufe0f", "")
+
+
+@telemetry.timed("pdf")
+def render_pdf(report, language="English", title="AgriDoc Prescription"):
+    """The prescription for one diagnosis as PDF bytes."""
+    from fpdf import FPDF  # only loaded once a report is rendered
+    pdf = FPDF()
+    pdf.set_auto_page_break(True, margin=15)
+    pdf.add_page()
+    fonts = font_files(language)
+    body = _plain(report)
+    if fonts:
+        for family, path in fonts:
+            pdf.add_font(family, "", path)
+        pdf.set_fallback_fonts([family for family, _ in fonts[1:]])
+        try:
+            pdf.set_text_shaping(True)
+        except ImportError:
+            logger.warning("uharfbuzz is not installed; Indic scripts are rendered without shaping")
+        family = fonts[0][0]
+    else:
+        family = "Helvetica"
+        body = body.encode("latin-1", "replace").decode("latin-1")
+
+    pdf.set_font(family, size=18)
+    pdf.cell(0, 10, title, new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font(family, size=9)
+    pdf.cell(0, 6, f"{time.strftime('%Y-%m-%d')} | {language}", new_x="LMARGIN", new_y="NEXT")
+    pdf.ln(4)
+    pdf.set_font(family, size=12)
+    pdf.multi_cell(0, 7, body)
+    return bytes(pdf.output())
+
+
+# === CACHE ===
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def report_key(report, language):
+    return f"{hashlib.sha256(report.encode('utf-8')).hexdigest()}:{language}"
+
+
+def pdf_bytes(report, language="English"):
+    """render_pdf() memoized by report hash + language (bounded LRU of REPORT_CACHE_SIZE)."""
+    key = report_key(report, language)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    data = render_pdf(report, language)
+    with _cache_lock:
+        _cache[key] = data
+        while len(_cache) > Config.REPORT_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return data
+
+
+# === BATCH ===
+def _render_item(item):
+    report, language = item
+    return render_pdf(report, language)
+
+
+def render_many(items, workers=None):
+    """
+    Renders (report, language) pairs on a pool of REPORT_WORKERS processes
+    (default: one per CPU) and returns the PDF bytes in input order.
+    """
+    items = list(items)
+    workers = workers or Config.REPORT_WORKERS or os.cpu_count() or 1
+    if workers == 1 or len(items) < 2:
+        return [_render_item(item) for item in items]
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(items)), mp_context=context) as pool:
+        return list(pool.map(_render_item, items, chunksize=max(1, len(items) // (workers * 4))))
+
+
+def render_zip(items, workers=None):
+    """
+    A ZIP of one PDF per (file_name, report, language), rendered with
+    render_many(). Repeated names get a numeric suffix (see unique_names).
+    """
+    items = list(items)
+    pdfs = render_many([(report, language) for _, report, language in items], workers)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:  # PDF streams are already compressed
+        for name, data in zip(unique_names(name for name, _, _ in items), pdfs):
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def pdf_name(file_name):
+    """prescription file name for an image, e.g. field_07/leaf.jpg -> field_07_leaf.pdf"""
+    return os.path.splitext(file_name.replace("/", "_").replace(os.sep, "_"))[0] + ".pdf"
+
+
+def unique_names(names):
+    """`names` in order, repeats suffixed before the extension: leaf.pdf, leaf_2.pdf, leaf_3.pdf"""
+    seen, unique = set(), []
+    for name in names:
+        base, ext = os.path.splitext(name)
+        candidate, n = name, 1
+        while candidate in seen:
+            n += 1
+            candidate = f"{base}_{n}{ext}"
+        seen.add(candidate)
+        unique.append(candidate)
+    return unique
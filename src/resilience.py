@@ -0,0 +1,364 @@
+"""
+Resilient model calls: retry, deadlines, hedging, circuit breaker, fallback.
+
+ResilientClient wraps a model backend. Every model it builds exposes the
+usual generate_content() / start_chat().send_message(), but each call:
+
+- fast-fails with CircuitOpenError while that model's breaker is open,
+- runs each attempt with an ATTEMPT timeout and the whole call (retries
+  included) within a CALL deadline; the timeout is also passed to the SDK
+  (request_options), so an abandoned attempt ends instead of holding a
+  worker and quota,
+- retries quota and transient errors with jittered exponential backoff; a
+  429 also pauses every other caller of that model (shared cooldown),
+- optionally hedges: if an attempt is slower than the model's observed p95
+  (at least MODEL_HEDGE_MIN_DELAY), a second identical request races it.
+  Only stateless generate_content calls are hedged, never chat messages,
+  and only while the attempt pool has an idle worker,
+- falls back to FALLBACK_MODEL_NAME when the primary model still fails,
+- with a RateLimiter, takes RPM / TPM quota before every attempt and hedge
+  (waiting counts against the deadline) and settles the token estimate
+  with the response's usage_metadata.
+
+Every retry, timeout, hedge, breaker transition and fallback is counted in
+telemetry (agridoc_model_call_events_total).
+"""
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from src.config import Config
+from src import telemetry
+from src.rate_limit import RateLimitExceeded, create_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+_RETRYABLE_ERRORS = None
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the model while its circuit breaker is open."""
+
+
+class CallTimeoutError(TimeoutError):
+    """An attempt ran past MODEL_ATTEMPT_TIMEOUT, or the call past MODEL_CALL_DEADLINE."""
+
+
+def retryable_errors():
+    """Errors worth retrying: quota (429), transient upstream failures and attempt timeouts."""
+    global _RETRYABLE_ERRORS
+    if _RETRYABLE_ERRORS is None:
+        from google.api_core import exceptions as google_exceptions
+        _RETRYABLE_ERRORS = (
+            google_exceptions.ResourceExhausted,
+            google_exceptions.TooManyRequests,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.InternalServerError,
+            google_exceptions.DeadlineExceeded,
+            CallTimeoutError,
+        )
+    return _RETRYABLE_ERRORS
+
+
+def _is_quota_error(error):
+    return type(error).__name__ in ("ResourceExhausted", "TooManyRequests")
+
+
+class CircuitBreaker:
+    """
+    Closed until `failure_threshold` consecutive failures, then open: calls
+    fail fast for `reset_seconds`. After that one probe call is let through
+    (half-open); its outcome closes or re-opens the breaker.
+    """
+    def __init__(self, name, failure_threshold=5, reset_seconds=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.reset_seconds:
+                    return False
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open":
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info(f"Circuit for {self.name} closed")
+                telemetry.record_model_event(self.name, "circuit_closed")
+            self.state = "closed"
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self._failures >= self.failure_threshold):
+                logger.warning(f"Circuit for {self.name} opened after {self._failures} failures")
+                telemetry.record_model_event(self.name, "circuit_opened")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class AttemptPool:
+    """
+    Thread pool for model attempts that counts those submitted and not yet
+    finished, including attempts a timeout or a hedge already gave up on.
+    """
+    def __init__(self, max_workers=32):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-call")
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            self._in_flight += 1
+        future = self._executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, _future):
+        with self._lock:
+            self._in_flight -= 1
+
+    def in_flight(self):
+        with self._lock:
+            return self._in_flight
+
+    def has_idle_worker(self):
+        return self.in_flight() < self.max_workers
+
+
+def _with_request_timeout(kwargs, timeout):
+    """kwargs with the SDK's per-request timeout set (the caller's request_options win)."""
+    options = dict(kwargs.get("request_options") or {})
+    options.setdefault("timeout", timeout)
+    return dict(kwargs, request_options=options)
+
+
+class ResilientCaller:
+    """Retry / deadline / hedging / breaker policy for one model name."""
+    def __init__(self, name, executor, max_retries=None, backoff_base=None, backoff_max=None,
+                 attempt_timeout=None, deadline=None, hedge=None, hedge_min_delay=None, breaker=None,
+                 limiter=None, tokens_per_call=None):
+        self.name = name
+        self.max_retries = Config.MODEL_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = Config.MODEL_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.backoff_max = Config.MODEL_BACKOFF_MAX if backoff_max is None else backoff_max
+        self.attempt_timeout = Config.MODEL_ATTEMPT_TIMEOUT if attempt_timeout is None else attempt_timeout
+        self.deadline = Config.MODEL_CALL_DEADLINE if deadline is None else deadline
+        self.hedge = Config.MODEL_HEDGE_ENABLED if hedge is None else hedge
+        self.hedge_min_delay = Config.MODEL_HEDGE_MIN_DELAY if hedge_min_delay is None else hedge_min_delay
+        self.breaker = breaker or CircuitBreaker(
+            name, Config.BREAKER_FAILURE_THRESHOLD, Config.BREAKER_RESET_SECONDS
+        )
+        self.limiter = limiter
+        self.tokens_per_call = Config.RATE_LIMIT_TOKENS_PER_CALL if tokens_per_call is None else tokens_per_call
+        self._executor = executor
+        self._latencies = deque(maxlen=200)
+        self._cooldown_until = 0.0
+        self._cooldown_lock = threading.Lock()
+
+    def p95(self):
+        """p95 of recent successful attempt latencies (None until 20 samples)."""
+        samples = sorted(self._latencies)
+        if len(samples) < 20:
+            return None
+        return samples[int(len(samples) * 0.95)]
+
+    def _hedge_delay(self):
+        return max(self.hedge_min_delay, self.p95() or 0.0)
+
+    def call(self, fn, *args, hedge=None, **kwargs):
+        """Runs fn(*args, **kwargs) under this model's policy (see module docstring)."""
+        hedge = self.hedge if hedge is None else hedge
+        end = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                telemetry.record_model_event(self.name, "circuit_rejected")
+                raise CircuitOpenError(f"{self.name} is unavailable (circuit open), retry later")
+
+            wait_for = self._cooldown_until - time.monotonic()
+            if wait_for > 0:
+                time.sleep(min(wait_for, max(0.0, end - time.monotonic())))
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                telemetry.record_model_event(self.name, "deadline")
+                raise CallTimeoutError(f"{self.name} call exceeded its {self.deadline:.0f}s deadline")
+            if self.limiter is not None:
+                try:
+                    if self.limiter.acquire(self.name, self.tokens_per_call, timeout=remaining) > 0:
+                        telemetry.record_model_event(self.name, "throttled")
+                except RateLimitExceeded:
+                    telemetry.record_model_event(self.name, "rate_limited")
+                    raise
+                remaining = max(0.0, end - time.monotonic())
+
+            start = time.monotonic()
+            timeout = min(self.attempt_timeout, remaining)
+            # A stream is only returned by the attempt; the SDK deadline has to cover reading it too
+            request_kwargs = _with_request_timeout(kwargs, remaining if kwargs.get("stream") else timeout)
+            try:
+                result = self._attempt(fn, args, request_kwargs, timeout, hedge)
+            except retryable_errors() as e:
+                self.breaker.record_failure()
+                delay = min(self.backoff_max, self.backoff_base * (2 ** attempt)) * (0.5 + random.random())
+                if attempt >= self.max_retries or time.monotonic() + delay >= end:
+                    telemetry.record_model_event(self.name, "failed")
+                    raise
+                logger.warning(f"{self.name} busy ({type(e).__name__}), retrying in {delay:.1f}s")
+                telemetry.record_model_event(self.name, "retry")
+                if _is_quota_error(e):
+                    # One 429 slows every worker on this model, not just the one that hit it
+                    with self._cooldown_lock:
+                        self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+                else:
+                    time.sleep(delay)
+                attempt += 1
+                continue
+            except Exception:
+                # Non-retryable (bad request, parsing): the upstream answered, so it isn't degraded
+                self.breaker.record_success()
+                raise
+
+            self._latencies.append(time.monotonic() - start)
+            self.breaker.record_success()
+            if self.limiter is not None and not kwargs.get("stream"):
+                # Streamed usage is only complete after the last chunk; those calls keep the estimate
+                usage = getattr(result, "usage_metadata", None)
+                actual = getattr(usage, "total_token_count", 0) or 0
+                if actual:
+                    self.limiter.settle(self.name, actual - self.tokens_per_call)
+            return result
+
+    def _attempt(self, fn, args, kwargs, timeout, hedge):
+        end = time.monotonic() + timeout
+        primary = self._executor.submit(fn, *args, **kwargs)
+        futures = [primary]
+        if hedge:
+            done, _ = wait(futures, timeout=min(self._hedge_delay(), timeout))
+            # A hedge is a second request: only send it with an idle worker and quota to spare
+            if not done and self._executor.has_idle_worker() and (
+                    self.limiter is None or self.limiter.try_acquire(self.name, self.tokens_per_call) == 0):
+                telemetry.record_model_event(self.name, "hedged")
+                futures.append(self._executor.submit(fn, *args, **kwargs))
+
+        pending, error = set(futures), None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, end - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                telemetry.record_model_event(self.name, "timeout")
+                raise CallTimeoutError(f"{self.name} did not answer within {timeout:.1f}s")
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        telemetry.record_model_event(self.name, "hedge_won")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+
+FALLBACK_ERRORS = (CircuitOpenError, CallTimeoutError, RateLimitExceeded)  # the fallback has its own quota
+
+
+class ResilientModel:
+    """A backend model plus its fallback, with generate_content() and start_chat() going through the callers."""
+    def __init__(self, client, build):
+        self._client = client
+        self._models = {name: build(name) for name in client.model_names}
+
+    def _with_fallback(self, operation):
+        names = self._client.model_names
+        for i, name in enumerate(names):
+            try:
+                return operation(self._models[name], self._client.callers[name])
+            except FALLBACK_ERRORS + retryable_errors() as e:
+                if i == len(names) - 1:
+                    raise
+                logger.warning(f"{name} failed ({type(e).__name__}), falling back to {names[i + 1]}")
+                telemetry.record_model_event(name, "fallback")
+
+    def generate_content(self, *args, **kwargs):
+        return self._with_fallback(lambda model, caller: caller.call(model.generate_content, *args, **kwargs))
+
+    def start_chat(self):
+        return ResilientChat(self)
+
+
+class ResilientChat:
+    """
+    Chat whose first message may fall back to another model; later messages
+    stay on the model that answered it (chat history lives there). Chat
+    messages are never hedged, a duplicate would fork the history.
+    """
+    def __init__(self, model):
+        self._model = model
+        self._chat = None
+        self._caller = None
+
+    def send_message(self, content, **kwargs):
+        if self._chat is not None:
+            return self._caller.call(self._chat.send_message, content, hedge=False, **kwargs)
+
+        def first(model, caller):
+            chat = model.start_chat()
+            result = caller.call(chat.send_message, content, hedge=False, **kwargs)
+            self._chat, self._caller = chat, caller
+            return result
+        return self._model._with_fallback(first)
+
+
+class ResilientClient:
+    """
+    Builds resilient models for MODEL_NAME (+ FALLBACK_MODEL_NAME) on a
+    backend; one policy per model name. `limiter` defaults to the RATE_LIMIT_*
+    configuration (pass False for none).
+    """
+    def __init__(self, backend, model_name=None, fallback_model_name=None, max_workers=32, limiter=None):
+        self.backend = backend
+        primary = model_name or Config.MODEL_NAME
+        fallback = Config.FALLBACK_MODEL_NAME if fallback_model_name is None else fallback_model_name
+        self.model_names = [primary] + ([fallback] if fallback and fallback != primary else [])
+        self._executor = AttemptPool(max_workers)
+        self.limiter = create_rate_limiter() if limiter is None else limiter or None
+        self.callers = {
+            name: ResilientCaller(name, self._executor, limiter=self.limiter) for name in self.model_names
+        }
+
+    def tool_model(self, tools, system_instruction):
+        return ResilientModel(self, lambda name: self.backend.tool_model(tools, system_instruction, model_name=name))
+
+    def text_model(self):
+        return ResilientModel(self, lambda name: self.backend.text_model(model_name=name))
+
+    def json_model(self, schema, system_instruction):
+        return ResilientModel(self, lambda name: self.backend.json_model(schema, system_instruction, model_name=name))
+
+    def stats(self):
+        """Breaker state and p95 latency (s) per model name, for dashboards."""
+        return {
+            name: {"circuit": caller.breaker.state, "p95": caller.p95()}
+            for name, caller in self.callers.items()
+        }
+
+    def in_flight(self):
+        """Model attempts running or queued, abandoned ones included."""
+        return self._executor.in_flight()
@@ -0,0 +1,116 @@
+"""
+Process-wide shared resources.
+
+Streamlit re-runs app.py for every session and every widget click, but
+imported modules live for the whole process. Everything built here (the
+storage client, the registry, the agent and its Gemini models, the
+outbreak monitor, the job queue) is therefore created once per process
+and reused by every session, the API server and the CLI.
+"""
+import logging
+import threading
+
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+_registry = None
+_agent = None
+_monitor = None
+_analytics = None
+_job_queue = None
+_knowledge_warmup = None
+
+
+def get_registry():
+    global _registry
+    with _lock:
+        if _registry is None:
+            from src.database import OutbreakRegistry
+            _registry = OutbreakRegistry()
+        return _registry
+
+
+def get_agent():
+    """The shared PlantDoctorAgent (imports google.generativeai on first call)."""
+    global _agent
+    with _lock:
+        if _agent is None:
+            from src.agent import PlantDoctorAgent
+            _agent = PlantDoctorAgent(registry=get_registry())
+        return _agent
+
+
+def get_monitor():
+    global _monitor
+    with _lock:
+        if _monitor is None:
+            from src.monitor import OutbreakMonitor
+            _monitor = OutbreakMonitor(
+                get_registry().store,
+                refresh_interval=Config.MONITOR_REFRESH_SECONDS,
+                capacity=Config.MONITOR_CAPACITY,
+                overlap_seconds=Config.MONITOR_OVERLAP_SECONDS
+            )
+        return _monitor
+
+
+def get_analytics():
+    global _analytics
+    with _lock:
+        if _analytics is None:
+            from src.analytics import OutbreakAnalytics
+            _analytics = OutbreakAnalytics(
+                get_registry().store,
+                refresh_interval=Config.MONITOR_REFRESH_SECONDS,
+                overlap_seconds=Config.MONITOR_OVERLAP_SECONDS,
+                merge_window_seconds=Config.OUTBREAK_CLUSTER_WINDOW_HOURS * 3600 if Config.OUTBREAK_CLUSTERING else 0.0
+            )
+        return _analytics
+
+
+def _diagnose_job(payload, language):
+    from src.jobs import InvalidJobError
+    from src.preprocess import preprocess_image
+    try:
+        image_bytes = preprocess_image(payload)
+    except Exception as e:
+        raise InvalidJobError(f"Unreadable image: {e}") from e
+    diagnosis, logged, ok = get_agent().analyze(image_bytes, language)
+    if not ok:
+        raise RuntimeError(diagnosis)  # the job ends "failed" instead of "done" with an error message
+    return diagnosis, logged
+
+
+def get_job_queue():
+    """Worker pool for queued diagnoses; jobs carry raw upload bytes and are preprocessed by the worker."""
+    global _job_queue
+    with _lock:
+        if _job_queue is None:
+            from src.jobs import JobQueue
+            _job_queue = JobQueue(
+                _diagnose_job,
+                workers=Config.JOB_WORKERS,
+                max_depth=Config.JOB_QUEUE_MAX_DEPTH,
+                timeout=Config.JOB_TIMEOUT_SECONDS,
+                db_path=Config.JOB_DB_PATH or None
+            )
+        return _job_queue
+
+
+def start_knowledge_warmup():
+    """Warms the agent's knowledge cache from a daemon thread, once per process (KNOWLEDGE_WARMUP_TOP_N > 0)."""
+    global _knowledge_warmup
+    with _lock:
+        if _knowledge_warmup is not None or Config.KNOWLEDGE_WARMUP_TOP_N <= 0:
+            return
+
+        def run():
+            analytics = get_analytics()
+            analytics.maybe_refresh()
+            added = get_agent().warm_up_knowledge(analytics=analytics)
+            logger.info(f"Knowledge warm-up added {added} entries")
+
+        _knowledge_warmup = threading.Thread(target=run, name="knowledge-warmup", daemon=True)
+        _knowledge_warmup.start()
@@ -0,0 +1,406 @@
+import datetime
+import hashlib
+import heapq
+import logging
+import random
+import sqlite3
+import threading
+import uuid
+
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Firestore rejects WriteBatch commits with more than 500 operations
+FIRESTORE_MAX_BATCH = 500
+
+INCIDENT_FIELDS = (
+    "timestamp", "plant", "disease", "confidence", "severity", "status",
+    "occurrences", "last_seen", "latitude", "longitude",
+)
+
+# Dimensions with pre-aggregated totals (see IncidentStore.count_by)
+COUNTER_DIMENSIONS = ("disease", "plant", "severity")
+
+
+def day_key(timestamp):
+    return timestamp.strftime("%Y-%m-%d")
+
+
+def last_seen(record):
+    """When an outbreak was last reported (its first `timestamp` for records written before clustering)."""
+    return record.get("last_seen") or record["timestamp"]
+
+
+class IncidentStore:
+    """
+    Storage interface behind OutbreakRegistry.
+
+    Records are plain dicts with the fields in INCIDENT_FIELDS; reads return
+    the same dicts plus an "id" key. With outbreak clustering a record is an
+    outbreak: `timestamp` is its first detection and `occurrences` /
+    `last_seen` grow through update_many(). Reads are ordered and filtered by
+    `last_seen`, so an incremental since() reader also sees merged updates.
+    """
+    def new_id(self) -> str:
+        return uuid.uuid4().hex
+
+    def write(self, doc_id, data):
+        self.write_many([(doc_id, data)])
+
+    def write_many(self, records):
+        """Upserts a list of (doc_id, data) pairs. Re-writing an ID must be idempotent."""
+        raise NotImplementedError
+
+    def update_many(self, records):
+        """Rewrites existing documents (merged outbreaks) without counting them as new incidents."""
+        self.write_many(records)
+
+    def delete_many(self, doc_ids):
+        raise NotImplementedError
+
+    def recent(self, limit=5):
+        """The `limit` most recently reported records, newest first."""
+        raise NotImplementedError
+
+    def since(self, timestamp, limit=500):
+        """Records with last_seen >= `timestamp`, least recently reported first."""
+        raise NotImplementedError
+
+    def count_by(self, dimension, day=None):
+        """
+        {value: outbreak count} for a COUNTER_DIMENSIONS field, all-time or
+        for the date of the outbreaks' first report. Outbreaks count under
+        their current value (e.g. the escalated severity).
+        """
+        raise NotImplementedError
+
+
+class FirestoreStore(IncidentStore):
+    """
+    Production backend. Every incident write also bumps sharded counters
+    (one document per dimension/value/day/shard, in a sibling collection)
+    in the same WriteBatch, so totals never need a collection scan. Counters
+    are at-least-once: a replayed spool entry increments them again, which
+    rebuild_counters() corrects. update_many() reads the previous documents
+    and moves counts whose value changed (an escalated severity).
+    """
+    def __init__(self, client=None, collection_name=None):
+        from google.cloud import firestore
+        from google.cloud.firestore_v1.base_query import FieldFilter
+        self._firestore = firestore
+        self._filter = FieldFilter
+        self.client = client or firestore.Client(project=Config.PROJECT_ID)
+        name = collection_name or Config.COLLECTION_NAME
+        self.collection = self.client.collection(name)
+        self.counters = self.client.collection(f"{name}_counters")
+        self.shards = Config.COUNTER_SHARDS
+
+    def new_id(self):
+        # Auto-IDs are generated client-side, no round-trip
+        return self.collection.document().id
+
+    def _counter_ref(self, dimension, value, day, shard):
+        # Values come from the model and may contain "/" or other characters
+        # Firestore rejects in IDs; the raw value is stored in the "value" field
+        digest = hashlib.sha1(value.encode("utf-8")).hexdigest()[:16]
+        return self.counters.document(f"{dimension}:{digest}:{day}:{shard}")
+
+    def _counter_keys(self, data):
+        for dimension in COUNTER_DIMENSIONS:
+            for day in (day_key(data["timestamp"]), "all"):
+                yield dimension, str(data.get(dimension)), day
+
+    def write_many(self, records):
+        # 1 incident set + 2 counter increments per dimension, per record
+        per_batch = max(1, FIRESTORE_MAX_BATCH // (1 + 2 * len(COUNTER_DIMENSIONS)))
+        for start in range(0, len(records), per_batch):
+            batch = self.client.batch()
+            for doc_id, data in records[start:start + per_batch]:
+                batch.set(self.collection.document(doc_id), dict(data, last_seen=last_seen(data)))
+                for key in self._counter_keys(data):
+                    self._increment(batch, key, 1)
+            batch.commit()
+
+    def _increment(self, batch, key, amount):
+        dimension, value, day = key
+        shard = random.randrange(self.shards)
+        batch.set(self._counter_ref(dimension, value, day, shard), {
+            "dimension": dimension,
+            "value": value,
+            "day": day,
+            "count": self._firestore.Increment(amount),
+        }, merge=True)
+
+    def update_many(self, records):
+        # Old and new counter keys: 1 set + up to 4 increments per dimension, per record
+        per_batch = max(1, FIRESTORE_MAX_BATCH // (1 + 4 * len(COUNTER_DIMENSIONS)))
+        for start in range(0, len(records), per_batch):
+            chunk = records[start:start + per_batch]
+            refs = [self.collection.document(doc_id) for doc_id, _ in chunk]
+            previous = {snap.id: snap.to_dict() for snap in self.client.get_all(refs) if snap.exists}
+            batch = self.client.batch()
+            for ref, (doc_id, data) in zip(refs, chunk):
+                batch.set(ref, dict(data, last_seen=last_seen(data)))
+                # Counters move only when a value changed; a replayed update changes nothing
+                old = previous.get(doc_id)
+                old_keys = set(self._counter_keys(old)) if old else set()
+                new_keys = set(self._counter_keys(data))
+                for key in old_keys - new_keys:
+                    self._increment(batch, key, -1)
+                for key in new_keys - old_keys:
+                    self._increment(batch, key, 1)
+            batch.commit()
+
+    def delete_many(self, doc_ids):
+        """Deletes documents; their counters stay until rebuild_counters()."""
+        for start in range(0, len(doc_ids), FIRESTORE_MAX_BATCH):
+            batch = self.client.batch()
+            for doc_id in doc_ids[start:start + FIRESTORE_MAX_BATCH]:
+                batch.delete(self.collection.document(doc_id))
+            batch.commit()
+
+    def count_by(self, dimension, day=None):
+        """Reads only the shard documents for this dimension and day (one query)."""
+        docs = (self.counters
+                .where(filter=self._filter("dimension", "==", dimension))
+                .where(filter=self._filter("day", "==", day or "all"))
+                .stream())
+        totals = {}
+        for d in docs:
+            data = d.to_dict()
+            totals[data["value"]] = totals.get(data["value"], 0) + data.get("count", 0)
+        # rebuild_counters() zeroes counters of values that no longer occur instead of deleting them
+        return {value: count for value, count in totals.items() if count}
+
+    def count_one(self, dimension, value, day=None):
+        """Total for a single value: exactly COUNTER_SHARDS document reads."""
+        refs = [self._counter_ref(dimension, value, day or "all", s) for s in range(self.shards)]
+        return sum((snap.to_dict() or {}).get("count", 0) for snap in self.client.get_all(refs) if snap.exists)
+
+    def rebuild_counters(self):
+        """
+        Reconciliation job: recomputes every counter from the raw incidents.
+        Both collections are read as of the same moment (an incident and its
+        counter increments commit in one batch, so that snapshot agrees with
+        itself) and only the difference is applied, as increments: writes
+        that land while the job runs keep their own increments. The scan
+        must finish within Firestore's one-hour read_time limit. Also
+        backfills `last_seen` on documents written before clustering, which
+        since() and recent() would otherwise never return.
+        """
+        read_time = datetime.datetime.now(datetime.timezone.utc)
+        totals = {}
+        batch, ops = self.client.batch(), 0
+        for d in self.collection.stream(read_time=read_time):
+            data = d.to_dict()
+            for key in self._counter_keys(data):
+                totals[key] = totals.get(key, 0) + 1
+            if "last_seen" not in data:
+                batch.update(d.reference, {"last_seen": data["timestamp"]})
+                ops += 1
+                if ops == FIRESTORE_MAX_BATCH:
+                    batch.commit()
+                    batch, ops = self.client.batch(), 0
+
+        current = {}
+        for d in self.counters.stream(read_time=read_time):
+            data = d.to_dict()
+            key = (data["dimension"], data["value"], data["day"])
+            current[key] = current.get(key, 0) + data.get("count", 0)
+        changed = 0
+        for key in totals.keys() | current.keys():
+            delta = totals.get(key, 0) - current.get(key, 0)
+            if not delta:
+                continue
+            self._increment(batch, key, delta)
+            changed += 1
+            ops += 1
+            if ops == FIRESTORE_MAX_BATCH:
+                batch.commit()
+                batch, ops = self.client.batch(), 0
+        if ops:
+            batch.commit()
+        logger.info(f"Rebuilt {len(totals)} counters ({changed} corrected)")
+        return len(totals)
+
+    def recent(self, limit=5):
+        docs = self.collection.order_by("last_seen", direction=self._firestore.Query.DESCENDING).limit(limit).stream()
+        return [dict(d.to_dict(), id=d.id) for d in docs]
+
+    def since(self, timestamp, limit=500):
+        docs = (self.collection
+                .where(filter=self._filter("last_seen", ">=", timestamp))
+                .order_by("last_seen").limit(limit).stream())
+        return [dict(d.to_dict(), id=d.id) for d in docs]
+
+
+class SQLiteStore(IncidentStore):
+    """Local backend for offline development and load tests (WAL mode)."""
+    def __init__(self, path=None):
+        self.path = path or Config.SQLITE_PATH
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS incidents (
+                id TEXT PRIMARY KEY,
+                timestamp REAL NOT NULL,
+                plant TEXT,
+                disease TEXT,
+                confidence REAL,
+                severity TEXT,
+                status TEXT,
+                occurrences INTEGER,
+                last_seen REAL,
+                latitude REAL,
+                longitude REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_incidents_timestamp ON incidents(timestamp);
+            CREATE INDEX IF NOT EXISTS idx_incidents_plant ON incidents(plant, timestamp);
+            CREATE INDEX IF NOT EXISTS idx_incidents_disease ON incidents(disease, timestamp);
+        """)
+        # Databases created before outbreak clustering lack the newer columns
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(incidents)")}
+        for column, kind in (("occurrences", "INTEGER"), ("last_seen", "REAL"),
+                             ("latitude", "REAL"), ("longitude", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE incidents ADD COLUMN {column} {kind}")
+        self._conn.execute("UPDATE incidents SET last_seen = timestamp WHERE last_seen IS NULL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_incidents_last_seen ON incidents(last_seen)")
+        self._conn.commit()
+
+    @staticmethod
+    def _to_row(doc_id, data):
+        return (
+            doc_id,
+            data["timestamp"].timestamp(),
+            data.get("plant"),
+            data.get("disease"),
+            data.get("confidence"),
+            data.get("severity"),
+            data.get("status"),
+            data.get("occurrences", 1),
+            last_seen(data).timestamp(),
+            data.get("latitude"),
+            data.get("longitude"),
+        )
+
+    @staticmethod
+    def _from_row(row):
+        record = dict(zip(("id",) + INCIDENT_FIELDS, row))
+        record["timestamp"] = datetime.datetime.fromtimestamp(record["timestamp"])
+        record["occurrences"] = record["occurrences"] or 1
+        record["last_seen"] = datetime.datetime.fromtimestamp(record["last_seen"])
+        for field in ("latitude", "longitude"):
+            if record[field] is None:
+                del record[field]
+        return record
+
+    def write_many(self, records):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO incidents (id, " + ", ".join(INCIDENT_FIELDS) + ") "
+                "VALUES (" + ", ".join("?" * (len(INCIDENT_FIELDS) + 1)) + ")",
+                [self._to_row(doc_id, data) for doc_id, data in records]
+            )
+
+    def delete_many(self, doc_ids):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM incidents WHERE id = ?", [(doc_id,) for doc_id in doc_ids])
+
+    def recent(self, limit=5):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, " + ", ".join(INCIDENT_FIELDS) + " FROM incidents ORDER BY last_seen DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [self._from_row(r) for r in rows]
+
+    def since(self, timestamp, limit=500):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, " + ", ".join(INCIDENT_FIELDS) + " FROM incidents WHERE last_seen >= ? "
+                "ORDER BY last_seen LIMIT ?",
+                (timestamp.timestamp(), limit)
+            ).fetchall()
+        return [self._from_row(r) for r in rows]
+
+    def count_by(self, dimension, day=None):
+        if dimension not in COUNTER_DIMENSIONS:
+            raise ValueError(f"Unknown counter dimension '{dimension}'")
+        query = f"SELECT {dimension}, COUNT(*) FROM incidents"
+        params = ()
+        if day:
+            start = datetime.datetime.strptime(day, "%Y-%m-%d")
+            query += " WHERE timestamp >= ? AND timestamp < ?"
+            params = (start.timestamp(), (start + datetime.timedelta(days=1)).timestamp())
+        with self._lock:
+            rows = self._conn.execute(query + f" GROUP BY {dimension}", params).fetchall()
+        return {str(value): count for value, count in rows}
+
+
+class MemoryStore(IncidentStore):
+    """Volatile backend for tests and benchmarks."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = {}
+
+    def write_many(self, records):
+        with self._lock:
+            for doc_id, data in records:
+                self._records[doc_id] = dict(data)
+
+    def delete_many(self, doc_ids):
+        with self._lock:
+            for doc_id in doc_ids:
+                self._records.pop(doc_id, None)
+
+    def recent(self, limit=5):
+        with self._lock:
+            items = heapq.nlargest(limit, self._records.items(), key=lambda kv: last_seen(kv[1]))
+        return [dict(data, id=doc_id) for doc_id, data in items]
+
+    def since(self, timestamp, limit=500):
+        with self._lock:
+            items = [(doc_id, data) for doc_id, data in self._records.items() if last_seen(data) >= timestamp]
+        items = heapq.nsmallest(limit, items, key=lambda kv: last_seen(kv[1]))
+        return [dict(data, id=doc_id) for doc_id, data in items]
+
+    def count_by(self, dimension, day=None):
+        totals = {}
+        with self._lock:
+            for data in self._records.values():
+                if day and day_key(data["timestamp"]) != day:
+                    continue
+                value = str(data.get(dimension))
+                totals[value] = totals.get(value, 0) + 1
+        return totals
+
+
+STORE_BACKENDS = {
+    "firestore": FirestoreStore,
+    "sqlite": SQLiteStore,
+    "memory": MemoryStore,
+}
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def create_store(backend=None):
+    """Returns the process-wide store for `backend` (defaults to Config.STORAGE_BACKEND)."""
+    backend = backend or Config.STORAGE_BACKEND
+    if backend not in STORE_BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND '{backend}'. Choose from: {', '.join(STORE_BACKENDS)}")
+    with _stores_lock:
+        if backend not in _stores:
+            _stores[backend] = STORE_BACKENDS[backend]()
+            logger.info(f"Storage backend: {backend}")
+        return _stores[backend]
+
+
+def is_shared_store(store):
+    """True if `store` is one of the process-wide stores returned by create_store()."""
+    with _stores_lock:
+        return any(store is shared for shared in _stores.values())
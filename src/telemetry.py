@@ -0,0 +1,265 @@
+"""
+Tracing spans and Prometheus-style metrics.
+
+    with telemetry.span("model.structured", bytes=len(image_bytes)):
+        response = ...
+
+Every span records its duration in the `agridoc_stage_seconds` histogram
+and, with TRACING_ENABLED and opentelemetry-api installed, also opens an
+OpenTelemetry span (exporters are configured the usual OTel way, e.g.
+`opentelemetry-instrument`). With both METRICS_ENABLED and
+TRACING_ENABLED off, span() returns a shared no-op object.
+
+Metrics are exposed as Prometheus text by render_prometheus() (the API
+serves it at GET /metrics) or logged every METRICS_LOG_INTERVAL seconds.
+"""
+import bisect
+import functools
+import logging
+import threading
+import time
+
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (16e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500)
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, **labels):
+        series = self._series.get(tuple(sorted(labels.items())))
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + ("+Inf",), series[:-1]):
+                    cumulative += n
+                    lines.append(f"{self.name}_bucket{_label_text(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{self.name}_sum{_label_text(key)} {series[-1]}")
+                lines.append(f"{self.name}_count{_label_text(key)} {cumulative}")
+        return lines
+
+
+# === METRICS ===
+STAGE_SECONDS = Histogram("agridoc_stage_seconds", "Latency of each diagnosis stage.")
+MODEL_REQUEST_BYTES = Histogram("agridoc_model_request_bytes", "Image bytes sent per model call.", BYTES_BUCKETS)
+MODEL_TOKENS = Counter("agridoc_model_tokens_total", "Tokens reported by usage_metadata.")
+CACHE_LOOKUPS = Counter("agridoc_cache_lookups_total", "Diagnosis cache lookups by result.")
+KNOWLEDGE_LOOKUPS = Counter("agridoc_knowledge_lookups_total", "Knowledge cache lookups (confident findings) by result.")
+STORE_WRITE_SECONDS = Histogram("agridoc_store_write_seconds", "Latency of incident store commits.")
+STORE_WRITE_BATCH = Histogram("agridoc_store_write_batch_size", "Incidents per store commit.", SIZE_BUCKETS)
+MODEL_CALL_EVENTS = Counter(
+    "agridoc_model_call_events_total", "Retries, timeouts, hedges, circuit breaker transitions and fallbacks."
+)
+
+METRICS = [STAGE_SECONDS, MODEL_REQUEST_BYTES, MODEL_TOKENS, CACHE_LOOKUPS, KNOWLEDGE_LOOKUPS, STORE_WRITE_SECONDS,
+           STORE_WRITE_BATCH, MODEL_CALL_EVENTS]
+
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# === TRACING ===
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def _get_tracer():
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                try:
+                    from opentelemetry import trace
+                    _tracer = trace.get_tracer("agridoc")
+                except ImportError:
+                    logger.warning("TRACING_ENABLED but opentelemetry-api is not installed; spans are metrics-only")
+                    _tracer = False
+    return _tracer or None
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, key, value):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("name", "attributes", "_start", "_context", "_otel")
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self._context = None
+        self._otel = None
+
+    def __enter__(self):
+        tracer = _get_tracer() if Config.TRACING_ENABLED else None
+        if tracer is not None:
+            self._context = tracer.start_as_current_span(self.name, attributes=self.attributes)
+            self._otel = self._context.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def set(self, key, value):
+        """Adds an attribute once it is known (e.g. token counts after the call)."""
+        if self._otel is not None:
+            self._otel.set_attribute(key, value)
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        if Config.METRICS_ENABLED:
+            STAGE_SECONDS.observe(elapsed, stage=self.name, status="error" if exc_type else "ok")
+        if self._context is not None:
+            return self._context.__exit__(exc_type, exc, tb)
+        return False
+
+
+def span(name, **attributes):
+    """Context manager timing one stage (see module docstring)."""
+    if not (Config.METRICS_ENABLED or Config.TRACING_ENABLED):
+        return _NOOP
+    return _Span(name, attributes)
+
+
+def timed(name):
+    """Decorator form of span()."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_stage(name, seconds):
+    """Records a stage duration measured by hand (e.g. across generator yields, where a span can't stay open)."""
+    if Config.METRICS_ENABLED:
+        STAGE_SECONDS.observe(seconds, stage=name, status="ok")
+
+
+def record_usage(response, call, current_span=None):
+    """Adds the token counts from a Gemini response's usage_metadata to MODEL_TOKENS."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None or not Config.METRICS_ENABLED:
+        return
+    for kind, field in (("prompt", "prompt_token_count"), ("output", "candidates_token_count")):
+        count = getattr(usage, field, 0) or 0
+        MODEL_TOKENS.inc(count, call=call, kind=kind)
+        if current_span is not None:
+            current_span.set(f"tokens.{kind}", count)
+
+
+def record_request_bytes(call, size):
+    if Config.METRICS_ENABLED:
+        MODEL_REQUEST_BYTES.observe(size, call=call)
+
+
+def record_cache_lookup(result):
+    """result: "hit", "near_duplicate" or "miss"."""
+    if Config.METRICS_ENABLED:
+        CACHE_LOOKUPS.inc(result=result)
+
+
+def record_knowledge_lookup(result):
+    """result: "hit" or "miss"."""
+    if Config.METRICS_ENABLED:
+        KNOWLEDGE_LOOKUPS.inc(result=result)
+
+
+def record_model_event(model, event):
+    if Config.METRICS_ENABLED:
+        MODEL_CALL_EVENTS.inc(model=model, event=event)
+
+
+def record_store_write(store, count, seconds):
+    if Config.METRICS_ENABLED:
+        backend = type(store).__name__
+        STORE_WRITE_SECONDS.observe(seconds, backend=backend)
+        STORE_WRITE_BATCH.observe(count, backend=backend)
+
+
+# === LOG EXPORTER ===
+_exporter = None
+
+
+def start_log_exporter(interval=None):
+    """Logs render_prometheus() every `interval` seconds from a daemon thread (once per process)."""
+    global _exporter
+    interval = interval or Config.METRICS_LOG_INTERVAL
+    if _exporter is not None or not interval:
+        return
+
+    def run():
+        while True:
+            time.sleep(interval)
+            logger.info("Metrics snapshot\n" + render_prometheus())
+
+    _exporter = threading.Thread(target=run, name="metrics-log-exporter", daemon=True)
+    _exporter.start()
@@ -0,0 +1,259 @@
+"""
+Tiled analysis for high-resolution field and drone images.
+
+A whole-canopy shot downscaled to IMAGE_MAX_EDGE loses the small lesions
+the model needs. analyze_tiled() cuts the full-resolution image into
+overlapping TILE_SIZE tiles, diagnoses them concurrently and merges the
+per-tile findings into one report plus a heatmap overlay.
+
+Most tiles of a field shot are soil, sky or healthy canopy, so a NumPy
+prefilter scores every tile on a TILE_PREFILTER_EDGE copy first:
+
+- plant: share of pixels with an excess-green index (2G - R - B) above PLANT_EXG
+- lesion: yellow / brown pixels (chlorosis, necrosis, rust) enclosed by
+  plant pixels (on all four sides within LESION_RADIUS), as a share of
+  the plant area. Bare soil between rows is not enclosed and does not count.
+
+Tiles under TILE_MIN_PLANT or TILE_MIN_LESION are skipped; of the rest
+at most TILE_MAX_CALLS, highest lesion share first, go to the model. If
+no tile shows lesions, the tile with the most plant material is sent
+once so the report still names the crop. Both shares come from
+summed-area tables, so scoring costs the same for any number of tiles.
+"""
+import io
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from src.analytics import SEVERITIES
+from src.config import Config
+from src import rate_limit
+from src import telemetry
+
+logger = logging.getLogger(__name__)
+
+PLANT_EXG = 20  # same vegetation threshold as the "leaf" crop in preprocess.py
+LESION_RADIUS = 10  # pixels of the prefilter copy; spots wider than twice this only count near their rim
+
+Tile = namedtuple("Tile", ["index", "box", "plant", "lesion", "selected"])
+TiledResult = namedtuple("TiledResult", ["report", "logged", "tiles", "findings", "overlay"])
+
+
+def tile_boxes(width, height, size, overlap):
+    """(left, top, right, bottom) boxes of side `size` covering the image, neighbours overlapping by `overlap`."""
+    def starts(length):
+        side = min(size, length)
+        step = max(1, int(side * (1 - overlap)))
+        positions = list(range(0, length - side + 1, step))
+        if positions[-1] != length - side:
+            positions.append(length - side)  # the last row / column ends flush with the edge
+        return positions, side
+
+    xs, w = starts(width)
+    ys, h = starts(height)
+    return [(x, y, x + w, y + h) for y in ys for x in xs]
+
+
+def _enclosed(mask, radius):
+    """Pixels with `mask` pixels within `radius` on both sides, horizontally and vertically."""
+    def both_sides(m):
+        n = m.shape[-1]
+        c = np.zeros(m.shape[:-1] + (n + 1,), dtype=np.int32)
+        np.cumsum(m, axis=-1, out=c[..., 1:])
+        idx = np.arange(n)
+        before = c[..., idx] - c[..., np.maximum(idx - radius, 0)]
+        after = c[..., np.minimum(idx + radius + 1, n)] - c[..., idx + 1]
+        return (before > 0) & (after > 0)
+
+    return both_sides(mask) & both_sides(mask.T).T
+
+
+def _box_sums(mask, boxes):
+    """Sum of `mask` inside each box, from one summed-area table."""
+    sat = np.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype=np.int64)
+    np.cumsum(np.cumsum(mask, axis=0), axis=1, out=sat[1:, 1:])
+    x0, y0, x1, y1 = boxes.T
+    return sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0]
+
+
+@telemetry.timed("tile_prefilter")
+def score_tiles(image, boxes, prefilter_edge=None):
+    """(plant share, lesion share) per box, computed on a small copy of `image`."""
+    edge = prefilter_edge or Config.TILE_PREFILTER_EDGE
+    small = image.reduce(max(1, -(-max(image.size) // edge)))  # box-filter downscale, much cheaper than a resample
+    rgb = np.asarray(small, dtype=np.int16)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    plant = (2 * g - r - b) > PLANT_EXG
+    # Yellow, brown and rust tones: red at least as strong as green and well above blue
+    lesion = (r >= g) & (r - b > 40) & (r > 80) & _enclosed(plant, LESION_RADIUS)
+
+    scale = np.array([small.width / image.width, small.height / image.height] * 2)
+    scaled = np.rint(np.asarray(boxes, dtype=np.float64) * scale).astype(np.int64)
+    scaled[:, 2] = np.maximum(scaled[:, 2], scaled[:, 0] + 1)
+    scaled[:, 3] = np.maximum(scaled[:, 3], scaled[:, 1] + 1)
+    area = (scaled[:, 2] - scaled[:, 0]) * (scaled[:, 3] - scaled[:, 1])
+    plant_px = _box_sums(plant, scaled)
+    lesion_px = _box_sums(lesion, scaled)
+    return plant_px / area, lesion_px / np.maximum(plant_px + lesion_px, 1)
+
+
+def plan_tiles(image, size=None, overlap=None, max_calls=None):
+    """Every tile of `image` with its prefilter scores; `selected` marks the ones to diagnose."""
+    size = size or Config.TILE_SIZE
+    overlap = Config.TILE_OVERLAP if overlap is None else overlap
+    max_calls = max_calls or Config.TILE_MAX_CALLS
+    boxes = tile_boxes(image.width, image.height, size, overlap)
+    plant, lesion = score_tiles(image, boxes)
+
+    candidates = np.flatnonzero((plant >= Config.TILE_MIN_PLANT) & (lesion >= Config.TILE_MIN_LESION))
+    chosen = candidates[np.argsort(-lesion[candidates], kind="stable")][:max_calls]
+    if not len(chosen) and plant.max() >= Config.TILE_MIN_PLANT:
+        chosen = [int(plant.argmax())]
+    chosen = set(int(i) for i in chosen)
+    return [
+        Tile(i, box, float(plant[i]), float(lesion[i]), i in chosen)
+        for i, box in enumerate(boxes)
+    ]
+
+
+def _tile_jpeg(tile_image):
+    tile_image.thumbnail((Config.IMAGE_MAX_EDGE, Config.IMAGE_MAX_EDGE))
+    buffer = io.BytesIO()
+    tile_image.save(buffer, format="JPEG", quality=Config.JPEG_QUALITY)
+    return buffer.getvalue()
+
+
+def diagnose_tiles(agent, image, tiles, language="English", max_concurrency=None):
+    """
+    Runs agent.find_disease() on the selected tiles concurrently, in the
+    caller's rate-limit lane. Returns [(tile, finding)]; failed tiles are
+    logged and left out.
+    """
+    selected = [t for t in tiles if t.selected]
+    crops = {t.index: image.crop(t.box) for t in selected}  # cropped here, encoded in the workers
+    lane_name = rate_limit.current_lane()
+
+    def diagnose(tile):
+        with rate_limit.lane(lane_name):
+            return agent.find_disease(_tile_jpeg(crops[tile.index]), language)
+
+    findings = []
+    with ThreadPoolExecutor(max_workers=max_concurrency or Config.BATCH_MAX_CONCURRENCY) as pool:
+        futures = {pool.submit(diagnose, tile): tile for tile in selected}
+        for future in as_completed(futures):
+            tile = futures[future]
+            try:
+                findings.append((tile, future.result()))
+            except Exception as e:
+                logger.warning(f"Tile {tile.index} failed: {e}")
+    findings.sort(key=lambda item: item[0].index)
+    return findings
+
+
+def _severity_rank(severity):
+    return SEVERITIES.index(severity) if severity in SEVERITIES else -1
+
+
+def _is_diseased(finding):
+    return finding['disease'].strip().lower() != 'healthy'
+
+
+def merge_findings(findings):
+    """
+    One merged finding per (plant, disease), most affected tiles first:
+    the most confident tile's text, the worst severity and a `tiles` count.
+    """
+    groups = {}
+    for _, finding in findings:
+        if _is_diseased(finding):
+            key = (finding['plant'].strip().lower(), finding['disease'].strip().lower())
+            groups.setdefault(key, []).append(finding)
+    merged = []
+    for group in sorted(groups.values(), key=len, reverse=True):
+        best = dict(max(group, key=lambda f: f['confidence']))
+        best['severity'] = max((f['severity'] for f in group), key=_severity_rank)
+        best['tiles'] = len(group)
+        merged.append(best)
+    return merged
+
+
+def format_tiled_report(merged, findings, tiles):
+    skipped = sum(1 for t in tiles if not t.selected)
+    lines = []
+    if merged:
+        affected = sum(1 for _, f in findings if _is_diseased(f))
+        lines.append(f"### 🛰️ Tiled scan: disease in {affected} of {len(findings)} analyzed tiles")
+    else:
+        lines.append(f"### 🛰️ Tiled scan: no disease in {len(findings)} analyzed tiles")
+    lines.append(f"{skipped} of {len(tiles)} tiles skipped by the prefilter (no plant material or no visible lesions).")
+    for result in merged:
+        remedies = "\n".join(f"{i}. {r}" for i, r in enumerate(result['remedies'], 1))
+        lines.append(
+            f"#### 🌿 {result['plant']} — {result['disease']}\n"
+            f"**{result['confidence']:.0f}%** · {result['severity']} · {result['tiles']} tile{'s' if result['tiles'] != 1 else ''}\n\n"
+            f"{result['diagnosis']}\n\n"
+            f"{remedies}"
+        )
+    if not merged and findings:
+        lines.append(findings[0][1]['diagnosis'])
+    return "\n\n".join(lines)
+
+
+def heatmap_overlay(image, findings, tiles, max_edge=1024):
+    """
+    Preview of `image` with diseased tiles tinted red by confidence x
+    severity. Tiles the prefilter skipped are dimmed.
+    """
+    preview = image.copy()
+    preview.thumbnail((max_edge, max_edge))
+    scale = preview.width / image.width
+    heat = np.zeros((preview.height, preview.width), dtype=np.float32)
+    analyzed = np.zeros(heat.shape, dtype=bool)
+    for tile, finding in findings:
+        x0, y0, x1, y1 = (int(round(v * scale)) for v in tile.box)
+        analyzed[y0:y1, x0:x1] = True
+        if _is_diseased(finding):
+            value = finding['confidence'] / 100 * (_severity_rank(finding['severity']) + 2) / (len(SEVERITIES) + 1)
+            heat[y0:y1, x0:x1] = np.maximum(heat[y0:y1, x0:x1], value)
+
+    rgb = np.asarray(preview, dtype=np.float32)
+    alpha = 0.65 * np.clip(heat, 0, 1)[..., None]
+    out = rgb * (1 - alpha) + np.array([230, 30, 30], dtype=np.float32) * alpha
+    out[~analyzed] *= 0.55
+    return Image.fromarray(out.astype(np.uint8))
+
+
+def analyze_tiled(agent, image_bytes, language="English", max_concurrency=None):
+    """
+    Tiled diagnosis of one large image. Each disease found is logged once
+    (highest confidence, worst severity), not once per tile. Returns a
+    TiledResult(report, logged, tiles, findings, overlay PIL image).
+    """
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    tiles = plan_tiles(image)
+    selected = sum(1 for t in tiles if t.selected)
+    logger.info(f"{len(tiles)} tiles, {selected} sent to the model")
+    findings = diagnose_tiles(agent, image, tiles, language, max_concurrency)
+    merged = merge_findings(findings)
+
+    logged = False
+    for result in merged:
+        if result['confidence'] > Config.LOG_CONFIDENCE_THRESHOLD:
+            args = {k: result[k] for k in ('plant', 'disease', 'confidence', 'severity')}
+            logger.warning(f"Logging outbreak: {args}")
+            agent.db.log_incident(**args)
+            logged = True
+
+    if selected and not findings:
+        report = "I split the image into tiles, but every tile failed to process. Please retry."
+    elif not selected:
+        report = "### 🛰️ Tiled scan: no plant material found\n\nTry a closer or better-lit image of the crop."
+    else:
+        report = format_tiled_report(merged, findings, tiles)
+    return TiledResult(report, logged, tiles, findings, heatmap_overlay(image, findings, tiles))
@@ -0,0 +1,220 @@
+import atexit
+import datetime
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from src import telemetry
+
+logger = logging.getLogger(__name__)
+
+# Firestore rejects WriteBatch commits with more than 500 operations
+MAX_BATCH_OPS = 500
+
+
+def _encode(data):
+    return {k: (v.isoformat() if isinstance(v, datetime.datetime) else v) for k, v in data.items()}
+
+
+def _decode(data):
+    out = dict(data)
+    for field in ("timestamp", "last_seen"):
+        if isinstance(out.get(field), str):
+            out[field] = datetime.datetime.fromisoformat(out[field])
+    return out
+
+
+def _coalesce(items):
+    """
+    One (doc_id, data, update) per document, with the latest data. A
+    document created and then updated within the batch is still a create.
+    """
+    latest = {}
+    for doc_id, data, _, update in items:
+        created = doc_id in latest and not latest[doc_id][1]
+        latest[doc_id] = (data, update and not created)
+    return [(doc_id, data, update) for doc_id, (data, update) in latest.items()]
+
+
+class IncidentWriteBuffer:
+    """
+    Write-behind buffer for incident documents.
+
+    submit() appends the record to a local spool file and returns at once;
+    a background thread commits pending records through the store's
+    write_many() (a Firestore WriteBatch, or one SQLite transaction) when
+    `batch_size` records are waiting or `flush_interval` seconds have passed.
+    Document IDs are assigned by the caller, so a replayed spool entry
+    overwrites the same document instead of creating a duplicate. Updates
+    (merged outbreaks, submitted with update=True) go through update_many()
+    and several writes to one document in a batch are coalesced into one.
+    A batch that still fails after `max_retries` is dead-lettered: its
+    futures fail, but its records stay in the spool until the next start
+    replays them (or a later write to the same document carries them).
+    """
+    def __init__(self, store, batch_size=50, flush_interval=2.0,
+                 spool_path=None, max_retries=5, backoff_base=0.5):
+        self.store = store
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_OPS))
+        self.flush_interval = flush_interval
+        self.spool_path = spool_path
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+
+        self._pending = []  # list of (doc_id, data, future, update)
+        self._inflight = {}  # doc_id -> (data, update), taken off _pending but not yet committed
+        self._failed = {}  # doc_id -> (data, update) that exhausted max_retries, kept until restart
+        # One lock guards the queue and the spool file so a compaction never
+        # drops a record that was appended while it ran
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._replay_spool()
+        self._thread = threading.Thread(target=self._run, name="incident-write-buffer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # === PUBLIC API ===
+    def submit(self, doc_id, data, update=False):
+        """Queues a document write. The returned Future resolves to doc_id once committed."""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Write buffer is closed")
+            self._append_spool(doc_id, data, update)
+            self._pending.append((doc_id, data, future, update))
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+        return future
+
+    def flush(self):
+        """Synchronously commits everything currently pending."""
+        while True:
+            items = self._take()
+            if not items:
+                return
+            self._commit(items)
+
+    def close(self):
+        """Stops the background thread and flushes what is left (registered with atexit)."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=30)
+        self.flush()
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+    def failed_count(self):
+        with self._cond:
+            return len(self._failed)
+
+    # === BACKGROUND FLUSH ===
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._pending) < self.batch_size:
+                    self._cond.wait(timeout=self.flush_interval)
+                if self._closed:
+                    return
+            items = self._take()
+            if items:
+                self._commit(items)
+
+    def _take(self):
+        with self._cond:
+            items = self._pending[:self.batch_size]
+            del self._pending[:self.batch_size]
+            for i, (doc_id, data, future, update) in enumerate(items):
+                if doc_id in self._failed:
+                    # A later write carries a dead-lettered document (and its create) along;
+                    # popped either way so the stale record is not replayed over the newer one
+                    failed_update = self._failed.pop(doc_id)[1]
+                    update = update and failed_update
+                    items[i] = (doc_id, data, future, update)
+                created = doc_id in self._inflight and not self._inflight[doc_id][1]
+                self._inflight[doc_id] = (data, update and not created)
+        return items
+
+    def _commit(self, items):
+        records = _coalesce(items)
+        attempt = 0
+        while True:
+            try:
+                start = time.perf_counter()
+                creates = [(doc_id, data) for doc_id, data, update in records if not update]
+                updates = [(doc_id, data) for doc_id, data, update in records if update]
+                if creates:
+                    self.store.write_many(creates)
+                if updates:
+                    self.store.update_many(updates)
+                telemetry.record_store_write(self.store, len(records), time.perf_counter() - start)
+                break
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    # Dead-lettered: kept in the spool and replayed on the next start
+                    logger.error(f"Batch write failed after {self.max_retries} retries: {e}")
+                    with self._cond:
+                        for doc_id, data, update in records:
+                            self._inflight.pop(doc_id, None)
+                            self._failed[doc_id] = (data, update)
+                    for _, _, future, _ in items:
+                        future.set_exception(e)
+                    return
+                delay = self.backoff_base * (2 ** (attempt - 1)) * (0.5 + random.random())
+                logger.warning(f"Batch write failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+        logger.info(f"Flushed {len(items)} incidents ({len(records)} documents)")
+        with self._cond:
+            for doc_id, _, _, _ in items:
+                self._inflight.pop(doc_id, None)
+            self._compact_spool()
+        for doc_id, _, future, _ in items:
+            future.set_result(doc_id)
+
+    # === SPOOL FILE (callers hold self._cond) ===
+    def _append_spool(self, doc_id, data, update=False):
+        if not self.spool_path:
+            return
+        with open(self.spool_path, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps({"id": doc_id, "data": _encode(data), "update": update}) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    def _compact_spool(self):
+        """Rewrites the spool so it only holds records that are not yet committed (failed ones first)."""
+        if not self.spool_path:
+            return
+        remaining = [(doc_id, data, update) for doc_id, (data, update) in self._failed.items()]
+        remaining += [(doc_id, data, update) for doc_id, (data, update) in self._inflight.items()]
+        remaining += [(doc_id, data, update) for doc_id, data, _, update in self._pending]
+        tmp_path = self.spool_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            for doc_id, data, update in remaining:
+                fh.write(json.dumps({"id": doc_id, "data": _encode(data), "update": update}) + "\n")
+        os.replace(tmp_path, self.spool_path)
+
+    def _replay_spool(self):
+        if not self.spool_path or not os.path.exists(self.spool_path):
+            return
+        replayed = 0
+        with open(self.spool_path, "r", encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn write from a crash mid-append
+                self._pending.append((entry["id"], _decode(entry["data"]), Future(), entry.get("update", False)))
+                replayed += 1
+        if replayed:
+            logger.info(f"Replaying {replayed} spooled incidents")
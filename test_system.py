@@ -1,75 +1,864 @@
 #!/usr/bin/env python3
 """
 Test script for AgriDoc Enterprise System
+
+    python test_system.py        # prints progress, exits 1 on any failure
+    python -m pytest test_system.py
+
+Every test is a plain function that raises (assert) on failure.
+test_config and test_database check the deployment environment
+(GOOGLE_API_KEY, GOOGLE_CLOUD_PROJECT or STORAGE_BACKEND); the rest run
+offline against the fake model and in-memory stores.
 """
 
 import sys
 import os
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Tests never spool to the working directory
+os.environ.setdefault("WRITE_SPOOL_PATH", "")
+
+
+def _offline_agent(**backend_options):
+    """PlantDoctorAgent on the fake model and an in-memory registry, with no cache reuse."""
+    from src.agent import PlantDoctorAgent
+    from src.backends import FakeBackend
+    from src.database import OutbreakRegistry
+    from src.storage import MemoryStore
+    agent = PlantDoctorAgent(registry=OutbreakRegistry(store=MemoryStore()), backend=FakeBackend(**backend_options))
+    agent.phash_index = None
+    return agent
+
+
+def _jpeg(seed, size=(320, 240)):
+    import io
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    buf = io.BytesIO()
+    Image.fromarray(rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
 def test_imports():
     """Test if all imports work"""
     print("🧪 Testing imports...")
-    try:
-        from src.config import Config
-        print("✅ Config import successful")
-        
-        from src.database import OutbreakRegistry
-        print("✅ Database import successful")
-        
-        from src.agent import PlantDoctorAgent
-        print("✅ Agent import successful")
-        
-        import google.generativeai as genai
-        print("✅ Gemini AI import successful")
-        
-        return True
-    except Exception as e:
-        print(f"❌ Import failed: {e}")
-        return False
+    from src.config import Config
+    print("✅ Config import successful")
+
+    from src.database import OutbreakRegistry
+    print("✅ Database import successful")
+
+    from src.agent import PlantDoctorAgent
+    print("✅ Agent import successful")
+
+    import google.generativeai as genai
+    print("✅ Gemini AI import successful")
 
 def test_config():
     """Test configuration"""
     print("\n🧪 Testing configuration...")
-    try:
-        from src.config import Config
-        Config.validate()
-        print("✅ Configuration valid")
-        print(f"   Project: {Config.PROJECT_ID}")
-        print(f"   Model: {Config.MODEL_NAME}")
-        return True
-    except Exception as e:
-        print(f"❌ Configuration error: {e}")
-        return False
+    from src.config import Config
+    Config.validate()
+    print("✅ Configuration valid")
+    print(f"   Project: {Config.PROJECT_ID}")
+    print(f"   Model: {Config.MODEL_NAME}")
 
 def test_database():
     """Test database connection"""
     print("\n🧪 Testing database...")
+    from src.database import OutbreakRegistry
+    db = OutbreakRegistry()
+    stats = db.get_recent_stats()
+    print("✅ Database connection successful")
+    print(f"   Recent stats: {len(stats)} entries")
+
+def test_agent_offline():
+    """Test the agent end-to-end against the local fake model"""
+    print("\n🧪 Testing agent (fake model)...")
+    from src.backends import FakeBackend
+    agent = _offline_agent()
+    for image in (b"sample-a", b"sample-b", b"sample-c"):
+        plant, disease, _, _ = FakeBackend.finding([{"data": image}])
+        text, logged = agent.analyze_and_act(image, "English")
+        assert disease in text, text
+        assert logged == (disease != "Healthy")
+    print("✅ Agent diagnosis and logging work offline")
+
+def test_streaming_single_call():
+    """Streaming uses the one structured call and shares its cache entry with analyze_and_act"""
+    print("\n🧪 Testing streamed diagnosis...")
+    from src.agent import _partial_json_string
+    from src.config import Config
+    assert _partial_json_string('{"plant": "Rice", "diagnosis": "Brown \\"sp', "diagnosis") == 'Brown "sp'
+    assert _partial_json_string('{"diagnosis": "caf\\u00', "diagnosis") == "caf"
+
+    mode = Config.DIAGNOSIS_MODE
+    try:
+        Config.DIAGNOSIS_MODE = "single"
+        agent = _offline_agent()
+        image = next(i for i in (b"s1", b"s2", b"s3", b"s4", b"s5")
+                     if agent.backend.finding([{"data": i}])[1] != "Healthy")
+        stream = agent.analyze_and_act_stream(image, "English")
+        chunks = list(stream)
+        assert len(chunks) > 2 and agent.backend.calls == 1, (chunks, agent.backend.calls)
+        assert stream.logged and stream.text.startswith("### 🌿")
+        assert agent.analyze_and_act(image, "English") == (stream.text, True)  # cache hit
+        assert agent.backend.calls == 1
+
+        Config.DIAGNOSIS_MODE = "two_call"  # the other A/B arm never sees single-call entries
+        assert "".join(agent.analyze_and_act_stream(image, "English")) != stream.text
+        assert agent.backend.calls == 3
+    finally:
+        Config.DIAGNOSIS_MODE = mode
+    print("✅ Streamed diagnosis: 1 model call, cached under the single-call key")
+
+
+def test_streaming_errors_and_knowledge():
+    """Streamed and non-streamed two-call reports match on a knowledge hit; failed streams are not cached"""
+    print("\n🧪 Testing streamed errors and knowledge hits...")
+    from src.backends import FakeBackend
+    from src.config import Config
+    mode, min_confidence = Config.DIAGNOSIS_MODE, Config.KNOWLEDGE_MIN_CONFIDENCE
+    try:
+        Config.DIAGNOSIS_MODE, Config.KNOWLEDGE_MIN_CONFIDENCE = "two_call", 0
+        image = next(i for i in (b"k1", b"k2", b"k3", b"k4", b"k5")
+                     if FakeBackend.finding([{"data": i}])[1] != "Healthy")
+        plant, disease = FakeBackend.finding([{"data": image}])[:2]
+        streamed, plain = _offline_agent(), _offline_agent()
+        for agent in (streamed, plain):
+            agent.knowledge.put(plant, disease, "English", "Vetted text.", ["Neem oil"])
+        stream = streamed.analyze_and_act_stream(image, "English")
+        list(stream)
+        assert stream.text == plain.analyze_and_act(image, "English")[0] == streamed.analyze_and_act(image, "English")[0]
+        assert stream.text.startswith("### 🌿") and "Vetted text." in stream.text
+
+        failing = _offline_agent()
+        failing.db.log_incident = lambda **kwargs: (_ for _ in ()).throw(RuntimeError("registry down"))
+        stream = failing.analyze_and_act_stream(image, "English")
+        assert "processing error: registry down" in "".join(stream) and stream.text.startswith("I analyzed")
+        calls = failing.backend.calls
+        failing.analyze_and_act(image, "English")
+        assert failing.backend.calls > calls  # the failed stream was not cached
+
+        Config.DIAGNOSIS_MODE = "single"
+        broken = _offline_agent()
+        broken._parse_finding_text = lambda text: {"plant": plant, "disease": disease}  # schema without remedies
+        stream = broken.analyze_and_act_stream(image, "English")
+        assert "processing error" in "".join(stream) and not stream.logged
+    finally:
+        Config.DIAGNOSIS_MODE, Config.KNOWLEDGE_MIN_CONFIDENCE = mode, min_confidence
+    print("✅ Streamed errors are reported and not cached; knowledge hits match")
+
+
+def test_diagnosis_cache():
+    """LRU and SQLite tiers: hits, eviction, TTL expiry and restart survival"""
+    print("\n🧪 Testing diagnosis cache...")
+    import tempfile
+    import time
+    from src.cache import DiagnosisCache
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cache.db")
+        cache = DiagnosisCache(max_entries=2, ttl_seconds=60, db_path=path)
+        for key in ("a", "b", "c"):
+            cache.put(key, f"report {key}", key == "b")
+        assert len(cache._memory) == 2  # "a" evicted from memory...
+        assert cache.get("a") == ("report a", False)  # ...but still on disk
+        assert DiagnosisCache(db_path=path).get("b") == ("report b", True)  # survives a restart
+
+        expiring = DiagnosisCache(ttl_seconds=1)
+        expiring.put("x", "old", False)
+        expiring._memory["x"] = ("old", False, time.time() - 5)
+        assert expiring.get("x") is None
+    print("✅ Cache tiers, eviction and TTL work")
+
+def _leaf(seed, size=(320, 240), quality=90):
+    """Smooth synthetic leaf photo; unlike noise, its perceptual hash survives resizing and re-encoding."""
+    import io
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:240, 0:320] / 40.0
+    fx, fy, phase = rng.uniform(0.3, 1.5, 3)
+    green = 120 + 80 * np.sin(fx * x + phase) * np.cos(fy * y)
+    rgb = np.stack([green * 0.5, green, green * 0.3], axis=-1).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(rgb).resize(size).save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def test_preprocess_image():
+    """Passthrough of small JPEGs, EXIF orientation, downscaling and crop sizes"""
+    print("\n🧪 Testing image preprocessing...")
+    import io
+    import numpy as np
+    from PIL import Image
+    from src.config import Config
+    from src.preprocess import EXIF_ORIENTATION, preprocess_image
+
+    def size_of(data):
+        return Image.open(io.BytesIO(data)).size
+
+    small = _jpeg(40, (320, 240))
+    assert preprocess_image(small, crop="none") == small  # already fit to send
+
+    # A portrait photo stored landscape with orientation 6 (rotate 90° clockwise)
+    buf = io.BytesIO()
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = 6
+    Image.fromarray(np.zeros((300, 400, 3), dtype=np.uint8)).save(buf, format="JPEG", exif=exif)
+    upright = preprocess_image(buf.getvalue(), crop="none")
+    assert size_of(upright) == (300, 400)
+    assert Image.open(io.BytesIO(upright)).getexif().get(EXIF_ORIENTATION, 1) == 1
+
+    large = _jpeg(41, (4000, 3000))
+    out = preprocess_image(large, max_edge=1024, crop="none")
+    assert size_of(out) == (1024, 768) and len(out) < len(large)
+    png = io.BytesIO()
+    Image.new("RGBA", (2048, 1024), (0, 128, 0, 128)).save(png, format="PNG")
+    assert size_of(preprocess_image(png.getvalue(), max_edge=1024, crop="none")) == (1024, 512)
+
+    center = preprocess_image(_jpeg(42, (1000, 800)), max_edge=2048, crop="center")
+    expected = (int(1000 * Config.IMAGE_CENTER_FRACTION), int(800 * Config.IMAGE_CENTER_FRACTION))
+    assert abs(size_of(center)[0] - expected[0]) <= 1 and abs(size_of(center)[1] - expected[1]) <= 1
+
+    # A green leaf in the middle third of a grey frame; the leaf crop keeps it plus a 5% margin
+    frame = np.full((900, 1200, 3), 128, dtype=np.uint8)
+    frame[300:600, 400:800] = (40, 160, 40)
+    buf = io.BytesIO()
+    Image.fromarray(frame).save(buf, format="JPEG", quality=95)
+    width, height = size_of(preprocess_image(buf.getvalue(), max_edge=2048, crop="leaf"))
+    assert 400 <= width <= 400 + 2 * 0.05 * 1200 + 10 and 300 <= height <= 300 + 2 * 0.05 * 900 + 10, (width, height)
+    print("✅ Passthrough, orientation, downscale and crops")
+
+
+def test_perceptual_hashes():
+    """dhash / phash tolerate re-encoding; index lookups match brute force and survive a restart"""
+    print("\n🧪 Testing perceptual hashes...")
+    import random
+    import tempfile
+    from src.phash import PerceptualIndex, dhash, hamming, phash
+    for hasher in (dhash, phash):
+        original = hasher(_leaf(1))
+        assert hamming(original, hasher(_leaf(1, size=(640, 480), quality=60))) <= 6
+        assert hamming(original, hasher(_leaf(2))) > 6
+
+    rng = random.Random(0)
+    hashes = [rng.getrandbits(64) for _ in range(2000)]
+    queries = [h ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for h in hashes[:200]]
+    queries += [rng.getrandbits(64) for _ in range(200)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "phash.idx")
+        index = PerceptualIndex(max_distance=7, path=path)
+        for i, value in enumerate(hashes):
+            index.add(value, f"k{i}")
+        for query in queries:
+            distance = min(hamming(query, h) for h in hashes)
+            found = index.nearest(query)
+            assert (found[1] if found else None) == (distance if distance <= 7 else None), (query, found, distance)
+        reloaded = PerceptualIndex(max_distance=7, path=path)
+        assert len(reloaded) == len(hashes)
+        assert all(reloaded.nearest(q) == index.nearest(q) for q in queries)
+    print("✅ Hashes robust to re-encoding; index matches brute force and reloads")
+
+
+def test_near_duplicate_modes():
+    """PHASH_MODE "reuse" serves the earlier text without claiming a registry write; "flag" calls the model"""
+    print("\n🧪 Testing near-duplicate modes...")
+    from src.config import Config
+    from src.phash import PerceptualIndex
+    mode = Config.PHASH_MODE
     try:
-        from src.database import OutbreakRegistry
-        db = OutbreakRegistry()
-        stats = db.get_recent_stats()
-        print("✅ Database connection successful")
-        print(f"   Recent stats: {len(stats)} entries")
-        return True
-    except Exception as e:
-        print(f"❌ Database error: {e}")
-        return False
+        for Config.PHASH_MODE in ("reuse", "flag"):
+            agent = _offline_agent()
+            agent.phash_index = PerceptualIndex(max_distance=Config.PHASH_MAX_DISTANCE)
+            seed = next(s for s in range(50) if agent.analyze_and_act(_leaf(s))[1])
+            text = agent.analyze_and_act(_leaf(seed))[0]
+            calls = agent.backend.calls
+            rephotographed = _leaf(seed, size=(640, 480), quality=60)
+            assert agent.find_near_duplicate(rephotographed) is not None
+            diagnosis, logged = agent.analyze_and_act(rephotographed)
+            if Config.PHASH_MODE == "reuse":
+                assert (diagnosis, logged) == (text, False) and agent.backend.calls == calls
+            else:
+                assert agent.backend.calls > calls
+    finally:
+        Config.PHASH_MODE = mode
+    print("✅ Near-duplicates reused without re-logging, or re-diagnosed when flagged")
+
+
+def test_knowledge_invalidation():
+    """Scoped invalidation keeps other versions' rows; the version is part of the diagnosis cache key"""
+    print("\n🧪 Testing knowledge invalidation...")
+    import sqlite3
+    import tempfile
+    from src.config import Config
+    from src.knowledge import KnowledgeCache
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "knowledge.db")
+        KnowledgeCache(db_path=path, version="1").put("Tomato", "Early Blight", "English", "old text", ["a"])
+        current = KnowledgeCache(db_path=path, version="2")
+        current.put("Wheat", "Rust", "English", "text", ["b"])
+        current.put("Wheat", "Rust", "Hindi", "text", ["c"])
+        assert current.invalidate(plant="wheat", language="hindi") == 1
+        rows = sqlite3.connect(path).execute("SELECT plant, language, version FROM knowledge ORDER BY plant").fetchall()
+        assert rows == [("tomato", "english", "1"), ("wheat", "english", "2")]
+        assert KnowledgeCache(db_path=path, version="1").get("Tomato", "Early Blight", "English") is not None
+
+        # A bump plus warm-up keeps the earlier version's row, so rolling back still hits
+        current.put("Tomato", "Early Blight", "English", "new text", ["a"])
+        assert KnowledgeCache(db_path=path, version="1").get("Tomato", "Early Blight", "English")["diagnosis"] == "old text"
+
+        legacy = os.path.join(directory, "legacy.db")
+        conn = sqlite3.connect(legacy)
+        conn.execute(
+            "CREATE TABLE knowledge (plant TEXT NOT NULL, disease TEXT NOT NULL, language TEXT NOT NULL, "
+            "version TEXT NOT NULL, diagnosis TEXT NOT NULL, remedies TEXT NOT NULL, source TEXT NOT NULL, "
+            "created REAL NOT NULL, PRIMARY KEY (plant, disease, language))"
+        )
+        conn.execute("INSERT INTO knowledge VALUES ('rice', 'blast', 'english', '1', 'text', '[]', 'vetted', 0)")
+        conn.commit()
+        conn.close()
+        migrated = KnowledgeCache(db_path=legacy, version="2")
+        migrated.put("Rice", "Blast", "English", "text v2", [])
+        assert KnowledgeCache(db_path=legacy, version="1").get("Rice", "Blast", "English")["diagnosis"] == "text"
+
+    agent = _offline_agent()
+    before = agent._model_key()
+    original = Config.KNOWLEDGE_VERSION
+    Config.KNOWLEDGE_VERSION = original + "-next"
+    try:
+        assert agent._model_key() != before
+    finally:
+        Config.KNOWLEDGE_VERSION = original
+    print("✅ Knowledge invalidation is scoped and versioned")
+
+
+def test_api_and_cli():
+    """HTTP API status codes and the directory CLI, on the fake model"""
+    print("\n🧪 Testing API and CLI...")
+    import asyncio
+    import io
+    import json
+    import tempfile
+    from fastapi import HTTPException, UploadFile
+    from src import api, resources
+    from src.__main__ import diagnose_directory
+
+    agent = _offline_agent()
+    saved = resources._agent, resources._registry
+    resources._agent, resources._registry = agent, agent.db
+    try:
+        result = asyncio.run(api.diagnose(file=UploadFile(io.BytesIO(_jpeg(1)), filename="leaf.jpg"),
+                                          files=None, language="English"))
+        assert set(result) == {"diagnosis", "logged"} and result["diagnosis"], result
+        try:
+            asyncio.run(api.diagnose(file=UploadFile(io.BytesIO(b"not an image"), filename="x.jpg"),
+                                     files=None, language="English"))
+            raise AssertionError("undecodable upload was accepted")
+        except HTTPException as e:
+            assert e.status_code == 400, e.status_code
+
+        with tempfile.TemporaryDirectory() as directory:
+            for i in range(3):
+                with open(os.path.join(directory, f"leaf_{i}.jpg"), "wb") as f:
+                    f.write(_jpeg(10 + i))
+            with open(os.path.join(directory, "broken.jpg"), "wb") as f:
+                f.write(b"not an image")
+            out = io.StringIO()
+            assert diagnose_directory(directory, out, agent=agent, workers=2) == (4, 1)
+            records = [json.loads(line) for line in out.getvalue().splitlines()]
+            assert sorted(r["file"] for r in records if "error" in r) == ["broken.jpg"], records
+
+            # A response that could not be parsed is an error, not a diagnosis
+            agent._run_analysis = lambda image, language: ("I analyzed the image, but encountered a processing error: x", False, False)
+            try:
+                asyncio.run(api.diagnose(file=UploadFile(io.BytesIO(_jpeg(2)), filename="leaf.jpg"),
+                                         files=None, language="English"))
+                raise AssertionError("unparseable response returned as a diagnosis")
+            except HTTPException as e:
+                assert e.status_code == 500, e.status_code
+            with open(os.path.join(directory, "leaf_9.jpg"), "wb") as f:
+                f.write(_jpeg(19))
+            os.remove(os.path.join(directory, "broken.jpg"))
+            out = io.StringIO()
+            assert diagnose_directory(directory, out, agent=agent, workers=2) == (4, 1)  # leaf_0-2 are cached
+            records = {r["file"]: r for r in map(json.loads, out.getvalue().splitlines())}
+            assert "diagnosis" not in records["leaf_9.jpg"] and "processing error" in records["leaf_9.jpg"]["error"]
+    finally:
+        resources._agent, resources._registry = saved
+    print("✅ API returns 200 / 400 / 500; CLI writes one line per image")
+
+
+def test_batch_errors_and_early_exit():
+    """Unparseable responses come back as batch errors; closing the batch early doesn't wait for the rest"""
+    print("\n🧪 Testing batch analysis...")
+    import time
+    agent = _offline_agent()
+    images = [_jpeg(300 + i) for i in range(3)]
+    run_analysis = agent._run_analysis
+    agent._run_analysis = lambda image, language: (
+        ("I analyzed the image, but encountered a processing error: bad JSON", False, False)
+        if image == images[1] else run_analysis(image, language)
+    )
+    results = sorted(agent.analyze_many(images), key=lambda r: r.index)
+    assert [r.error is None for r in results] == [True, False, True]
+    assert results[1].diagnosis is None and "processing error" in results[1].error
+
+    agent = _offline_agent(latency=0.3)
+    batch = agent.analyze_many([_jpeg(310 + i) for i in range(6)], max_concurrency=1)
+    next(batch)
+    start = time.perf_counter()
+    batch.close()
+    assert time.perf_counter() - start < 0.2  # the running call is not joined
+    time.sleep(0.5)
+    assert agent.backend.calls <= 2  # the images still queued were cancelled
+    print("✅ Batch reports parse errors and stops early")
+
+
+def test_sqlite_store():
+    """SQLite backend: schema migration, last_seen ordering, counts and outbreak updates"""
+    print("\n🧪 Testing SQLite store...")
+    import datetime
+    import sqlite3
+    import tempfile
+    from src.storage import SQLiteStore
+    day = datetime.datetime(2026, 5, 1, 9)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "incidents.db")
+        # A database from before outbreak clustering: no occurrences / last_seen / coordinates
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE incidents (id TEXT PRIMARY KEY, timestamp REAL NOT NULL, plant TEXT, "
+                     "disease TEXT, confidence REAL, severity TEXT, status TEXT)")
+        conn.execute("INSERT INTO incidents VALUES ('old', ?, 'Rice', 'Blast', 80.0, 'Low', 'OPEN')",
+                     (day.timestamp(),))
+        conn.commit()
+        conn.close()
+
+        store = SQLiteStore(path)
+        columns = {row[1] for row in store._conn.execute("PRAGMA table_info(incidents)")}
+        assert {"occurrences", "last_seen", "latitude", "longitude"} <= columns
+        old = store.recent(1)[0]
+        assert old["last_seen"] == old["timestamp"] == day and old["occurrences"] == 1
+
+        def incident(hours, plant, **extra):
+            return dict({"timestamp": day + datetime.timedelta(hours=hours), "plant": plant, "disease": "Rust",
+                         "confidence": 90.0, "severity": "Medium", "status": "OPEN"}, **extra)
+
+        store.write_many([("a", incident(1, "Wheat")), ("b", incident(2, "Wheat", latitude=17.4, longitude=78.5)),
+                          ("c", incident(24, "Maize"))])
+        assert [r["id"] for r in store.recent(10)] == ["c", "b", "a", "old"]
+        assert store.recent(10)[1]["latitude"] == 17.4 and "latitude" not in store.recent(10)[2]
+
+        # "a" absorbs a later report: it moves to the front by last_seen, counts stay per outbreak
+        store.update_many([("a", incident(1, "Wheat", severity="High", occurrences=2,
+                                          last_seen=day + datetime.timedelta(hours=30)))])
+        assert [r["id"] for r in store.recent(10)] == ["a", "c", "b", "old"]
+        assert [r["id"] for r in store.since(day + datetime.timedelta(hours=2))] == ["b", "c", "a"]
+        assert store.recent(1)[0]["occurrences"] == 2
+        assert store.count_by("plant") == {"Wheat": 2, "Maize": 1, "Rice": 1}
+        assert store.count_by("severity", day="2026-05-01") == {"High": 1, "Medium": 1, "Low": 1}
+        assert store.count_by("disease", day="2026-05-02") == {"Rust": 1}
+
+        store.delete_many(["old"])
+        assert SQLiteStore(path).count_by("disease") == {"Rust": 3}  # reopening keeps the data
+    print("✅ SQLite store migrates, orders by last report and counts outbreaks")
+
+
+def test_job_queue():
+    """Timed-out jobs keep their worker busy for admission; unreadable queued uploads are a 400"""
+    print("\n🧪 Testing job queue...")
+    import asyncio
+    import io
+    import time
+    from fastapi import HTTPException, UploadFile
+    from src import api, resources
+    from src.config import Config
+    from src.jobs import JobQueue, QueueFullError
+
+    def handler(payload, language):
+        time.sleep(1.0 if payload == b"slow" else 0.1)
+        return "ok", False
+
+    queue = JobQueue(handler, workers=2, timeout=0.15)
+    for _ in range(3):
+        assert queue.wait(queue.submit(b"fast"))["status"] == "done"  # median run time 0.1 s
+    stuck = [queue.submit(b"slow") for _ in range(2)]
+    assert [queue.wait(job_id)["status"] for job_id in stuck] == ["timeout", "timeout"]
+    assert queue.metrics()["running"] == 2  # both handlers are still running
+    try:
+        queue.submit(b"fast")  # would start only after a stuck job returns: past its timeout
+        raise AssertionError("admitted behind stuck workers")
+    except QueueFullError:
+        pass
+    time.sleep(1.0)
+    assert queue.metrics()["running"] == 0
+    queue.close()
+
+    agent = _offline_agent()
+    saved = resources._agent, resources._registry, resources._job_queue, Config.JOB_QUEUE_ENABLED
+    resources._agent, resources._registry = agent, agent.db
+    resources._job_queue = JobQueue(resources._diagnose_job, workers=1, timeout=30)
+    Config.JOB_QUEUE_ENABLED = True
+    try:
+        ok = asyncio.run(api.diagnose(file=UploadFile(io.BytesIO(_jpeg(2)), filename="leaf.jpg"),
+                                      files=None, language="English"))
+        assert ok["diagnosis"], ok
+        try:
+            asyncio.run(api.diagnose(file=UploadFile(io.BytesIO(b"not an image"), filename="x.jpg"),
+                                     files=None, language="English"))
+            raise AssertionError("undecodable upload was accepted")
+        except HTTPException as e:
+            assert e.status_code == 400, e.status_code
+    finally:
+        resources._job_queue.close()
+        resources._agent, resources._registry, resources._job_queue, Config.JOB_QUEUE_ENABLED = saved
+    print("✅ Stuck worker counted until it returns; queued bad upload -> 400")
+
+def test_write_buffer_dead_letter():
+    """A batch that exhausts its retries stays spooled through later flushes and is replayed on restart"""
+    print("\n🧪 Testing write buffer (failed batch)...")
+    import datetime
+    import tempfile
+    from src.storage import MemoryStore
+    from src.write_buffer import IncidentWriteBuffer
+
+    class FlakyStore(MemoryStore):
+        down = True
+
+        def write_many(self, items):
+            if self.down:
+                raise ConnectionError("backend unavailable")
+            super().write_many(items)
+
+    record = {"timestamp": datetime.datetime(2026, 5, 1), "plant": "Tomato", "disease": "Early Blight",
+              "confidence": 90.0, "severity": "High", "status": "OPEN"}
+    with tempfile.TemporaryDirectory() as directory:
+        spool = os.path.join(directory, "spool.jsonl")
+        store = FlakyStore()
+        buffer = IncidentWriteBuffer(store, flush_interval=60, spool_path=spool, max_retries=0)
+        lost = buffer.submit("a", record)
+        buffer.flush()
+        assert isinstance(lost.exception(), ConnectionError)
+
+        store.down = False
+        saved = buffer.submit("b", dict(record, plant="Potato"))
+        buffer.flush()
+        assert saved.result(timeout=0) == "b"
+        assert buffer.failed_count() == 1
+        assert [r["id"] for r in store.recent(10)] == ["b"]
+        buffer.close()
+
+        restarted = IncidentWriteBuffer(store, flush_interval=60, spool_path=spool)
+        restarted.flush()
+        assert sorted(r["id"] for r in store.recent(10)) == ["a", "b"]
+        assert os.path.getsize(spool) == 0
+        restarted.close()
+
+        # A newer full write of a dead-lettered document replaces it, in the spool too
+        buffer = IncidentWriteBuffer(store, flush_interval=60, spool_path=spool, max_retries=0)
+        store.down = True
+        buffer.submit("c", dict(record, severity="Low"))
+        buffer.flush()
+        store.down = False
+        buffer.submit("c", dict(record, severity="Critical"))
+        buffer.flush()
+        assert buffer.failed_count() == 0 and os.path.getsize(spool) == 0
+        buffer.close()
+        assert {r["id"]: r["severity"] for r in store.recent(10)}["c"] == "Critical"
+    print("✅ Failed batch kept in the spool and committed after restart")
+
+
+def test_firestore_counter_ids():
+    """Counter document IDs stay valid for values such as "N/A"; reconciliation only increments (no network needed)"""
+    print("\n🧪 Testing Firestore counter IDs...")
+    import datetime
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import firestore
+    from src.storage import FirestoreStore
+    store = FirestoreStore(client=firestore.Client(project="test", credentials=AnonymousCredentials()))
+    batches = []
+
+    def offline_batch():
+        batch = firestore.WriteBatch(store.client)
+        batch.commit = lambda: batches.append(batch)
+        return batch
+
+    store.client.batch = offline_batch
+    store.write_many([("a", {"timestamp": datetime.datetime(2026, 5, 1), "plant": "Tomato/Potato",
+                             "disease": "N/A", "confidence": 90.0, "severity": "High", "status": "OPEN"})])
+    assert len(batches) == 1 and len(batches[0]._write_pbs) == 7
+    refs = {store._counter_ref("plant", value, "all", 0).id for value in ("N/A", "N_A", "n/a")}
+    assert len(refs) == 3 and not any("/" in ref for ref in refs)
+
+    # Reconciliation applies only the drift, as increments, from one read_time for both collections
+    class Snapshot:
+        def __init__(self, doc_id, data):
+            self.id, self._data = doc_id, data
+            self.reference = store.collection.document(doc_id)
+
+        def to_dict(self):
+            return dict(self._data)
+
+    incident = {"timestamp": datetime.datetime(2026, 5, 1), "last_seen": datetime.datetime(2026, 5, 1),
+                "plant": "Tomato", "disease": "Rust", "severity": "High"}
+    read_times = []
+    store.collection.stream = lambda read_time=None: read_times.append(read_time) or [Snapshot("a", incident)]
+    store.counters.stream = lambda read_time=None: read_times.append(read_time) or [
+        Snapshot("c1", {"dimension": "plant", "value": "Tomato", "day": "all", "count": 3}),  # replayed twice
+        Snapshot("c2", {"dimension": "plant", "value": "Potato", "day": "all", "count": 1}),  # deleted incident
+    ] + [Snapshot(f"k{i}", {"dimension": dim, "value": str(incident[dim]), "day": day, "count": 1})
+         for i, (dim, _, day) in enumerate(store._counter_keys(incident)) if (dim, day) != ("plant", "all")]
+    batches.clear()
+    assert store.rebuild_counters() == 6
+    assert len(set(read_times)) == 1 and read_times[0] is not None
+    writes = [w for b in batches for w in b._write_pbs]
+    assert not any(w.delete for w in writes)
+    deltas = sorted((w.update.fields["value"].string_value, w.update_transforms[0].increment.integer_value)
+                    for w in writes)
+    assert deltas == [("Potato", -1), ("Tomato", -2)], deltas
+    print("✅ Values with '/' map to distinct, valid counter IDs; reconciliation applies increments")
+
+
+def test_resilience_abandoned_attempts():
+    """Timed-out attempts end in the SDK instead of holding workers; hedges need an idle worker"""
+    print("\n🧪 Testing model call timeouts and hedging...")
+    import time
+    from src.backends import FakeBackend
+    from src.resilience import AttemptPool, ResilientCaller, retryable_errors
+    backend = FakeBackend(latency=1.0)
+    pool = AttemptPool(max_workers=4)
+    caller = ResilientCaller("slow", pool, max_retries=2, backoff_base=0.01, attempt_timeout=0.1,
+                             deadline=5, hedge=False, limiter=None)
+    model = backend.json_model(None, None)
+    try:
+        caller.call(model.generate_content, [{"data": b"leaf"}])
+        raise AssertionError("slow model answered")
+    except retryable_errors():
+        pass  # CallTimeoutError, or the SDK's DeadlineExceeded if it fired first
+    time.sleep(0.1)
+    assert backend.calls == 3 and pool.in_flight() == 0, (backend.calls, pool.in_flight())
+
+    busy = AttemptPool(max_workers=1)
+    hedging = ResilientCaller("busy", busy, max_retries=0, attempt_timeout=2, deadline=5,
+                              hedge=True, hedge_min_delay=0.05, limiter=None)
+    backend = FakeBackend(latency=0.3)
+    hedging.call(backend.json_model(None, None).generate_content, [{"data": b"leaf"}])
+    assert backend.calls == 1, backend.calls  # the only worker is busy: no hedge queued behind it
+    print("✅ Abandoned attempts released their workers; no hedge without an idle worker")
+
+def test_pdf_batch():
+    """Batch PDFs render on a spawn-started pool; uploads sharing a base name keep separate ZIP members"""
+    print("\n🧪 Testing prescription PDF batch...")
+    import io
+    import zipfile
+    from src.report import pdf_name, render_zip
+    names = [pdf_name(n) for n in ("leaf.jpg", "leaf.png", "a/leaf.jpg", "leaf.jpg")]
+    items = [(name, f"### Report {i}\n\nNeem oil spray", "English") for i, name in enumerate(names)]
+    with zipfile.ZipFile(io.BytesIO(render_zip(items, workers=2))) as archive:
+        members = archive.namelist()
+        assert members == ["leaf.pdf", "leaf_2.pdf", "a_leaf.pdf", "leaf_3.pdf"], members
+        assert all(archive.read(m).startswith(b"%PDF") for m in members)
+    print("✅ 4 PDFs, 4 distinct ZIP members")
+
+def test_rate_limiter_burst():
+    """Simulate a burst of sessions against the rate limiter on a virtual clock"""
+    print("\n🧪 Testing rate limiter (synthetic burst)...")
+    import heapq
+    import random
+    from src.rate_limit import RateLimiter, LocalBucketStore, BULK, INTERACTIVE
+    rpm, tpm = 60, 60000
+    clock = [0.0]
+    limiter = RateLimiter(rpm=rpm, tpm=tpm, store=LocalBucketStore(), clock=lambda: clock[0])
+
+    # 400 calls arrive within 20 s: 3 in 4 from a bulk batch, the rest single uploads
+    rng = random.Random(7)
+    events = []
+    for i in range(400):
+        lane = INTERACTIVE if i % 4 == 0 else BULK
+        arrival = rng.uniform(0, 20)
+        heapq.heappush(events, (arrival, i, lane, arrival, rng.randint(300, 2500)))
+    grants = []
+    while events:
+        now, i, lane, arrival, tokens = heapq.heappop(events)
+        clock[0] = now
+        wait = limiter.try_acquire("model", tokens, lane)
+        if wait > 0:
+            heapq.heappush(events, (now + wait, i, lane, arrival, tokens))
+        else:
+            grants.append((now, tokens, lane, now - arrival))
+
+    # Quota holds in every 60 s window, however the burst lines up
+    times = [g[0] for g in grants]
+    for start in times:
+        window = [g for g in grants if start <= g[0] < start + 60]
+        assert len(window) <= rpm, f"{len(window)} requests in one minute"
+        assert sum(g[1] for g in window) <= tpm, "token quota exceeded"
+    delays = {lane: [g[3] for g in grants if g[2] == lane] for lane in (INTERACTIVE, BULK)}
+    mean = {lane: sum(d) / len(d) for lane, d in delays.items()}
+    assert len(grants) == 400
+    assert mean[INTERACTIVE] < mean[BULK], mean
+    print(f"✅ Quota respected; mean wait interactive {mean[INTERACTIVE]:.0f}s vs bulk {mean[BULK]:.0f}s")
+
+def test_outbreak_clustering():
+    """Repeat detections of one outbreak update a single document; compaction merges old duplicates"""
+    print("\n🧪 Testing outbreak clustering...")
+    import datetime
+    from src.database import OutbreakRegistry
+    from src.storage import MemoryStore
+    registry = OutbreakRegistry(store=MemoryStore())
+    futures = [registry.log_incident_async("Tomato", "Early Blight", 70 + i % 20, ("Low", "High")[i % 2])
+               for i in range(40)]
+    assert len({f.result() for f in futures}) == 1
+    docs = registry.store.recent(limit=10)
+    assert len(docs) == 1, f"{len(docs)} documents"
+    assert (docs[0]["occurrences"], docs[0]["confidence"], docs[0]["severity"]) == (40, 89, "High"), docs[0]
+
+    # History logged one document per detection, 3 h apart: one outbreak
+    old = datetime.datetime(2026, 1, 1)
+    registry.store.write_many([
+        (f"old{i}", {"timestamp": old + datetime.timedelta(hours=3 * i), "plant": "Rice", "disease": "Blast",
+                     "confidence": 80.0, "severity": "Medium", "status": "OPEN"})
+        for i in range(10)
+    ])
+    assert registry.compact() == (1, 9)
+    assert registry.store.count_by("disease") == {"Early Blight": 1, "Blast": 1}
+    print("✅ 40 detections -> 1 outbreak; 10 historical documents compacted into 1")
+
+def test_analytics_spikes_anchor():
+    """Spike detection looks at today, not at the day of the newest incident"""
+    print("\n🧪 Testing spike window...")
+    import datetime
+    from src.analytics import OutbreakAnalytics
+    spike_day = datetime.datetime.now().replace(hour=12, minute=0, second=0, microsecond=0) - datetime.timedelta(days=3)
+    records = [
+        {"id": f"base{d}", "timestamp": spike_day - datetime.timedelta(days=d),
+         "plant": "Tomato", "disease": "Early Blight", "severity": "Low", "confidence": 90.0}
+        for d in range(1, 8)
+    ] + [
+        {"id": f"spike{i}", "timestamp": spike_day, "plant": "Tomato", "disease": "Late Blight",
+         "severity": "High", "confidence": 90.0}
+        for i in range(5)
+    ]
+    analytics = OutbreakAnalytics()
+    analytics.append(records)
+    assert analytics.spikes() == []  # three quiet days since; the spike is not "today"
+    hits = analytics.spikes(now=spike_day)
+    assert [h["disease"] for h in hits] == ["Late Blight"] and hits[0]["today"] == 5
+    assert analytics.spikes(now=spike_day - datetime.timedelta(days=30)) == []  # later incidents are not counted
+    print("✅ Spike window anchored at now")
+
+
+def test_merged_outbreak_visibility():
+    """A report merged into an old outbreak reaches the monitor, analytics and Firestore counters"""
+    print("\n🧪 Testing merged outbreak updates downstream...")
+    import datetime
+    from src.analytics import OutbreakAnalytics
+    from src.database import OutbreakRegistry
+    from src.monitor import OutbreakMonitor
+    from src.storage import MemoryStore
+    store = MemoryStore()
+    opened = datetime.datetime.now() - datetime.timedelta(hours=3)
+    store.write("outbreak", {"timestamp": opened, "plant": "Rice", "disease": "Blast", "confidence": 80.0,
+                             "severity": "Low", "status": "OPEN", "occurrences": 1, "last_seen": opened})
+    monitor = OutbreakMonitor(store, refresh_interval=0, overlap_seconds=0)
+    analytics = OutbreakAnalytics(store, overlap_seconds=0, merge_window_seconds=86400)
+    monitor.refresh()
+    assert analytics.refresh() == 1
+
+    registry = OutbreakRegistry(store=store)
+    for _ in range(2):
+        registry.log_incident_async("Rice", "Blast", 90.0, "High").result()
+    monitor.refresh()
+    (row,) = monitor.snapshot()
+    assert (row["id"], row["occurrences"], row["severity"]) == ("outbreak", 3, "High"), row
+    assert analytics.refresh() == 2
+    assert sum(r["count"] for r in analytics.counts()) == 3
+    assert analytics.refresh() == 0  # re-reading an unchanged outbreak adds nothing
+
+    # Firestore moves the severity counters when a merge escalates it (offline client)
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import firestore
+    from src.storage import FirestoreStore
+    fs = FirestoreStore(client=firestore.Client(project="test", credentials=AnonymousCredentials()))
+    old = {"timestamp": opened, "plant": "Rice", "disease": "Blast", "severity": "Low"}
+    snapshot = type("Snapshot", (), {"id": "outbreak", "exists": True, "to_dict": lambda self: dict(old)})()
+    batches = []
+
+    def offline_batch():
+        batch = firestore.WriteBatch(fs.client)
+        batch.commit = lambda: batches.append(batch)
+        return batch
+
+    fs.client.get_all = lambda refs: [snapshot]
+    fs.client.batch = offline_batch
+    fs.update_many([("outbreak", dict(old, severity="High", occurrences=3))])
+    fs.update_many([("outbreak", dict(old, occurrences=4))])  # same values: no counter writes
+    assert [len(b._write_pbs) for b in batches] == [5, 1]
+    print("✅ Merged report visible in monitor and analytics; Firestore severity counters moved")
+
+def test_tiled_prefilter():
+    """The tiling prefilter sends only tiles with lesions on plants to the model"""
+    print("\n🧪 Testing tiled analysis prefilter...")
+    import numpy as np
+    from PIL import Image
+    from src import tiling
+    # Crop rows on soil (3 x 2 tiles of 1024 px); brown spots on the leaves of the top-left tile only
+    rgb = np.zeros((1600, 2600, 3), dtype=np.uint8)
+    rgb[:] = (120, 95, 70)
+    for x in range(0, 2600, 160):
+        rgb[:, x:x + 100] = (50, 140, 45)
+    for y in range(100, 600, 40):
+        rgb[y:y + 16, 338:354] = (150, 105, 40)
+    tiles = tiling.plan_tiles(Image.fromarray(rgb), size=1024, overlap=0.2)
+    selected = [t.box for t in tiles if t.selected]
+    assert selected == [(0, 0, 1024, 1024)], selected
+
+    rgb[100:600, 338:354] = (50, 140, 45)  # healthy: one tile, so the report still names the crop
+    assert sum(t.selected for t in tiling.plan_tiles(Image.fromarray(rgb), size=1024, overlap=0.2)) == 1
+    print(f"✅ 1 of {len(tiles)} tiles sent to the model")
+
+TESTS = [
+    test_imports,
+    test_config,
+    test_database,
+    test_agent_offline,
+    test_streaming_single_call,
+    test_streaming_errors_and_knowledge,
+    test_diagnosis_cache,
+    test_preprocess_image,
+    test_perceptual_hashes,
+    test_near_duplicate_modes,
+    test_knowledge_invalidation,
+    test_api_and_cli,
+    test_batch_errors_and_early_exit,
+    test_sqlite_store,
+    test_job_queue,
+    test_write_buffer_dead_letter,
+    test_firestore_counter_ids,
+    test_resilience_abandoned_attempts,
+    test_pdf_batch,
+    test_rate_limiter_burst,
+    test_outbreak_clustering,
+    test_analytics_spikes_anchor,
+    test_merged_outbreak_visibility,
+    test_tiled_prefilter,
+]
 
 if __name__ == "__main__":
     print("🚀 AgriDoc Enterprise System Test")
     print("=" * 40)
-    
-    # Add current directory to path
-    sys.path.append(os.path.dirname(__file__))
-    
-    results = [
-        test_imports(),
-        test_config(), 
-        test_database()
-    ]
-    
-    if all(results):
+
+    failed = []
+    for test in TESTS:
+        try:
+            test()
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {type(e).__name__}: {e}")
+            failed.append(test.__name__)
+
+    if not failed:
         print("\n🎉 ALL TESTS PASSED! System is ready for deployment.")
     else:
-        print("\n❌ SOME TESTS FAILED! Please check the errors above.")
-        sys.exit(1)
\ No newline at end of file
+        print(f"\n❌ {len(failed)} TEST(S) FAILED: {', '.join(failed)}")
+        sys.exit(1)